@@ -1,130 +1,519 @@
 import os
-import shutil
 import glob
 import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("organization_log.txt", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from hash_engine import HashEngine, new_hasher
+from content_index import ContentIndex, keep_priority
+from edited_names import edited_original, name_key
+from takeout_archives import find_archives, iter_photo_members, list_photo_members
+from plan import Plan
+from run_state import run_stage
+import metrics
+from pipeline_logging import setup_logging, file_event
+
+# Configure logging (written on a background thread, see pipeline_logging.py)
+setup_logging("organization_log.txt")
 
 DESTINATION_DIR = os.path.abspath("Unified_photos")
 ROOT_DIR = os.getcwd()
 
-def get_unique_filename(directory, filename):
+# Algorithm used to confirm that two files with the same name and size are identical
+HASH_ALGORITHM = "sha256"
+hash_engine = HashEngine(HASH_ALGORITHM, workers=2)
+
+# Number of takeout archives ingested at the same time (--from-archives)
+ARCHIVE_WORKERS = 2
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Skip files whose content is already in Unified_photos under another name or album (--dedup)
+CONTENT_DEDUP = False
+
+class AlbumNames:
     """
-    Generates a unique filename if the file already exists in the directory.
-    Renames to filename_1, filename_2, etc.
+    Names present in one destination album, built from a single listing and kept up
+    to date as files are added, with the next free _N suffix of each conflicting name.
+    Replaces an os.path.exists call per file and per suffix probe.
     """
-    name, ext = os.path.splitext(filename)
-    counter = 1
-    new_filename = filename
-    
-    while os.path.exists(os.path.join(directory, new_filename)):
+
+    def __init__(self, album_path):
+        self.names = set(os.listdir(album_path)) if os.path.isdir(album_path) else set()
+        self.next_suffix = {}
+        # exists() calls the per-file checks and the suffix probing would have made
+        self.probes_avoided = 0
+
+    def __contains__(self, filename):
+        self.probes_avoided += 1
+        return filename in self.names
+
+    def add(self, filename):
+        self.names.add(filename)
+
+    def discard(self, filename):
+        self.names.discard(filename)
+
+    def unique_name(self, filename):
+        """Returns filename, or filename_1, filename_2... the first name not taken in the album."""
+        if filename not in self.names:
+            return filename
+        name, ext = os.path.splitext(filename)
+        counter = self.next_suffix.get(filename, 1)
         new_filename = f"{name}_{counter}{ext}"
-        counter += 1
-    
-    return new_filename
+        while new_filename in self.names:
+            counter += 1
+            new_filename = f"{name}_{counter}{ext}"
+        # Kept at the free suffix: it is only taken once the file is added
+        self.next_suffix[filename] = counter
+        # The probing loop checks the name itself, then _1 up to the free suffix
+        self.probes_avoided += counter + 1
+        return new_filename
+
+class DestinationIndex:
+    """
+    AlbumNames of every destination album, each listed once on first use. Albums planned
+    on several threads share the index: the first use of an album is locked, so it is
+    listed once and every thread gets the same AlbumNames.
+    """
+
+    def __init__(self):
+        self.albums = {}
+        self.lock = threading.Lock()
+
+    def get(self, album):
+        with self.lock:
+            names = self.albums.get(album)
+            if names is None:
+                names = AlbumNames(os.path.join(DESTINATION_DIR, album))
+                self.albums[album] = names
+            return names
+
+    def probes_avoided(self):
+        return sum(names.probes_avoided for names in self.albums.values())
+
+    def discard(self, path):
+        names = self.albums.get(os.path.basename(os.path.dirname(path)))
+        if names is not None:
+            names.discard(os.path.basename(path))
+
+class IngestDedup:
+    """
+    Drops files whose content is already in Unified_photos before they are moved,
+    across all takeout parts and albums, instead of leaving them to stage 4.
+    Between two identical files, the one stage 4 would keep stays.
+    Originals that stage 2 will replace with their edited version are left alone,
+    their content is not the one that ends up in the album.
+    With a plan, files planned into Unified_photos are read where they are now,
+    and an earlier copy that loses is simply not moved.
+    """
+
+    def __init__(self, engine, sources, plan=None):
+        self.content = ContentIndex.scan(DESTINATION_DIR, engine)
+        self.plan = plan
+        if plan is not None:
+            self.content.locate = plan.source_of
+        # (album, name) of the files an edited version from any takeout part replaces
+        self.replaced = {(album, name_key(edited_original(filename))) for album, filename in sources
+                         if edited_original(filename)}
+        self.skipped = 0
+        self.replaced_copies = 0
+        self.bytes_saved = 0
+
+    def eligible(self, dest_path):
+        filename = os.path.basename(dest_path)
+        album = os.path.basename(os.path.dirname(dest_path))
+        return ContentIndex.indexed(filename) and (album, name_key(filename)) not in self.replaced
+
+    def check(self, source_path, dest_path, size, dest_index, digest=None):
+        """
+        Returns (keep_new, digest). keep_new is False when an existing copy is kept;
+        when the new file is preferred, the existing copy is deleted.
+        """
+        if not self.eligible(dest_path):
+            return True, digest
+        existing, digest = self.content.find(source_path, size, digest)
+        if existing is None:
+            return True, digest
+        if keep_priority(dest_path) < keep_priority(existing):
+            if self.plan is not None:
+                # Not moved at all if it is still in its takeout folder
+                if not self.plan.cancel(existing):
+                    self.plan.delete(existing, size)
+            else:
+                try:
+                    os.remove(existing)
+                except OSError as e:
+                    logging.error(f"Error deleting duplicate {existing}: {e}")
+                    return True, digest
+            self.content.remove(existing, size)
+            dest_index.discard(existing)
+            self.replaced_copies += 1
+            file_event("copies replaced", dest_path, f"Duplicate content: replaced {existing} with {dest_path}.",
+                       replaced=existing)
+            return True, digest
+        self.skipped += 1
+        self.bytes_saved += size
+        file_event("content duplicates skipped", source_path,
+                   f"Duplicate content: {source_path} is already in {existing}. Skipping.", existing=existing)
+        return False, digest
+
+    def added(self, dest_path, size, digest):
+        if self.eligible(dest_path):
+            self.content.add(dest_path, size, digest)
+
+    def log_totals(self):
+        logging.info(f"Duplicates by content skipped at ingest: {self.skipped} ({self.bytes_saved} bytes not moved)")
+        logging.info(f"Earlier copies replaced by a preferred one: {self.replaced_copies}")
+        logging.info(f"Bytes hashed by the content index: {self.content.bytes_hashed}")
+
+def same_filesystem(path1, path2):
+    try:
+        return os.stat(path1).st_dev == os.stat(path2).st_dev
+    except OSError:
+        return False
 
 def are_files_identical(file1, file2):
     """
-    Checks if two files are identical by comparing size.
-    (Could extend to hash check if needed, but size is a good first proxy for speed)
+    Checks if two files are identical by comparing size, then content hash.
+    Both files are hashed on the calling thread, and only when their sizes match.
     """
     try:
-        s1 = os.path.getsize(file1)
-        s2 = os.path.getsize(file2)
-        return s1 == s2
+        with metrics.active().timed("stat", files=2, syscalls=2):
+            s1 = os.path.getsize(file1)
+            s2 = os.path.getsize(file2)
     except OSError:
         return False
+    if s1 != s2:
+        return False
+    digest = hash_engine.hash_file(file1)
+    return digest is not None and digest == hash_engine.hash_file(file2)
+
+def find_google_photos_path(takeout_dir):
+    """Returns the Google Photos folder of an extracted takeout part, or None."""
+    # Locate the Google Photos folder inside
+    # It could be 'Takeout/Google Photos' or similar. 
+    # listing to be sure, catching 'Takeout' first
+    takeout_internal = os.path.join(takeout_dir, "Takeout")
+    
+    if not os.path.exists(takeout_internal):
+        logging.warning(f"Could not find 'Takeout' folder in {takeout_dir}, skipping.")
+        return None
+
+    google_photos_path = os.path.join(takeout_internal, "Google Photos")
+    # Handle potential non-breaking space issues or case sensitivity
+    # By finding the folder that looks like 'Google Photos'
+    if not os.path.exists(google_photos_path):
+         # Try to find it loosely
+         children = os.listdir(takeout_internal)
+         found = False
+         for child in children:
+             if "Google" in child and "Photos" in child:
+                 google_photos_path = os.path.join(takeout_internal, child)
+                 found = True
+                 break
+         if not found:
+             logging.warning(f"Could not find 'Google Photos' folder in {takeout_internal}, skipping.")
+             return None
+    return google_photos_path
+
+def list_source_files(google_photos_paths):
+    """Returns the (album, filename) of every file of the given Google Photos folders."""
+    sources = []
+    for google_photos_path in google_photos_paths:
+        with os.scandir(google_photos_path) as albums:
+            for album_entry in albums:
+                if album_entry.is_dir():
+                    with os.scandir(album_entry.path) as entries:
+                        sources.extend((album_entry.name, entry.name) for entry in entries)
+    return sources
+
+def plan_album_sources(sources, plan, index, content_dedup=None):
+    """
+    Plans the moves of (google_photos_path, album, copy) sources into their destination
+    albums, in order. Returns the number of duplicates skipped.
+    """
+    skipped = 0
+    for google_photos_path, album, copy in sources:
+        source_album_path = os.path.join(google_photos_path, album)
+        dest_album_path = os.path.join(DESTINATION_DIR, album)
+        if album not in index.albums and not os.path.isdir(dest_album_path):
+            plan.mkdir(dest_album_path)
+        dest_names = index.get(album)
+        
+        # Use os.scandir for better performance with many files
+        with os.scandir(source_album_path) as it:
+            for entry in it:
+                if entry.is_file():
+                    source_file = entry.path
+                    filename = entry.name
+                    dest_file = os.path.join(dest_album_path, filename)
 
-def organize_photos():
+                    # The file planned at dest_file may still be in its takeout folder
+                    if filename in dest_names and are_files_identical(source_file, plan.source_of(dest_file)):
+                        file_event("duplicates skipped", source_file,
+                                   f"Duplicate found (identical content): {filename} in {album}. Skipping.")
+                        skipped += 1
+                        continue
+
+                    # Not identical (or not there yet): rename if the name is taken
+                    new_filename = dest_names.unique_name(filename)
+                    dest_file_renamed = os.path.join(dest_album_path, new_filename)
+                    with metrics.active().timed("stat"):
+                        size = entry.stat().st_size
+
+                    if content_dedup:
+                        keep_new, digest = content_dedup.check(source_file, dest_file_renamed, size, index)
+                        if not keep_new:
+                            continue
+
+                    plan.move(source_file, dest_file_renamed, size, copy)
+                    dest_names.add(new_filename)
+                    if content_dedup:
+                        content_dedup.added(dest_file_renamed, size, digest)
+    return skipped
+
+def plan_albums_concurrently(sources_by_album, index, workers):
+    """
+    Plans each destination album on its own, on workers threads. An album's sources are
+    all handled by one worker in takeout part order: the album is locked to it, so its
+    duplicate and rename decisions are the ones a sequential run makes.
+    Returns one (plan, skipped) per album, in the given order.
+    """
+    def plan_one(sources):
+        album_plan = Plan()
+        return album_plan, plan_album_sources(sources, album_plan, index)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(plan_one, sources_by_album.values()))
+
+def organize_photos(dedup=CONTENT_DEDUP, dry_run=False, workers=1):
+    """
+    Plans every move first (names and duplicates are decided from the listings and
+    the in-memory album index), then executes the plan source folder by source folder.
+    With several workers, albums are planned and source folders moved concurrently;
+    the plan is the same as with one.
+    """
+    plan = Plan()
     if not os.path.exists(DESTINATION_DIR):
-        os.makedirs(DESTINATION_DIR)
-        logging.info(f"Created destination directory: {DESTINATION_DIR}")
+        plan.mkdir(DESTINATION_DIR)
 
     # Find all takeout directories
-    takeout_dirs = glob.glob("takeout-*")
+    # Archives with the same prefix are handled by organize_from_archives
+    takeout_dirs = [d for d in glob.glob("takeout-*") if os.path.isdir(d)]
     logging.info(f"Found {len(takeout_dirs)} takeout directories: {takeout_dirs}")
+    if not takeout_dirs:
+        logging.error("No takeout-* directory found in the current directory.")
+        return False
 
-    total_moved = 0
     total_skipped = 0
-    total_renamed = 0
 
-    for takeout_dir in takeout_dirs:
-        # Locate the Google Photos folder inside
-        # It could be 'Takeout/Google Photos' or similar. 
-        # listing to be sure, catching 'Takeout' first
-        takeout_internal = os.path.join(takeout_dir, "Takeout")
-        
-        if not os.path.exists(takeout_internal):
-            logging.warning(f"Could not find 'Takeout' folder in {takeout_dir}, skipping.")
-            continue
-
-        google_photos_path = os.path.join(takeout_internal, "Google Photos")
-        # Handle potential non-breaking space issues or case sensitivity
-        # By finding the folder that looks like 'Google Photos'
-        if not os.path.exists(google_photos_path):
-             # Try to find it loosely
-             children = os.listdir(takeout_internal)
-             found = False
-             for child in children:
-                 if "Google" in child and "Photos" in child:
-                     google_photos_path = os.path.join(takeout_internal, child)
-                     found = True
-                     break
-             if not found:
-                 logging.warning(f"Could not find 'Google Photos' folder in {takeout_internal}, skipping.")
-                 continue
+    index = DestinationIndex()
+    existing_albums = 0
+    if os.path.isdir(DESTINATION_DIR):
+        with os.scandir(DESTINATION_DIR) as entries:
+            existing_albums = sum(1 for entry in entries if entry.is_dir())
+    logging.info(f"Destination has {existing_albums} existing albums, each listed once instead of "
+                 f"one exists() check per file and per rename suffix.")
+    google_photos_paths = [path for path in map(find_google_photos_path, takeout_dirs) if path]
+    content_dedup = IngestDedup(hash_engine, list_source_files(google_photos_paths), plan) if dedup else None
 
+    # (google_photos_path, album, copy) of every source album, in takeout part order
+    sources = []
+    for google_photos_path in google_photos_paths:
         logging.info(f"Processing source: {google_photos_path}")
+
+        # Same filesystem: a plain rename, no copy fallback needed
+        copy = not same_filesystem(google_photos_path, os.path.dirname(DESTINATION_DIR))
+        if not copy:
+            logging.info("Source and destination are on the same filesystem, using direct renames.")
         
         # Iterate over albums
         albums = [d for d in os.listdir(google_photos_path) if os.path.isdir(os.path.join(google_photos_path, d))]
-        
-        for album in albums:
-            source_album_path = os.path.join(google_photos_path, album)
-            dest_album_path = os.path.join(DESTINATION_DIR, album)
-
-            if not os.path.exists(dest_album_path):
-                os.makedirs(dest_album_path)
-            
-            # Use os.scandir for better performance with many files
-            with os.scandir(source_album_path) as it:
-                for entry in it:
-                    if entry.is_file():
-                        source_file = entry.path
-                        filename = entry.name
-                        dest_file = os.path.join(dest_album_path, filename)
-
-                        if os.path.exists(dest_file):
-                            # File exists, check if identical
-                            if are_files_identical(source_file, dest_file):
-                                logging.info(f"Duplicate found (identical size): {filename} in {album}. Skipping.")
-                                total_skipped += 1
-                            else:
-                                # Not identical, rename
-                                new_filename = get_unique_filename(dest_album_path, filename)
-                                dest_file_renamed = os.path.join(dest_album_path, new_filename)
-                                shutil.move(source_file, dest_file_renamed)
-                                logging.info(f"Conflict (diff size): Moved {filename} to {new_filename} in {album}.")
-                                total_renamed += 1
-                                total_moved += 1
-                        else:
-                            # Move file
-                            shutil.move(source_file, dest_file)
-                            total_moved += 1
+        sources.extend((google_photos_path, album, copy) for album in albums)
+
+    if workers > 1 and content_dedup is None:
+        # Destination albums are independent of each other, the sources of one are planned in order.
+        # Names differing only in case or Unicode form share a worker, they may be the same folder.
+        sources_by_album = {}
+        for source in sources:
+            sources_by_album.setdefault(name_key(source[1]).casefold(), []).append(source)
+        logging.info(f"Planning {len(sources_by_album)} albums on {workers} threads.")
+        for album_plan, skipped in plan_albums_concurrently(sources_by_album, index, workers):
+            plan.merge(album_plan)
+            total_skipped += skipped
+    else:
+        # The content index spans every album: --dedup decides in one pass, in part order
+        total_skipped += plan_album_sources(sources, plan, index, content_dedup)
+
+    moves = plan.operations("move")
+    total_moved = len(moves)
+    total_renamed = sum(1 for op in moves if os.path.basename(op.src) != os.path.basename(op.dst))
+    plan.log_summary("Plan")
+    if dry_run:
+        plan.print_plan()
+    else:
+        for op, error in plan.execute(workers=workers):
+            if error:
+                logging.error(f"Error moving {op.src}: {error}")
+                if op.kind == "move":
+                    total_moved -= 1
+            elif op.kind == "mkdir" and op.src == DESTINATION_DIR:
+                logging.info(f"Created destination directory: {DESTINATION_DIR}")
+            elif op.kind == "move" and os.path.basename(op.src) != os.path.basename(op.dst):
+                album = os.path.basename(os.path.dirname(op.dst))
+                file_event("renamed on conflict", op.dst, f"Conflict (diff content): Moved {os.path.basename(op.src)} to "
+                           f"{os.path.basename(op.dst)} in {album}.", source=op.src)
 
+    log_totals(total_moved, total_renamed, total_skipped)
+    if content_dedup:
+        content_dedup.log_totals()
+    logging.info(f"exists() calls avoided by the album name index: {index.probes_avoided()}")
+
+def log_totals(total_moved, total_renamed, total_skipped):
     logging.info("="*30)
     logging.info("PROCESSING COMPLETE")
     logging.info(f"Total files moved: {total_moved}")
     logging.info(f"Total files renamed (conflicts kept): {total_renamed}")
     logging.info(f"Total duplicates skipped: {total_skipped}")
 
+class ArchiveIngest:
+    """
+    Streams the Google Photos members of takeout archives straight into
+    Unified_photos, so every byte is written once and nothing has to be extracted first.
+    Each member is written to a temporary file in its destination album while being
+    hashed, then the same duplicate/rename rules as organize_photos decide its final name.
+    """
+
+    def __init__(self, dedup=CONTENT_DEDUP, sources=()):
+        self.lock = threading.Lock()
+        self.album_locks = {}
+        self.index = DestinationIndex()
+        # Content decisions span albums, so they are made one at a time
+        self.content_dedup = IngestDedup(hash_engine, sources) if dedup else None
+        self.dedup_lock = threading.Lock()
+        self.total_moved = 0
+        self.total_skipped = 0
+        self.total_renamed = 0
+
+    def album_lock(self, album):
+        if self.content_dedup:
+            return self.dedup_lock
+        with self.lock:
+            return self.album_locks.setdefault(album, threading.Lock())
+
+    def ingest_member(self, album, filename, mtime, fileobj):
+        dest_album_path = os.path.normpath(os.path.join(DESTINATION_DIR, album))
+        # Never write outside Unified_photos, whatever the member name holds
+        dest_path = os.path.normpath(os.path.join(dest_album_path, filename))
+        if (os.path.dirname(dest_path) != dest_album_path or dest_album_path == DESTINATION_DIR
+                or os.path.commonpath([DESTINATION_DIR, dest_album_path]) != DESTINATION_DIR):
+            logging.error(f"Skipping archive member {album}/{filename}: not a file of an album of {DESTINATION_DIR}.")
+            return
+        os.makedirs(dest_album_path, exist_ok=True)
+
+        hasher = new_hasher(hash_engine.algorithm)
+        size = 0
+        fd, temp_path = tempfile.mkstemp(prefix=".ingest-", dir=dest_album_path)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: fileobj.read(COPY_BUFFER_SIZE), b""):
+                    hasher.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            os.utime(temp_path, (mtime, mtime))
+
+            # Decisions about names in an album must not interleave between archives
+            with self.album_lock(album):
+                with self.lock:
+                    dest_names = self.index.get(album)
+                dest_file = os.path.join(dest_album_path, filename)
+                digest = hasher.hexdigest()
+                if filename in dest_names and os.path.getsize(dest_file) == size and hash_engine.hash_file(dest_file) == digest:
+                    os.remove(temp_path)
+                    file_event("duplicates skipped", dest_file,
+                               f"Duplicate found (identical content): {filename} in {album}. Skipping.")
+                    with self.lock:
+                        self.total_skipped += 1
+                    return
+
+                # Not identical (or not there yet): rename if the name is taken
+                new_filename = dest_names.unique_name(filename)
+                dest_file = os.path.join(dest_album_path, new_filename)
+
+                if self.content_dedup:
+                    keep_new, _ = self.content_dedup.check(temp_path, dest_file, size, self.index, digest)
+                    if not keep_new:
+                        os.remove(temp_path)
+                        return
+
+                os.rename(temp_path, dest_file)
+                dest_names.add(new_filename)
+                renamed = new_filename != filename
+                if renamed:
+                    file_event("renamed on conflict", dest_file,
+                               f"Conflict (diff content): Moved {filename} to {new_filename} in {album}.")
+                with self.lock:
+                    self.total_renamed += renamed
+                    self.total_moved += 1
+                if self.content_dedup:
+                    self.content_dedup.added(dest_file, size, digest)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def ingest_archive(self, archive_path):
+        logging.info(f"Processing archive: {archive_path}")
+        try:
+            for album, filename, mtime, fileobj in iter_photo_members(archive_path):
+                self.ingest_member(album, filename, mtime, fileobj)
+        except Exception as e:
+            logging.error(f"Error reading archive {archive_path}: {e}")
+
+def organize_from_archives(workers=ARCHIVE_WORKERS, dedup=CONTENT_DEDUP):
+    if not os.path.exists(DESTINATION_DIR):
+        os.makedirs(DESTINATION_DIR)
+        logging.info(f"Created destination directory: {DESTINATION_DIR}")
+
+    archives = find_archives()
+    logging.info(f"Found {len(archives)} takeout archives: {archives}")
+    if not archives:
+        logging.error("No takeout-* archive found in the current directory.")
+        return False
+
+    sources = []
+    if dedup:
+        # Member names only, to know which originals have an edited version
+        for archive_path in archives:
+            sources.extend(list_photo_members(archive_path))
+    ingest = ArchiveIngest(dedup=dedup, sources=sources)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        list(pool.map(ingest.ingest_archive, archives))
+
+    log_totals(ingest.total_moved, ingest.total_renamed, ingest.total_skipped)
+    if ingest.content_dedup:
+        ingest.content_dedup.log_totals()
+
 if __name__ == "__main__":
-    organize_photos()
+    parser = argparse.ArgumentParser(description="Merge the albums of all takeout parts into Unified_photos.")
+    parser.add_argument("--from-archives", action="store_true",
+                        help="read takeout-*.zip / .tgz archives directly instead of extracted folders")
+    parser.add_argument("--workers", type=int, default=ARCHIVE_WORKERS,
+                        help="number of archives ingested concurrently (--from-archives), "
+                             "or of albums planned and source folders moved concurrently")
+    parser.add_argument("--dedup", action="store_true",
+                        help="skip files whose content is already in Unified_photos under any name or album")
+    parser.add_argument("--restart", action="store_true", help="run again even if a previous run completed this stage")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the planned moves (extracted folders only)")
+    args = parser.parse_args()
+    # An interrupted run simply continues: the files already moved are no longer in the sources
+    if args.dry_run:
+        organize_photos(dedup=args.dedup, dry_run=True, workers=args.workers)
+    elif args.from_archives:
+        run_stage("1_organize_photos", organize_from_archives, restart=args.restart,
+                  workers=args.workers, dedup=args.dedup)
+    else:
+        run_stage("1_organize_photos", organize_photos, restart=args.restart, dedup=args.dedup, workers=args.workers)
@@ -1,56 +1,99 @@
 import os
 import logging
+import argparse
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("cleanup_log.txt", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from inventory import Inventory
+from edited_names import EDITED_SUFFIXES, edited_matcher, edited_original, name_key
+from plan import Plan
+from run_state import run_stage
+from pipeline_logging import setup_logging, file_event
+
+# Configure logging (written on a background thread, see pipeline_logging.py)
+setup_logging("cleanup_log.txt")
 
 TARGET_DIR = os.path.abspath("Unified_photos")
 
-def cleanup_modified_files():
+def plan_cleanup_modified(inventory, matcher=None):
+    """
+    Returns the plan replacing every original with its edited version (any suffix of
+    edited_names.EDITED_SUFFIXES, or of matcher), or renaming the edited version when
+    the original is missing. When an original has several edited versions (e.g.
+    "-edited" and "-modifié", or one name in two Unicode forms), the most recently
+    modified one is used and the others are left in place.
+    """
+    matcher = matcher or edited_matcher()
+    plan = Plan()
+
+    for root, files in inventory.walk():
+        # Planned names of the folder, from its listing: name_key(name) -> name
+        names = {name_key(filename): filename for filename, _ in files}
+        # name_key(original) -> (filename, stats) of the edited version that replaces it
+        chosen = {}
+        for filename, stats in files:
+            original_filename = edited_original(filename, matcher)
+            if original_filename is None:
+                continue
+            key = name_key(original_filename)
+            current = chosen.get(key)
+            if current is None or (stats.st_mtime, filename) > (current[1].st_mtime, current[0]):
+                chosen[key] = (filename, stats)
+
+        for filename, stats in files:
+            # Only a suffix right before the extension counts, e.g. "IMG_1234-modifié.jpg"
+            original_filename = edited_original(filename, matcher)
+            if original_filename is None:
+                continue
+
+            modified_file_path = os.path.join(root, filename)
+            kept = chosen[name_key(original_filename)][0]
+            if kept != filename:
+                logging.warning(f"{filename} and {kept} in {root} are both edited versions of {original_filename}: "
+                                f"the most recent one ({kept}) replaces it, {filename} is left as it is.")
+                continue
+            # The original keeps its own spelling if it exists in another Unicode form
+            existing = names.get(name_key(original_filename))
+            if existing is not None:
+                # Atomic: the original is never missing, even if the run is interrupted
+                plan.replace(modified_file_path, os.path.join(root, existing), stats.st_size)
+            else:
+                existing = original_filename
+                plan.rename(modified_file_path, os.path.join(root, existing), stats.st_size)
+            names.pop(name_key(filename), None)
+            names[name_key(existing)] = existing
+    return plan
+
+def cleanup_modified_files(inventory=None, dry_run=False, suffixes=EDITED_SUFFIXES):
     if not os.path.exists(TARGET_DIR):
         logging.error(f"Target directory {TARGET_DIR} does not exist.")
-        return
+        return False
+
+    if inventory is None:
+        inventory = Inventory.scan(TARGET_DIR)
 
     count_replaced = 0
     count_renamed = 0
     count_errors = 0
 
-    for root, dirs, files in os.walk(TARGET_DIR):
-        for filename in files:
-            # Check for pattern *-modifié.*
-            # Be careful not to match files that just happen to have modified in the name but not as a suffix before extension
-            # But the user said "suffixés en -modifié", so we look for that exact ending before extension.
-            
-            name, ext = os.path.splitext(filename)
-            if name.endswith("-modifié"):
-                original_name_base = name[:-len("-modifié")]
-                original_filename = original_name_base + ext
-                
-                modified_file_path = os.path.join(root, filename)
-                original_file_path = os.path.join(root, original_filename)
-                
-                try:
-                    if os.path.exists(original_file_path):
-                        # Delete original, rename modified to original
-                        os.remove(original_file_path)
-                        os.rename(modified_file_path, original_file_path)
-                        logging.info(f"Replaced: {original_filename} with {filename}")
-                        count_replaced += 1
-                    else:
-                        # Just rename modified to original
-                        os.rename(modified_file_path, original_file_path)
-                        logging.info(f"Renamed: {filename} to {original_filename} (original missing)")
-                        count_renamed += 1
-                except OSError as e:
-                    logging.error(f"Error processing {filename}: {e}")
-                    count_errors += 1
+    plan = plan_cleanup_modified(inventory, edited_matcher(suffixes))
+    plan.log_summary("Plan")
+    if dry_run:
+        plan.print_plan()
+        return
+
+    for op, error in plan.execute():
+        if error:
+            logging.error(f"Error processing {os.path.basename(op.src)}: {error}")
+            count_errors += 1
+            continue
+        inventory.renamed(op.src, op.dst)
+        filename = os.path.basename(op.src)
+        original_filename = os.path.basename(op.dst)
+        if op.kind == "replace":
+            file_event("replaced", op.dst, f"Replaced: {original_filename} with {filename}")
+            count_replaced += 1
+        else:
+            file_event("renamed", op.dst, f"Renamed: {filename} to {original_filename} (original missing)")
+            count_renamed += 1
 
     logging.info("="*30)
     logging.info(f"Total replaced: {count_replaced}")
@@ -58,4 +101,14 @@ def cleanup_modified_files():
     logging.info(f"Errors: {count_errors}")
 
 if __name__ == "__main__":
-    cleanup_modified_files()
+    parser = argparse.ArgumentParser(description="Replace originals with their edited (-modifié, -edited...) versions.")
+    parser.add_argument("--restart", action="store_true", help="run again even if a previous run completed this stage")
+    parser.add_argument("--dry-run", action="store_true", help="only print the planned renames and replaces")
+    parser.add_argument("--suffix", action="append", default=[],
+                        help="also treat files ending with this suffix (before the extension) as edited copies")
+    args = parser.parse_args()
+    suffixes = EDITED_SUFFIXES + tuple(args.suffix)
+    if args.dry_run:
+        cleanup_modified_files(dry_run=True, suffixes=suffixes)
+    else:
+        run_stage("2_cleanup_modified", cleanup_modified_files, restart=args.restart, suffixes=suffixes)
@@ -1,121 +1,125 @@
 import os
+import re
 import json
-import glob
 import logging
 import time
-from ctypes import windll, Structure, byref, c_longlong, c_int, create_unicode_buffer
-from ctypes.wintypes import HANDLE, DWORD, LPVOID
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("metadata_update_log.txt", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from inventory import Inventory
+from sidecar_index import SidecarReport
+from timestamps import select_backend, BACKENDS
+from catalog import MediaCatalog
+from embedded_dates import embedded_date, DATE_EXTENSIONS
+from run_state import RunState, run_stage
+import metrics
+from pipeline_logging import setup_logging, file_event
+
+# Configure logging (written on a background thread, see pipeline_logging.py)
+setup_logging("metadata_update_log.txt")
 
 TARGET_DIR = os.path.abspath("Unified_photos")
+# Lists media files without a sidecar and ambiguous sidecar matches
+SIDECAR_REPORT_PATH = os.path.abspath("sidecar_report.txt")
+# Dates of every media file, used by 5_filter_by_date.py instead of the file timestamps
+CATALOG_PATH = os.path.abspath("media_catalog.sqlite")
+# Name of this stage in pipeline_state.sqlite, where finished files are checkpointed
+STAGE = "3_update_metadata"
+
+# Sidecars are read and timestamps applied on a pool of threads, which mostly wait on I/O.
+# QUEUE_DEPTH bounds how many files are in flight at once.
+METADATA_WORKERS = 8
+QUEUE_DEPTH = 64
 
-# Windows API Structures
-class FILETIME(Structure):
-    _fields_ = [("dwLowDateTime", DWORD),
-                ("dwHighDateTime", DWORD)]
+# Extracts "<field>": {... "timestamp": "1560000000" ...} without parsing the rest of the sidecar
+TIMESTAMP_FIELD = re.compile(
+    r'"(creationTime|modificationTime|photoTakenTime)"\s*:\s*\{[^{}]*?"timestamp"\s*:\s*"?([^",}\s]+)"?'
+)
+
+# Windows SetFileTime or POSIX os.utime, picked for the running platform
+backend = select_backend()
 
 def set_file_creation_time(path, timestamp):
     """
-    Sets the creation time of a file on Windows.
+    Sets the creation time of a file (where the backend supports it).
     Timestamp is a unix timestamp (seconds since epoch).
     """
     try:
-        # Convert unix timestamp to Windows FileTime (100-nanosecond intervals since Jan 1, 1601)
-        # Unix epoch (Jan 1 1970) is 116444736000000000 intervals after Windows epoch
-        windows_ticks = int((timestamp * 10000000) + 116444736000000000)
-        
-        ft = FILETIME()
-        ft.dwLowDateTime = windows_ticks & 0xFFFFFFFF
-        ft.dwHighDateTime = windows_ticks >> 32
-        
-        # Open file
-        handle = windll.kernel32.CreateFileW(
-            path, 
-            256, # GENERIC_WRITE (0x40000000) -> using 256 for FILE_WRITE_ATTRIBUTES equivalent logic
-            0, 
-            None, 
-            3, # OPEN_EXISTING 
-            128, # FILE_ATTRIBUTE_NORMAL
-            None
-        )
-        
-        if handle == -1:
-            logging.warning(f"Failed to open file handle for {path}")
-            return False
-
-        # SetFileTime(handle, creation_time, access_time, write_time)
-        # We only strictly care about creation time here as os.utime handles the rest, 
-        # but os.utime might be more stable for access/write.
-        # Let's try to set all three to be consistent if strict sync is seemingly desired?
-        # User said: "date de création du fichier ... et la date de prise de vue"
-        # Since we use os.utime later for mod/access, we can just pass ft for all or just creation.
-        # Passing None (0 pointer) leaves it unchanged.
-        
-        result = windll.kernel32.SetFileTime(handle, byref(ft), None, None)
-        windll.kernel32.CloseHandle(handle)
-        
-        if result == 0:
-            logging.warning(f"SetFileTime failed for {path}")
-            return False
-            
-        return True
-        
+        return backend.apply(path, timestamp, None, None)
     except Exception as e:
         logging.error(f"Error setting creation time for {path}: {e}")
         return False
 
-def find_json_file(file_path):
+def find_json_file(file_path, inventory, report=None):
     """
     Attempts to find the associated JSON file for a given file path.
-    Handles standard naming and truncated extensions.
+    Handles standard naming, truncated names and "(1)" numbering.
+    Resolved from the folder's sidecar index, without touching the disk.
     """
-    candidates = [
-        file_path + ".json",
-        file_path + ".supplemental-metadata.json"
-    ]
-    
-    for cand in candidates:
-        if os.path.exists(cand):
-            return cand
-            
-    directory = os.path.dirname(file_path)
-    pattern = glob.escape(file_path) + ".*.json"
-    matches = glob.glob(pattern)
-    
-    if matches:
-        return matches[0]
-        
-    return None
+    directory, filename = os.path.split(file_path)
+    json_name, candidates = inventory.sidecar_index(directory).lookup(filename)
+
+    if report is not None:
+        if json_name is None:
+            report.unmatched.append(file_path)
+        elif len(candidates) > 1:
+            report.ambiguous.append((file_path, candidates))
+
+    if json_name is None:
+        return None
+    return os.path.join(directory, json_name)
+
+def read_sidecar_timestamps(json_path):
+    """
+    Returns the raw {field: timestamp string} of creationTime, modificationTime and photoTakenTime.
+    Only these fields are scanned; the full JSON parser is used only if none of them is found,
+    so unusual layouts behave exactly as before.
+    """
+    start = time.perf_counter()
+    with open(json_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+
+    fields = {}
+    for match in TIMESTAMP_FIELD.finditer(content):
+        fields.setdefault(match.group(1), match.group(2))
+    # open, fstat, read until the end, close
+    metrics.active().record("parse", time.perf_counter() - start, bytes_read=len(content), syscalls=5)
+    if fields:
+        return fields
+
+    data = json.loads(content)
+    for field in ("creationTime", "modificationTime", "photoTakenTime"):
+        if field in data and "timestamp" in data[field]:
+            fields[field] = data[field]["timestamp"]
+    return fields
 
-def update_file_timestamp(file_path, json_path):
+def update_file_timestamp(file_path, json_path, dir_fd=None):
+    return apply_sidecar(file_path, json_path, dir_fd)[0]
+
+def apply_sidecar(file_path, json_path, dir_fd=None):
+    """
+    Applies the sidecar timestamps to a file.
+    Returns (updated, (creation, modification, taken)); the timestamps are None if the sidecar could not be read.
+    """
+    times = None
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        fields = read_sidecar_timestamps(json_path)
             
         ts_creation = None      # JSON creationTime -> Windows Creation Date
         ts_modification = None  # JSON modificationTime -> Windows Modification Date
         ts_taken = None         # JSON photoTakenTime -> Windows Access Date (compromise)
         
         # 1. Parse creationTime
-        if "creationTime" in data and "timestamp" in data["creationTime"]:
-            ts_creation = float(data["creationTime"]["timestamp"])
+        if "creationTime" in fields:
+            ts_creation = float(fields["creationTime"])
         
         # 2. Parse modificationTime
-        if "modificationTime" in data and "timestamp" in data["modificationTime"]:
-             ts_modification = float(data["modificationTime"]["timestamp"])
+        if "modificationTime" in fields:
+             ts_modification = float(fields["modificationTime"])
         
         # 3. Parse photoTakenTime
-        if "photoTakenTime" in data and "timestamp" in data["photoTakenTime"]:
-             ts_taken = float(data["photoTakenTime"]["timestamp"])
+        if "photoTakenTime" in fields:
+             ts_taken = float(fields["photoTakenTime"])
 
         # Fallbacks to ensure we don't leave fields at current (extraction) time if any info exists
         # If user specific mapping is missing, we propagate available info
@@ -125,90 +129,179 @@ def update_file_timestamp(file_path, json_path):
             ts_modification = ts_creation
         if not ts_taken:
             ts_taken = ts_creation
+        times = (ts_creation, ts_modification, ts_taken)
 
         if ts_creation or ts_modification or ts_taken:
-            # Update via Windows API
-            # Convert unix timestamps to Windows FileTime
-            # (Logic remains same, but we set all three)
-            
-            def to_ft(ts):
-                if not ts: return None
-                ticks = int((ts * 10000000) + 116444736000000000)
-                ft = FILETIME()
-                ft.dwLowDateTime = ticks & 0xFFFFFFFF
-                ft.dwHighDateTime = ticks >> 32
-                return ft
-
-            ft_creation = to_ft(ts_creation)
-            ft_modification = to_ft(ts_modification)
-            ft_taken = to_ft(ts_taken)
-
-            # Open file
-            handle = windll.kernel32.CreateFileW(file_path, 256, 0, None, 3, 128, None)
-            if handle != -1:
-                # SetFileTime(handle, lpCreationTime, lpLastAccessTime, lpLastWriteTime)
-                # Note: Windows Explorer often shows 'Date' based on EXIF, 
-                # but if we follow user's mapping:
-                # Creation -> creationTime
-                # Modification -> modificationTime
-                # Access -> photoTakenTime (using this as it's the 3rd available slot)
-                windll.kernel32.SetFileTime(
-                    handle, 
-                    byref(ft_creation) if ft_creation else None,
-                    byref(ft_taken) if ft_taken else None,
-                    byref(ft_modification) if ft_modification else None
-                )
-                windll.kernel32.CloseHandle(handle)
-                
-                logging.info(f"Updated {os.path.basename(file_path)}: Creation={ts_creation}, Mod={ts_modification}, Taken(Access)={ts_taken}")
-                return True
-            else:
-                logging.warning(f"Failed to open file handle for {file_path}")
-                return False
+            # Creation -> creationTime, Modification -> modificationTime,
+            # Access -> photoTakenTime (see timestamps.py for the per-platform mapping)
+            with metrics.active().timed("utime"):
+                applied = backend.apply(file_path, ts_creation, ts_modification, ts_taken, dir_fd=dir_fd)
+            if applied:
+                file_event("updated", file_path,
+                           f"Updated {os.path.basename(file_path)}: Creation={ts_creation}, Mod={ts_modification}, Taken(Access)={ts_taken}",
+                           creation=ts_creation, modification=ts_modification, taken=ts_taken)
+                return True, times
+            return False, times
         else:
             logging.warning(f"No valid timestamps found in {os.path.basename(json_path)}")
-            return False
+            return False, times
             
     except Exception as e:
         logging.error(f"Error processing {file_path} with {json_path}: {e}")
-        return False
+        return False, times
+
+def apply_embedded_date(file_path, dir_fd=None):
+    """
+    Applies the date stored in a file without a sidecar (EXIF DateTimeOriginal, MP4/MOV creation
+    time) to its three timestamps. Returns (updated, times) like apply_sidecar; times is None
+    if the file has no readable date.
+    """
+    timestamp = embedded_date(file_path)
+    if timestamp is None:
+        return False, None
+    with metrics.active().timed("utime"):
+        applied = backend.apply(file_path, timestamp, timestamp, timestamp, dir_fd=dir_fd)
+    if applied:
+        file_event("updated from embedded date", file_path,
+                   f"Updated {os.path.basename(file_path)} from its embedded date: {timestamp}",
+                   taken=timestamp)
+    return applied, (timestamp, timestamp, timestamp)
 
-def main():
+def main(inventory=None, workers=METADATA_WORKERS, queue_depth=QUEUE_DEPTH, embedded_dates=True):
     if not os.path.exists(TARGET_DIR):
         logging.error(f"Target directory {TARGET_DIR} does not exist.")
-        return
+        return False
+
+    logging.info(f"Timestamp backend: {backend.name}")
+
+    if inventory is None:
+        inventory = Inventory.scan(TARGET_DIR)
 
     count_processed = 0
     count_updated = 0
     count_missing_json = 0
+    count_embedded = 0
+    count_resumed = 0
+    report = SidecarReport()
+    catalog = MediaCatalog(CATALOG_PATH)
+
+    # Files finished by an interrupted earlier run are not updated again
+    state = RunState()
+    done = state.done_items(STAGE)
+    if done:
+        logging.info(f"Resuming: {len(done)} files were already updated by the previous run.")
+    start_time = time.monotonic()
+    stage_metrics = metrics.active()
+    # Media files left to process, for the ETA
+    total = sum(1 for file_path, _ in inventory.files() if not file_path.lower().endswith(".json")) - len(done)
+
+    # Files handed to the pool, completed oldest first so results are handled in walk order
+    in_flight = deque()
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    # Folder descriptors stay open while the walk is in the folder or a file of it is in flight
+    open_dirs = {}
+
+    def release_dir(root):
+        entry = open_dirs[root]
+        entry[1] -= 1
+        if entry[1] == 0:
+            backend.close_dir(entry[0])
+            del open_dirs[root]
+
+    def complete_oldest():
+        nonlocal count_updated, count_embedded
+        file_path, root, result, from_sidecar = in_flight.popleft()
+        updated, times = result.result() if pool else result
+        if updated:
+            # Later stages read the new timestamps from the inventory
+            inventory.refresh(file_path)
+            if from_sidecar:
+                count_updated += 1
+            else:
+                count_embedded += 1
+        creation, modification, taken = times or (None, None, None)
+        rel_path = os.path.relpath(file_path, TARGET_DIR)
+        catalog.record(rel_path, taken, creation, modification)
+        state.checkpoint(STAGE, rel_path, before_commit=catalog.commit)
+        release_dir(root)
 
     # Walk through the directory
-    for root, dirs, files in os.walk(TARGET_DIR):
-        for filename in files:
+    for root, files in inventory.walk():
+        open_dirs[root] = [backend.open_dir(root), 1]
+        dir_fd = open_dirs[root][0]
+        for filename, _ in files:
             # Skip json files themselves
             if filename.lower().endswith(".json"):
                 continue
                 
             file_path = os.path.join(root, filename)
+            if done and os.path.relpath(file_path, TARGET_DIR) in done:
+                count_resumed += 1
+                continue
             
             # Find associated JSON
-            json_path = find_json_file(file_path)
+            json_path = find_json_file(file_path, inventory, report)
             
-            if json_path:
-                if update_file_timestamp(file_path, json_path):
-                    count_updated += 1
-            else:
+            if not json_path:
                 count_missing_json += 1
+            if json_path or (embedded_dates and filename.lower().endswith(DATE_EXTENSIONS)):
+                # Without a sidecar, the date in the file's own header is used (on the same pool)
+                task = (apply_sidecar, file_path, json_path, dir_fd) if json_path else (apply_embedded_date, file_path, dir_fd)
+                open_dirs[root][1] += 1
+                if pool:
+                    result = pool.submit(*task)
+                else:
+                    result = task[0](*task[1:])
+                in_flight.append((file_path, root, result, json_path is not None))
+                while len(in_flight) >= max(1, queue_depth):
+                    complete_oldest()
+            else:
+                rel_path = os.path.relpath(file_path, TARGET_DIR)
+                catalog.record(rel_path, None, None, None)
+                state.checkpoint(STAGE, rel_path, before_commit=catalog.commit)
                 
             count_processed += 1
-            
-            if count_processed % 100 == 0:
-                print(f"Processed {count_processed} files...", end='\r')
+            stage_metrics.progress("Updating timestamps", count_processed, total)
+        release_dir(root)
+
+    while in_flight:
+        complete_oldest()
+    if pool:
+        pool.shutdown()
+    # The catalog is committed before every batch of checkpoints, and here before the last one,
+    # so a file checkpointed as done always has its dates in the catalog
+    catalog.close()
+    state.close()
+
+    elapsed = time.monotonic() - start_time
 
     logging.info("="*30)
     logging.info(f"Total processed: {count_processed}")
     logging.info(f"Total updated: {count_updated}")
     logging.info(f"Files without JSON: {count_missing_json}")
+    if embedded_dates:
+        logging.info(f"Files without JSON dated from their EXIF or video header: {count_embedded}")
+    if count_resumed:
+        logging.info(f"Skipped (done by the previous run): {count_resumed}")
+    logging.info(f"Throughput: {count_processed / max(elapsed, 1e-9):.1f} files/sec ({elapsed:.1f}s, {workers} worker(s))")
+
+    report.write(SIDECAR_REPORT_PATH)
+    logging.info(f"Ambiguous JSON matches: {len(report.ambiguous)} (see {SIDECAR_REPORT_PATH})")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Restore file timestamps from Google JSON sidecars.")
+    parser.add_argument("--workers", type=int, default=METADATA_WORKERS,
+                        help="number of threads reading sidecars and applying timestamps (1 = sequential)")
+    parser.add_argument("--queue-depth", type=int, default=QUEUE_DEPTH,
+                        help="maximum number of files in flight")
+    parser.add_argument("--backend", choices=BACKENDS, default="auto",
+                        help="how timestamps are written (default: based on the platform)")
+    parser.add_argument("--no-embedded-dates", action="store_true",
+                        help="leave the files without a sidecar unchanged instead of reading the date in their header")
+    parser.add_argument("--restart", action="store_true",
+                        help="update every file again, even if a previous run completed or checkpointed them")
+    args = parser.parse_args()
+    backend = select_backend(args.backend)
+    run_stage(STAGE, main, restart=args.restart, workers=args.workers, queue_depth=args.queue_depth,
+              embedded_dates=not args.no_embedded_dates)
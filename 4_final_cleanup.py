@@ -1,133 +1,381 @@
 import os
 import logging
-import hashlib
+import argparse
+from array import array
 from collections import defaultdict
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("final_cleanup_log.txt", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from hash_cache import HashCache
+from file_links import LINK_MODE_ENV
+from hash_engine import HashEngine, ALGORITHMS, DEFAULT_WORKERS
+from inventory import Inventory
+from catalog import MediaCatalog
+from content_index import keep_priority
+from duplicate_index import DuplicateIndex, PathTable
+from plan import Plan
+import io_order
+import near_duplicates
+from run_state import run_stage
+import metrics
+from pipeline_logging import setup_logging, file_event
+
+# Configure logging (written on a background thread, see pipeline_logging.py)
+setup_logging("final_cleanup_log.txt")
 
 TARGET_DIR = os.path.abspath("Unified_photos")
+HASH_CACHE_PATH = os.path.abspath("hash_cache.sqlite")
+# Where the duplicate index moves once it passes INDEX_MEMORY_BUDGET bytes (None: always in memory)
+DUPLICATE_INDEX_PATH = os.path.abspath("duplicate_index.sqlite")
+INDEX_MEMORY_BUDGET = None
+# Deleted files are removed from the media catalog of 3_update_metadata.py, if there is one
+CATALOG_PATH = os.path.abspath("media_catalog.sqlite")
+
+# Size of the head and tail blocks read for the partial hash
+PARTIAL_BLOCK_SIZE = 64 * 1024
+# Files hashed per chunk: only the paths of one chunk are built at a time
+HASH_CHUNK = 4096
+
+# sha256, blake2b or xxh3 (fastest, needs the optional xxhash module)
+HASH_ALGORITHM = "sha256"
+HASH_WORKERS = DEFAULT_WORKERS
+
+# None deletes duplicates; "hardlink" or "reflink" (falls back to hardlinks) replaces
+# them with links to the kept copy, so every album keeps its photos (main.py --link-duplicates)
+DUPLICATE_LINKS = os.environ.get(LINK_MODE_ENV) or None
+LINK_MODES = ("reflink", "hardlink")
+
+# Groups of visually similar photos found by --near-duplicates (needs the optional Pillow package)
+NEAR_DUPLICATES_REPORT_PATH = os.path.abspath("near_duplicates_report.txt")
 
 def calculate_hash(file_path):
-    """Calculate SHA256 hash of a file."""
-    hash_sha256 = hashlib.sha256()
-    try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_sha256.update(chunk)
-        return hash_sha256.hexdigest()
-    except Exception as e:
-        logging.error(f"Error calculating hash for {file_path}: {e}")
-        return None
-
-def remove_duplicates(target_dir):
-    """Find and remove duplicate files based on content hash, with folder priority."""
-    hashes = defaultdict(list)
-    count_duplicates = 0
+    """Calculate the hash of a file with the configured algorithm."""
+    return HashEngine(HASH_ALGORITHM, workers=1).hash_file(file_path)
 
-    logging.info("Scanning for duplicates (calculating hashes)...")
-    for root, _, files in os.walk(target_dir):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            # Skip json files as they are handled separately or deleted
-            if filename.lower().endswith(".json"):
-                continue
-            
-            file_hash = calculate_hash(file_path)
+def remove_duplicates(target_dir, plan, force_rehash=False, algorithm=HASH_ALGORITHM, workers=HASH_WORKERS,
+                      inventory=None, link=DUPLICATE_LINKS, memory_budget=INDEX_MEMORY_BUDGET):
+    """
+    Find duplicate files based on content hash, with folder priority, and add their
+    deletion (or with link, their replacement by a link to the kept file) to the plan.
+    Files are tracked by id (see duplicate_index.py) and digests are kept in binary.
+    Returns {duplicate path: path kept}.
+    """
+    paths = PathTable()
+    hashes = DuplicateIndex(memory_budget, DUPLICATE_INDEX_PATH)
+    duplicates = {}
+
+    if inventory is None:
+        inventory = Inventory.scan(target_dir)
+
+    # One reader in disk order on a spinning disk (see io_order.py)
+    engine = HashEngine(algorithm, workers=io_order.io_workers(workers))
+    logging.info(f"Hashing with {engine.algorithm} on {engine.workers} worker(s).")
+
+    cache = HashCache(HASH_CACHE_PATH)
+    if force_rehash:
+        logging.info("Forcing full rehash, clearing hash cache.")
+        cache.clear()
+
+    # Stage 1: bucket by size, a file with a unique size cannot have a duplicate
+    logging.info("Scanning for duplicates (grouping by size)...")
+    sizes = defaultdict(lambda: array("I"))
+    for file_path, stats in inventory.files():
+        # Skip json files as they are handled separately or deleted
+        if file_path.lower().endswith(".json"):
+            continue
+        sizes[stats.st_size].append(paths.add(file_path))
+
+    bytes_total = 0
+    bytes_skipped_size = 0
+    bytes_skipped_partial = 0
+    bytes_skipped_cache = 0
+    bytes_read = 0
+
+    to_full_hash = array("I")
+    to_partial_hash = array("I")
+    unique_ids = array("I")
+    for size, ids in sizes.items():
+        bytes_total += size * len(ids)
+        if len(ids) < 2:
+            bytes_skipped_size += size
+            unique_ids.extend(ids)
+        elif size <= 2 * PARTIAL_BLOCK_SIZE:
+            # Small files are read entirely by the partial hash anyway
+            to_full_hash.extend(ids)
+        else:
+            to_partial_hash.extend(ids)
+    del sizes
+
+    def locate(file_id):
+        path = paths.path(file_id)
+        return path, inventory.get_stat(path)
+
+    def chunks(ids):
+        """Yields (ids, [(path, stats), ...]) of HASH_CHUNK ids at a time."""
+        for start in range(0, len(ids), HASH_CHUNK):
+            chunk = ids[start:start + HASH_CHUNK]
+            yield chunk, [locate(file_id) for file_id in chunk]
+
+    # Stage 2: head + tail digest, only inside size collisions
+    to_partial_hash = io_order.disk_order(to_partial_hash, locate, label="Partial hashing")
+    partials = defaultdict(lambda: array("I"))
+    done = 0
+    for chunk, located in chunks(to_partial_hash):
+        partial_hashes = engine.partial_hash_many([(path, stats.st_size) for path, stats in located],
+                                                  PARTIAL_BLOCK_SIZE)
+        for file_id, (_, stats), (_, partial_hash) in zip(chunk, located, partial_hashes):
+            done += 1
+            metrics.active().progress("Partial hashing", done, len(to_partial_hash))
+            bytes_read += 2 * PARTIAL_BLOCK_SIZE
+            if partial_hash:
+                partials[(stats.st_size, bytes.fromhex(partial_hash))].append(file_id)
+    del to_partial_hash
+    for (size, _), candidates in partials.items():
+        if len(candidates) < 2:
+            bytes_skipped_partial += size - 2 * PARTIAL_BLOCK_SIZE
+            unique_ids.extend(candidates)
+        else:
+            to_full_hash.extend(candidates)
+    del partials
+
+    # Unchanged files that were never looked up must not be evicted from the cache
+    cache.mark_seen(paths.path(file_id) for file_id in unique_ids)
+    del unique_ids
+
+    # Stage 3: full hash, only for files whose partial digests still collide.
+    # Whatever order the files are hashed in, the index returns each group sorted by id
+    # (walk order), which breaks keep priority ties as before.
+    logging.info(f"Calculating full hashes for {len(to_full_hash)} candidate files...")
+    to_compute = array("I")
+    for file_id in to_full_hash:
+        file_path = paths.path(file_id)
+        stats = inventory.get_stat(file_path)
+        # Reuse the stored digest if the file is unchanged since the last run
+        file_hash = cache.lookup(file_path, stats, engine.algorithm)
+        if file_hash:
+            bytes_skipped_cache += stats.st_size
+            hashes.add(bytes.fromhex(file_hash), file_id)
+        else:
+            to_compute.append(file_id)
+
+    to_compute = io_order.disk_order(to_compute, locate, label="Hashing")
+    done = 0
+    for chunk, located in chunks(to_compute):
+        digests = engine.hash_many([path for path, _ in located])
+        for file_id, (file_path, stats), (_, file_hash) in zip(chunk, located, digests):
+            done += 1
+            metrics.active().progress("Hashing", done, len(to_compute))
+            bytes_read += stats.st_size
             if file_hash:
-                hashes[file_hash].append(file_path)
+                cache.store(file_path, stats, file_hash, engine.algorithm)
+                hashes.add(bytes.fromhex(file_hash), file_id)
+    del to_compute
+
+    logging.info(f"Hash cache: {cache.hits} reused, {cache.misses} computed.")
+    logging.info(f"Bytes avoided by size grouping: {bytes_skipped_size}")
+    logging.info(f"Bytes avoided by partial hashing: {bytes_skipped_partial}")
+    logging.info(f"Bytes avoided by hash cache: {bytes_skipped_cache}")
+    logging.info(f"Bytes read for hashing: {bytes_read} of {bytes_total}")
+
+    logging.info(f"Duplicate index: {hashes.count} entries, {len(paths)} files, ~{hashes.memory + paths.memory()} "
+                 f"bytes in memory" + (f" (spilled to {DUPLICATE_INDEX_PATH})" if hashes.spilled else ""))
 
     logging.info("Processing duplicates...")
-    for file_hash, paths in hashes.items():
-        if len(paths) > 1:
+    for ids in hashes.groups():
+        group = [paths.path(file_id) for file_id in ids]
+        if len(group) > 1:
             # Sort paths: prioritizing those IN "Photos de " folders
             # We want to KEEP one file. 
             # Logic: 
             # 1. Paths starting with "Photos de " are higher priority.
             # 2. Within same priority, shorter paths might be preferred (sturdier)
-            
-            def get_priority(path):
-                # Get the immediate parent folder name
-                parent_folder = os.path.basename(os.path.dirname(path))
-                if parent_folder.startswith("Photos de "):
-                    return 0 # Higher priority
-                return 1 # Lower priority
-
-            # Sort by priority (0 first), then by path length
-            paths.sort(key=lambda p: (get_priority(p), len(p)))
+            group.sort(key=keep_priority)
             
             # The first one is the one we KEEP
-            to_keep = paths[0]
-            to_delete = paths[1:]
+            to_keep = group[0]
+            to_delete = group[1:]
             
+            kept_stats = inventory.get_stat(to_keep)
             for path in to_delete:
-                try:
-                    os.remove(path)
-                    count_duplicates += 1
-                    logging.info(f"Deleted duplicate: {path} (Keeping: {to_keep})")
-                except OSError as e:
-                    logging.error(f"Error deleting duplicate {path}: {e}")
-    
-    return count_duplicates
-
-def final_cleanup():
+                stats = inventory.get_stat(path)
+                # Linked by an earlier run: deleting it would free nothing and empty its album
+                if (stats.st_dev, stats.st_ino) == (kept_stats.st_dev, kept_stats.st_ino):
+                    continue
+                if cache.is_clone(path, stats, to_keep, kept_stats):
+                    continue
+                # .MP files are deleted by the cleanup anyway
+                if link and not path.lower().endswith(".mp"):
+                    plan.link(path, to_keep, stats.st_size, reflink=link == "reflink", stats=(stats, kept_stats))
+                else:
+                    plan.delete(path, stats.st_size)
+                duplicates[path] = to_keep
+    hashes.close()
+
+    # Entries of files that disappeared since the last run are no longer useful
+    # (the duplicates deleted now are evicted by the next run)
+    evicted = cache.evict_stale()
+    if evicted:
+        logging.info(f"Evicted {evicted} stale hash cache entries.")
+    cache.close()
+
+    return duplicates
+
+def report_near_duplicates(paths, radius=near_duplicates.HAMMING_RADIUS, method="dhash"):
+    """Writes the groups of near-duplicate photos among paths to a report. Never deletes anything."""
+    if near_duplicates.Image is None:
+        logging.warning("Pillow is not installed (pip install pillow), skipping near-duplicate detection.")
+        return
+    logging.info(f"Looking for near duplicates ({method}, up to {radius} different bits)...")
+    report = near_duplicates.find_near_duplicates(paths, radius=radius, method=method)
+    report.write(NEAR_DUPLICATES_REPORT_PATH)
+    logging.info(f"Near-duplicate groups: {len(report.groups)} among {report.hashed} photos "
+                 f"(see {NEAR_DUPLICATES_REPORT_PATH}, nothing was deleted)")
+
+def final_cleanup(force_rehash=False, algorithm=HASH_ALGORITHM, workers=HASH_WORKERS, inventory=None, dry_run=False,
+                  near_duplicate_radius=None, near_duplicate_method="dhash", link=DUPLICATE_LINKS,
+                  memory_budget=INDEX_MEMORY_BUDGET):
     if not os.path.exists(TARGET_DIR):
         logging.error(f"Target directory {TARGET_DIR} does not exist.")
-        return
+        return False
+
+    if inventory is None:
+        inventory = Inventory.scan(TARGET_DIR)
 
     count_json = 0
     count_mp = 0
     count_folders = 0
     count_duplicates = 0
+    count_hardlinks = 0
+    count_reflinks = 0
+    bytes_linked = 0
+
+    # Everything is decided first, then deleted folder by folder
+    plan = Plan()
 
     # 0. Remove duplicates first (based on hash)
-    count_duplicates = remove_duplicates(TARGET_DIR)
+    duplicates = remove_duplicates(
+        TARGET_DIR, plan, force_rehash=force_rehash, algorithm=algorithm, workers=workers, inventory=inventory,
+        link=link, memory_budget=memory_budget
+    )
 
     # 1. Remove .json and .MP files
-    for root, dirs, files in os.walk(TARGET_DIR):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            ext = filename.lower()
-            
-            if ext.endswith(".json"):
-                try:
-                    os.remove(file_path)
-                    count_json += 1
-                except OSError as e:
-                    logging.error(f"Error deleting {file_path}: {e}")
-            
-            elif ext.endswith(".mp"):
-                try:
-                    os.remove(file_path)
-                    count_mp += 1
-                except OSError as e:
-                    logging.error(f"Error deleting {file_path}: {e}")
+    for file_path, stats in inventory.files():
+        ext = file_path.lower()
+        if (ext.endswith(".json") or ext.endswith(".mp")) and file_path not in duplicates:
+            plan.delete(file_path, stats.st_size)
+
+    # Photos kept by this run that look alike, for review
+    if near_duplicate_radius is not None:
+        # Exact duplicates, deleted or replaced by links, are left out: only the kept copy is compared
+        removed = {op.src for op in plan.operations("delete", "link")}
+        report_near_duplicates([path for path, _ in inventory.files() if path not in removed],
+                               near_duplicate_radius, near_duplicate_method)
 
     # 2. Remove empty folders (recursively)
-    # We walk bottom-up to ensure we catch folders that became empty because their subfolders were deleted
-    for root, dirs, files in os.walk(TARGET_DIR, topdown=False):
-        for name in dirs:
-            dir_path = os.path.join(root, name)
-            try:
-                if not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-                    count_folders += 1
-                    # logging.info(f"Removed empty folder: {dir_path}")
-            except OSError as e:
-                logging.error(f"Error deleting folder {dir_path}: {e}")
+    # Bottom-up over the inventory, so folders that became empty because their subfolders were deleted are caught too
+    for dirpath in inventory.empty_dirs(op.src for op in plan.operations("delete")):
+        plan.rmdir(dirpath)
+
+    plan.log_summary("Plan")
+    if dry_run:
+        plan.print_plan()
+        return
+
+    catalog = MediaCatalog(CATALOG_PATH) if MediaCatalog.exists(CATALOG_PATH) else None
+    # Reflinked copies keep their own inode: recorded so the next runs do not clone them again
+    cache = HashCache(HASH_CACHE_PATH) if plan.operations("link") else None
+
+    for op, error in plan.execute():
+        if op.kind == "rmdir":
+            if error:
+                logging.error(f"Error deleting folder {op.src}: {error}")
+            else:
+                inventory.discard_dir(op.src)
+                count_folders += 1
+            continue
+        file_path = op.src
+        if op.kind == "link":
+            if error:
+                logging.error(f"Error linking duplicate {file_path}: {error}")
+                continue
+            inventory.refresh(file_path)
+            stats = inventory.get_stat(file_path)
+            kept_stats = inventory.get_stat(op.dst)
+            if (stats.st_dev, stats.st_ino) == (kept_stats.st_dev, kept_stats.st_ino):
+                method = "hardlink"
+                count_hardlinks += 1
+            else:
+                method = "reflink"
+                count_reflinks += 1
+                cache.store_clone(file_path, stats, op.dst, kept_stats)
+            bytes_linked += op.size
+            file_event("duplicates linked", file_path, f"Linked duplicate: {file_path} -> {op.dst} ({method})",
+                       kept=op.dst, method=method)
+            continue
+        if error:
+            if file_path in duplicates:
+                logging.error(f"Error deleting duplicate {file_path}: {error}")
+            else:
+                logging.error(f"Error deleting {file_path}: {error}")
+            continue
+        inventory.discard(file_path)
+        if file_path in duplicates:
+            count_duplicates += 1
+            file_event("duplicates deleted", file_path,
+                       f"Deleted duplicate: {file_path} (Keeping: {duplicates[file_path]})", kept=duplicates[file_path])
+        elif file_path.lower().endswith(".json"):
+            count_json += 1
+            continue
+        else:
+            count_mp += 1
+        if catalog:
+            catalog.forget(os.path.relpath(file_path, TARGET_DIR))
+
+    if catalog:
+        catalog.close()
+    if cache:
+        cache.close()
 
     logging.info("="*30)
     logging.info(f"JSON files deleted: {count_json}")
     logging.info(f".MP files deleted: {count_mp}")
     logging.info(f"Duplicate files deleted: {count_duplicates}")
+    if link:
+        logging.info(f"Duplicate files linked: {count_hardlinks + count_reflinks} "
+                     f"({count_hardlinks} hardlinks, {count_reflinks} reflinks)")
+        logging.info(f"Bytes reclaimed by links: {bytes_linked}")
     logging.info(f"Empty folders deleted: {count_folders}")
 
 if __name__ == "__main__":
-    final_cleanup()
+    parser = argparse.ArgumentParser(description="Remove duplicates, sidecar files and empty folders.")
+    parser.add_argument("--rehash", action="store_true", help="ignore the hash cache and recompute every digest")
+    parser.add_argument("--algorithm", choices=ALGORITHMS, default=HASH_ALGORITHM, help="hash algorithm")
+    parser.add_argument("--workers", type=int, default=HASH_WORKERS, help="number of hashing threads")
+    parser.add_argument("--restart", action="store_true",
+                        help="run again even if a previous run completed this stage (implied by --rehash)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="hash and print the planned deletes without deleting anything")
+    parser.add_argument("--near-duplicates", nargs="?", type=int, const=near_duplicates.HAMMING_RADIUS,
+                        metavar="RADIUS",
+                        help="also report visually similar photos (re-encoded, resized...) to "
+                             "near_duplicates_report.txt, up to RADIUS different hash bits "
+                             f"(0 to {near_duplicates.MAX_RADIUS}); needs Pillow")
+    parser.add_argument("--phash", choices=near_duplicates.METHODS, default="dhash",
+                        help="perceptual hash used by --near-duplicates")
+    parser.add_argument("--link-duplicates", nargs="?", choices=LINK_MODES, const="reflink", default=DUPLICATE_LINKS,
+                        help="replace duplicates with links to the kept copy instead of deleting them, so albums "
+                             "keep their photos: reflink (default, falls back to hardlinks) or hardlink")
+    parser.add_argument("--memory-budget", type=int, metavar="MB",
+                        help="move the duplicate index to duplicate_index.sqlite once it would use more than MB "
+                             "megabytes of memory (default: always in memory)")
+    args = parser.parse_args()
+    if args.near_duplicates is not None and not 0 <= args.near_duplicates <= near_duplicates.MAX_RADIUS:
+        parser.error(f"--near-duplicates RADIUS must be between 0 and {near_duplicates.MAX_RADIUS}")
+    options = dict(force_rehash=args.rehash, algorithm=args.algorithm, workers=args.workers,
+                   near_duplicate_radius=args.near_duplicates, near_duplicate_method=args.phash,
+                   link=args.link_duplicates,
+                   memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None)
+    if args.dry_run:
+        final_cleanup(dry_run=True, **options)
+    else:
+        # Digests already in the hash cache are the checkpoints of an interrupted run
+        run_stage("4_final_cleanup", final_cleanup, restart=args.restart or args.rehash or args.near_duplicates is not None,
+                  **options)
@@ -1,17 +1,18 @@
 import os
-import shutil
 import logging
+import argparse
 from datetime import datetime
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("filter_by_date_log.txt", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from inventory import Inventory, remove_empty_parents
+from catalog import MediaCatalog
+from move_journal import MoveJournal
+from plan import Plan, run_operation
+from run_state import run_stage
+import metrics
+from pipeline_logging import setup_logging, file_event
+
+# Configure logging (written on a background thread, see pipeline_logging.py)
+setup_logging("filter_by_date_log.txt")
 
 TARGET_DIR = os.path.abspath("Unified_photos")
 EXCLUDED_DIR = os.path.abspath("_Excluded_by_Date")
@@ -19,26 +20,96 @@ EXCLUDED_DIR = os.path.abspath("_Excluded_by_Date")
 # Range: 18/08/2013 to 25/12/2020
 START_DATE = datetime(2013, 8, 18)
 END_DATE = datetime(2020, 12, 25, 23, 59, 59)
+# Photos are kept if they fall in any of these ranges
+DATE_RANGES = [(START_DATE, END_DATE)]
+
+# Written by 3_update_metadata.py, used instead of the file timestamps when present
+CATALOG_PATH = os.path.abspath("media_catalog.sqlite")
+
+# Every move to the exclusion folder is recorded here, 6_revert_filter.py replays it backwards
+JOURNAL_PATH = os.path.abspath("filter_journal.jsonl")
+
+def parse_range(text):
+    """Parses a 'YYYY-MM-DD:YYYY-MM-DD' range, both days included."""
+    start, end = text.split(":")
+    return (datetime.strptime(start, "%Y-%m-%d"),
+            datetime.strptime(end, "%Y-%m-%d").replace(hour=23, minute=59, second=59))
+
+def is_in_ranges(date, ranges):
+    return any(start <= date <= end for start, end in ranges)
 
-def filter_photos():
+def open_journal():
+    """Opens the move journal, finishing any batch left incomplete by an interrupted run."""
+    journal = MoveJournal(JOURNAL_PATH, TARGET_DIR, EXCLUDED_DIR)
+    journal.recover()
+    return journal
+
+def execute_moves(plan, finish_moves):
+    """Runs the planned moves through the journal, folder by folder."""
+    journal = open_journal()
+    total = len(plan.operations("move"))
+    done = 0
+    # In disk order in the hdd I/O mode (see io_order.py)
+    for ops in plan.disk_ordered_batches():
+        for op in ops:
+            finish_moves(journal.add(os.path.relpath(op.src, TARGET_DIR)))
+            done += 1
+            metrics.active().progress("Moving", done, total)
+    finish_moves(journal.flush())
+    journal.close()
+
+def remove_planned_dirs(plan, inventory):
+    """Removes the folders the plan expects to be empty. Returns the number removed."""
+    removed = 0
+    for op in plan.operations("rmdir"):
+        _, error = run_operation(op)
+        if error:
+            logging.error(f"Error deleting folder {op.src}: {error}")
+            continue
+        inventory.discard_dir(op.src)
+        removed += 1
+    return removed
+
+def filter_photos(inventory=None, ranges=DATE_RANGES, use_catalog=True, dry_run=False):
     if not os.path.exists(TARGET_DIR):
         logging.error(f"Target directory {TARGET_DIR} does not exist.")
+        return False
+
+    if use_catalog and MediaCatalog.exists(CATALOG_PATH):
+        filter_with_catalog(inventory, ranges, dry_run)
         return
 
-    if not os.path.exists(EXCLUDED_DIR):
+    if inventory is None:
+        inventory = Inventory.scan(TARGET_DIR)
+
+    if not dry_run and not os.path.exists(EXCLUDED_DIR):
         os.makedirs(EXCLUDED_DIR)
 
     count_kept = 0
     count_excluded = 0
     count_folders_cleaned = 0
 
+    plan = Plan()
+    # Log line of each planned move, written once its journaled batch has run
+    messages = {}
+
+    def finish_moves(results):
+        nonlocal count_excluded
+        for rel_path, error in results:
+            file_path = os.path.join(TARGET_DIR, rel_path)
+            message = messages.pop(rel_path)
+            if error:
+                logging.error(f"Error processing {file_path}: {error}")
+                continue
+            inventory.discard(file_path)
+            count_excluded += 1
+            file_event("excluded", file_path, message)
+
     # 1. Check all files
-    for root, dirs, files in os.walk(TARGET_DIR):
-        for filename in files:
+    for root, files in inventory.walk():
+        for filename, stats in files:
             file_path = os.path.join(root, filename)
             try:
-                stats = os.stat(file_path)
-                
                 # Best photo date is Last Access Time (where we mapped photoTakenTime)
                 # OR Creation Time (creationTime) 
                 # We'll check the EARLIEST of the three standard dates just in case
@@ -49,37 +120,137 @@ def filter_photos():
                 
                 # In our setup: atime=Taken, ctime=CloudCreation, mtime=Modification
                 # We keep if ANY of these important dates are in range
-                is_in_range = (START_DATE <= atime <= END_DATE) or \
-                              (START_DATE <= ctime <= END_DATE) or \
-                              (START_DATE <= mtime <= END_DATE)
+                is_in_range = is_in_ranges(atime, ranges) or \
+                              is_in_ranges(ctime, ranges) or \
+                              is_in_ranges(mtime, ranges)
 
                 if is_in_range:
                     count_kept += 1
                 else:
                     # Move to excluded while preserving relative path
                     rel_path = os.path.relpath(file_path, TARGET_DIR)
-                    target_excluded_path = os.path.join(EXCLUDED_DIR, rel_path)
-                    
-                    # Create subfolder in excluded if needed
-                    os.makedirs(os.path.dirname(target_excluded_path), exist_ok=True)
-                    
-                    shutil.move(file_path, target_excluded_path)
-                    count_excluded += 1
-                    logging.info(f"Excluded {filename} (Dates: A={atime.date()}, C={ctime.date()}, M={mtime.date()} are outside range)")
+                    messages[rel_path] = f"Excluded {filename} (Dates: A={atime.date()}, C={ctime.date()}, M={mtime.date()} are outside range)"
+                    plan.move(file_path, os.path.join(EXCLUDED_DIR, rel_path), stats.st_size)
                     
             except Exception as e:
                 logging.error(f"Error processing {file_path}: {e}")
 
     # 2. Cleanup empty folders in source
-    for root, dirs, files in os.walk(TARGET_DIR, topdown=False):
-        for name in dirs:
-            dir_path = os.path.join(root, name)
-            try:
-                if not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-                    count_folders_cleaned += 1
-            except OSError:
-                pass
+    for dirpath in inventory.empty_dirs(op.src for op in plan.operations("move")):
+        plan.rmdir(dirpath)
+
+    plan.log_summary("Plan")
+    if dry_run:
+        plan.print_plan()
+        count_excluded = len(messages)
+    else:
+        execute_moves(plan, finish_moves)
+        count_folders_cleaned = remove_planned_dirs(plan, inventory)
+
+    logging.info("="*30)
+    if dry_run:
+        logging.info("DRY RUN, nothing was moved.")
+    logging.info(f"Photos kept in target: {count_kept}")
+    logging.info(f"Photos moved to exclusion: {count_excluded}")
+    logging.info(f"Empty source folders removed: {count_folders_cleaned}")
+
+def filter_with_catalog(inventory, ranges, dry_run):
+    """
+    Filters using the dates recorded by 3_update_metadata.py. Only the files whose taken
+    date is outside the ranges are read from the catalog, and only the files to move are touched.
+    Files recorded without any date (no sidecar) fall back to their file timestamps.
+    """
+    catalog = MediaCatalog(CATALOG_PATH)
+    range_timestamps = [(start.timestamp(), end.timestamp()) for start, end in ranges]
+    logging.info(f"Filtering with the media catalog: {CATALOG_PATH}")
+
+    to_exclude = []
+    to_check = []
+    for rel_path, taken, creation, modification in catalog.outside_ranges(range_timestamps):
+        if taken is None and creation is None and modification is None:
+            to_check.append(rel_path)
+            continue
+        # Kept if ANY of the dates is in range, like the file timestamp check
+        if any(ts is not None and is_in_ranges(datetime.fromtimestamp(ts), ranges) for ts in (creation, modification)):
+            continue
+        to_exclude.append(rel_path)
+
+    count_total = catalog.count()
+
+    if dry_run:
+        # Sizes are unknown without a stat, only the moves and their order are shown
+        plan = Plan()
+        for rel_path in to_exclude:
+            plan.move(os.path.join(TARGET_DIR, rel_path), os.path.join(EXCLUDED_DIR, rel_path))
+        plan.log_summary("Plan")
+        plan.print_plan()
+        logging.info("="*30)
+        logging.info("DRY RUN, nothing was moved.")
+        logging.info(f"Ranges: {', '.join(f'{start} -> {end}' for start, end in ranges)}")
+        logging.info(f"Cataloged photos: {count_total}")
+        logging.info(f"Photos that would be moved to exclusion: {len(to_exclude)}")
+        logging.info(f"Photos without dates (decided from file timestamps): {len(to_check)}")
+        logging.info(f"Photos that would be kept: {count_total - len(to_exclude) - len(to_check)}")
+        catalog.close()
+        return
+
+    # Files without sidecar dates are decided on their file timestamps, as before
+    for rel_path in to_check:
+        file_path = os.path.join(TARGET_DIR, rel_path)
+        try:
+            with metrics.active().timed("stat"):
+                stats = os.stat(file_path)
+        except OSError:
+            catalog.forget(rel_path)
+            continue
+        dates = [datetime.fromtimestamp(ts) for ts in (stats.st_atime, stats.st_ctime, stats.st_mtime)]
+        if not any(is_in_ranges(date, ranges) for date in dates):
+            to_exclude.append(rel_path)
+
+    if to_exclude and not os.path.exists(EXCLUDED_DIR):
+        os.makedirs(EXCLUDED_DIR)
+
+    plan = Plan()
+    for rel_path in to_exclude:
+        file_path = os.path.join(TARGET_DIR, rel_path)
+        stats = inventory.get_stat(file_path) if inventory is not None else None
+        plan.move(file_path, os.path.join(EXCLUDED_DIR, rel_path), stats.st_size if stats else 0)
+    if inventory is not None:
+        for dirpath in inventory.empty_dirs(op.src for op in plan.operations("move")):
+            plan.rmdir(dirpath)
+    plan.log_summary("Plan")
+
+    count_excluded = 0
+    emptied_dirs = set()
+
+    def finish_moves(results):
+        nonlocal count_excluded
+        for rel_path, error in results:
+            file_path = os.path.join(TARGET_DIR, rel_path)
+            if isinstance(error, FileNotFoundError):
+                # Deleted since stage 3 ran
+                catalog.forget(rel_path)
+                continue
+            if error:
+                logging.error(f"Error processing {file_path}: {error}")
+                continue
+            catalog.set_excluded(rel_path, True)
+            if inventory is not None:
+                inventory.discard(file_path)
+            emptied_dirs.add(os.path.dirname(file_path))
+            count_excluded += 1
+            file_event("excluded", file_path, f"Excluded {rel_path} (all dates outside range)")
+
+    execute_moves(plan, finish_moves)
+
+    # Cleanup empty folders in source, only where files were moved out
+    if inventory is not None:
+        count_folders_cleaned = remove_planned_dirs(plan, inventory)
+    else:
+        count_folders_cleaned = remove_empty_parents(emptied_dirs, TARGET_DIR)
+
+    count_kept = catalog.count()
+    catalog.close()
 
     logging.info("="*30)
     logging.info(f"Photos kept in target: {count_kept}")
@@ -87,4 +258,18 @@ def filter_photos():
     logging.info(f"Empty source folders removed: {count_folders_cleaned}")
 
 if __name__ == "__main__":
-    filter_photos()
+    parser = argparse.ArgumentParser(description="Move photos taken outside the date ranges to _Excluded_by_Date.")
+    parser.add_argument("--range", dest="ranges", action="append", type=parse_range, metavar="START:END",
+                        help="date range to keep, as YYYY-MM-DD:YYYY-MM-DD (repeatable, default: START_DATE to END_DATE)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print the planned moves and how many photos would be kept or moved")
+    parser.add_argument("--no-catalog", action="store_true",
+                        help="ignore media_catalog.sqlite and read the dates from the file timestamps")
+    parser.add_argument("--restart", action="store_true", help="run again even if a previous run completed this stage")
+    args = parser.parse_args()
+    if args.dry_run:
+        filter_photos(ranges=args.ranges or DATE_RANGES, use_catalog=not args.no_catalog, dry_run=True)
+    else:
+        # An interrupted run is completed from the move journal
+        run_stage("5_filter_by_date", filter_photos, restart=args.restart or bool(args.ranges),
+                  ranges=args.ranges or DATE_RANGES, use_catalog=not args.no_catalog)
@@ -1,33 +1,96 @@
 import os
 import shutil
 import logging
+import argparse
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("revert_filter_log.txt", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from catalog import MediaCatalog
+from inventory import remove_empty_parents, remove_emptied_dirs
+from move_journal import MoveJournal
+from run_state import RunState, STATE_PATH
+from pipeline_logging import setup_logging
+
+# Configure logging (written on a background thread, see pipeline_logging.py)
+setup_logging("revert_filter_log.txt")
 
 TARGET_DIR = os.path.abspath("Unified_photos")
 EXCLUDED_DIR = os.path.abspath("_Excluded_by_Date")
+CATALOG_PATH = os.path.abspath("media_catalog.sqlite")
+# Written by 5_filter_by_date.py
+JOURNAL_PATH = os.path.abspath("filter_journal.jsonl")
+
+def revert_from_journal():
+    """
+    Moves back only the files recorded in the filter journal, newest first, with plain renames.
+    Returns (files reverted, folders removed, errors).
+    """
+    journal = MoveJournal(JOURNAL_PATH, TARGET_DIR, EXCLUDED_DIR)
+    # Finish whatever batch (filter or revert) an interrupted run left behind
+    journal.recover()
+    moved = journal.moved_paths()
+    logging.info(f"Reverting {len(moved)} journaled moves from {JOURNAL_PATH}")
+
+    count_reverted = 0
+    count_errors = 0
+    emptied_dirs = set()
+
+    def finish_reverts(results):
+        nonlocal count_reverted, count_errors
+        for rel_path, error in results:
+            file_excluded_path = os.path.join(EXCLUDED_DIR, rel_path)
+            if isinstance(error, FileNotFoundError) and not os.path.exists(file_excluded_path):
+                # Moved back or deleted by hand since the filter ran
+                continue
+            if error:
+                logging.error(f"Error reverting {file_excluded_path}: {error}")
+                count_errors += 1
+                continue
+            emptied_dirs.add(os.path.dirname(file_excluded_path))
+            count_reverted += 1
+
+    for rel_path in reversed(moved):
+        finish_reverts(journal.add(rel_path, op="revert"))
+    finish_reverts(journal.flush())
+
+    if count_errors:
+        journal.close()
+    else:
+        # Everything recorded is back, the next filter run starts a new journal
+        journal.remove()
+
+    count_folders_cleaned = remove_empty_parents(emptied_dirs, EXCLUDED_DIR)
+    return count_reverted, count_folders_cleaned, count_errors
 
-def revert_filter():
-    if not os.path.exists(EXCLUDED_DIR):
+def revert_filter(full=False):
+    if not os.path.exists(EXCLUDED_DIR) and not os.path.exists(JOURNAL_PATH):
         logging.info("No excluded photos directory found. Nothing to revert.")
         return
 
     if not os.path.exists(TARGET_DIR):
         os.makedirs(TARGET_DIR)
 
+    if os.path.exists(JOURNAL_PATH) and not full:
+        count_reverted, count_folders_cleaned, _ = revert_from_journal()
+        # Cleanup root excluded folder if empty
+        try:
+            if os.path.exists(EXCLUDED_DIR):
+                if os.listdir(EXCLUDED_DIR):
+                    logging.info(f"{EXCLUDED_DIR} still contains files that are not in the journal, "
+                                 "run with --full to move everything back.")
+                else:
+                    os.rmdir(EXCLUDED_DIR)
+        except OSError:
+            pass
+        finish_revert(count_reverted, count_folders_cleaned)
+        return
+
     count_reverted = 0
-    count_folders_cleaned = 0
+
+    # Files and folders still in each excluded folder, so that only emptied folders are removed
+    remaining = {}
 
     # 1. Move everything back from excluded folder
     for root, dirs, files in os.walk(EXCLUDED_DIR):
+        remaining[root] = len(dirs) + len(files)
         for filename in files:
             file_excluded_path = os.path.join(root, filename)
             
@@ -42,31 +105,44 @@ def revert_filter():
                 # Move back (shutil.move handles overwriting or errors if exists)
                 shutil.move(file_excluded_path, target_original_path)
                 count_reverted += 1
+                remaining[root] -= 1
                 # logging.info(f"Reverted: {rel_path}")
             except Exception as e:
                 logging.error(f"Error reverting {file_excluded_path}: {e}")
 
-    # 2. Cleanup empty folders in excluded directory
-    for root, dirs, files in os.walk(EXCLUDED_DIR, topdown=False):
-        for name in dirs:
-            dir_path = os.path.join(root, name)
-            try:
-                if not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-                    count_folders_cleaned += 1
-            except OSError:
-                pass
-    
+    # 2. Cleanup empty folders in excluded directory, from the counts instead of listing every folder again
+    count_folders_cleaned = remove_emptied_dirs(remaining, EXCLUDED_DIR)
+
     # Cleanup root excluded folder if empty
     try:
-        if os.path.exists(EXCLUDED_DIR) and not os.listdir(EXCLUDED_DIR):
+        if remaining.get(EXCLUDED_DIR) == 0:
             os.rmdir(EXCLUDED_DIR)
     except OSError:
         pass
 
+    # Everything is back, an old journal would only point at files that are no longer excluded
+    if os.path.exists(JOURNAL_PATH):
+        os.remove(JOURNAL_PATH)
+
+    finish_revert(count_reverted, count_folders_cleaned)
+
+def finish_revert(count_reverted, count_folders_cleaned):
+    # Files are back in the target, so the next filter run considers them again
+    if MediaCatalog.exists(CATALOG_PATH):
+        with MediaCatalog(CATALOG_PATH) as catalog:
+            catalog.include_all()
+    # ...and main.py runs the filter stage again
+    if os.path.exists(STATE_PATH):
+        with RunState() as state:
+            state.reset_stage("5_filter_by_date")
+
     logging.info("="*30)
     logging.info(f"Photos reverted to target: {count_reverted}")
     logging.info(f"Empty exclusion folders removed: {count_folders_cleaned}")
 
 if __name__ == "__main__":
-    revert_filter()
+    parser = argparse.ArgumentParser(description="Move the photos excluded by 5_filter_by_date.py back to Unified_photos.")
+    parser.add_argument("--full", action="store_true",
+                        help="walk the whole exclusion folder instead of replaying the move journal")
+    args = parser.parse_args()
+    revert_filter(full=args.full)
@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import subprocess
+
+from generate_takeout import generate
+from io_order import IO_MODES, IO_MODE_ENV
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = os.path.abspath("benchmark_results.jsonl")
+# Written by Linux (as root) to empty the page cache before a stage, for cold-cache timings
+DROP_CACHES_PATH = "/proc/sys/vm/drop_caches"
+WORK_DIR = os.path.abspath("benchmark_work")
+
+STAGES = [
+    "1_organize_photos.py",
+    "2_cleanup_modified.py",
+    "3_update_metadata.py",
+    "4_final_cleanup.py",
+    "5_filter_by_date.py",
+]
+
+# Runs a stage script as __main__ and writes what it read to BENCHMARK_IO_PATH.
+# /proc/self/io is only there on Linux; elsewhere bytes_read comes from getrusage.
+STAGE_RUNNER = """
+import os, sys, json, runpy
+script = sys.argv[1]
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(script))
+try:
+    runpy.run_path(script, run_name="__main__")
+finally:
+    io = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, value = line.split(":")
+                io[key] = int(value)
+    except OSError:
+        pass
+    with open(os.environ["BENCHMARK_IO_PATH"], "w") as f:
+        json.dump(io, f)
+"""
+
+
+def count_files(paths):
+    total = 0
+    for path in paths:
+        for _, _, filenames in os.walk(path):
+            total += len(filenames)
+    return total
+
+
+def stage_inputs(work_dir, script):
+    """Folders a stage reads, to count the files it processes."""
+    if script.startswith("1_"):
+        return [os.path.join(work_dir, d) for d in os.listdir(work_dir) if d.startswith("takeout-")]
+    return [os.path.join(work_dir, "Unified_photos")]
+
+
+def drop_caches():
+    """Empties the page cache so the stage reads from the disk. Returns False if not allowed."""
+    try:
+        os.sync()
+        with open(DROP_CACHES_PATH, "w") as f:
+            f.write("3\n")
+        return True
+    except (OSError, AttributeError) as e:
+        logging.warning(f"Could not drop the page cache (needs Linux and root), timing with a warm cache: {e}")
+        return False
+
+
+def stage_counters(work_dir, script):
+    """Counters of the last metrics line of the stage (e.g. the seek distances of the hdd mode)."""
+    metrics_path = os.path.join(work_dir, "pipeline_metrics.jsonl")
+    counters = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path, encoding="utf-8") as f:
+            for line in f:
+                result = json.loads(line)
+                if result.get("stage") == script[:-len(".py")]:
+                    counters = result.get("counters", {})
+    return counters
+
+
+def run_stage(work_dir, script, io_mode=None, cold_cache=False):
+    """Runs one stage in work_dir. Returns its measurements."""
+    io_path = os.path.join(work_dir, ".benchmark_io.json")
+    env = dict(os.environ, BENCHMARK_IO_PATH=io_path)
+    if io_mode:
+        env[IO_MODE_ENV] = io_mode
+    files = count_files(stage_inputs(work_dir, script))
+    if cold_cache:
+        cold_cache = drop_caches()
+
+    output_path = os.path.join(work_dir, f".benchmark_{script}.out")
+    start = time.perf_counter()
+    with open(output_path, "wb") as output:
+        process = subprocess.Popen(
+            [sys.executable, "-c", STAGE_RUNNER, os.path.join(SCRIPT_DIR, script)],
+            cwd=work_dir, env=env, stdout=output, stderr=subprocess.STDOUT
+        )
+        if hasattr(os, "wait4"):
+            # Resource usage of this child only
+            _, status, usage = os.wait4(process.pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+        else:
+            usage = None
+            returncode = process.wait()
+    wall_time = time.perf_counter() - start
+    if returncode != 0:
+        with open(output_path, "r", encoding="utf-8", errors="replace") as f:
+            logging.error(f"{script} output:\n{''.join(f.readlines()[-20:])}")
+
+    io = {}
+    if os.path.exists(io_path):
+        with open(io_path) as f:
+            io = json.load(f)
+        os.remove(io_path)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = None
+    if usage is not None:
+        peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    if "rchar" in io:
+        bytes_read = io["rchar"]
+    elif usage is not None:
+        bytes_read = usage.ru_inblock * 512
+    else:
+        bytes_read = None
+
+    return {
+        "stage": script,
+        "returncode": returncode,
+        "wall_time": round(wall_time, 4),
+        "files": files,
+        "files_per_sec": round(files / wall_time, 1) if wall_time > 0 else None,
+        "bytes_read": bytes_read,
+        "bytes_read_from_disk": io.get("read_bytes"),
+        "peak_rss": peak_rss,
+        "io_mode": io_mode,
+        "cold_cache": cold_cache,
+        "counters": stage_counters(work_dir, script),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(settings, stages=STAGES, timed=None, repeat=1, label=None, results_path=RESULTS_PATH,
+              work_dir=WORK_DIR, io_mode=None, cold_cache=False):
+    """
+    Generates a fresh takeout for every repetition, runs the stages on it in order and
+    appends one JSON line per timed stage (all by default) to results_path. Returns the results.
+    """
+    label = label or git_revision()
+    results = []
+    for run in range(repeat):
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        files, size = generate(work_dir, **settings)
+        logging.info(f"Run {run + 1}/{repeat}: generated {files} files ({size} bytes)")
+
+        for script in stages:
+            result = run_stage(work_dir, script, io_mode, cold_cache)
+            if result["returncode"] != 0:
+                logging.error(f"{script} failed with exit code {result['returncode']}, stopping this run.")
+                break
+            if timed and script not in timed:
+                continue
+            result.update({
+                "label": label,
+                "run": run + 1,
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "settings": settings,
+                "generated_files": files,
+                "generated_bytes": size,
+            })
+            results.append(result)
+            with open(results_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+            logging.info(f"{script}: {result['wall_time']:.2f}s, {result['files_per_sec']} files/sec, "
+                         f"{result['bytes_read']} bytes read, peak RSS {result['peak_rss']}")
+            for name, value in result["counters"].items():
+                logging.info(f"{script}: {name} {value}")
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every stage on a generated takeout.")
+    parser.add_argument("--parts", type=int, default=3)
+    parser.add_argument("--albums", type=int, default=10)
+    parser.add_argument("--files-per-album", type=int, default=50)
+    parser.add_argument("--size-median", type=int, default=256 * 1024)
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stage", dest="stages", action="append", choices=STAGES,
+                        help="only time these stages (the earlier ones still run first to prepare the tree)")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs, each on a fresh takeout")
+    parser.add_argument("--label", help="name of this version in the results (default: git revision)")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSON lines file the results are appended to")
+    parser.add_argument("--io-mode", choices=IO_MODES,
+                        help="I/O order of the stages (see io_order.py); compare ssd and hdd with --cold-cache")
+    parser.add_argument("--cold-cache", action="store_true",
+                        help="empty the page cache before every stage (Linux, as root)")
+    args = parser.parse_args()
+
+    settings = {
+        "parts": args.parts,
+        "albums": args.albums,
+        "files_per_album": args.files_per_album,
+        "size_median": args.size_median,
+        "duplicate_rate": args.duplicate_rate,
+        "seed": args.seed,
+    }
+    stages = STAGES
+    if args.stages:
+        # Stages run in pipeline order up to the last one requested
+        stages = STAGES[:max(STAGES.index(stage) for stage in args.stages) + 1]
+    benchmark(settings, stages=stages, timed=args.stages, repeat=args.repeat, label=args.label,
+              results_path=args.results, io_mode=args.io_mode, cold_cache=args.cold_cache)
@@ -0,0 +1,121 @@
+import os
+import sqlite3
+
+DEFAULT_CATALOG_PATH = os.path.abspath("media_catalog.sqlite")
+
+# Number of pending writes before committing to disk
+COMMIT_BATCH = 1000
+
+
+class MediaCatalog:
+    """
+    Persistent catalog of the dates read from the Google sidecars, written by
+    stage 3 and queried by stage 5. Paths are stored relative to Unified_photos
+    (or _Excluded_by_Date once excluded), so date filtering is an indexed query
+    instead of a stat of every file.
+    Files without a sidecar are recorded with NULL dates.
+    """
+
+    def __init__(self, db_path=DEFAULT_CATALOG_PATH):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            " path TEXT PRIMARY KEY,"
+            " taken_time REAL,"
+            " creation_time REAL,"
+            " modification_time REAL,"
+            " excluded INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS media_taken ON media (excluded, taken_time)")
+        self.conn.commit()
+        self.pending = 0
+
+    @staticmethod
+    def exists(db_path=DEFAULT_CATALOG_PATH):
+        return os.path.exists(db_path)
+
+    def record(self, rel_path, taken_time, creation_time, modification_time):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO media (path, taken_time, creation_time, modification_time, excluded)"
+            " VALUES (?, ?, ?, ?, 0)",
+            (rel_path, taken_time, creation_time, modification_time)
+        )
+        self._count_write()
+
+    def forget(self, rel_path):
+        self.conn.execute("DELETE FROM media WHERE path = ?", (rel_path,))
+        self._count_write()
+
+    def set_excluded(self, rel_path, excluded):
+        self.conn.execute("UPDATE media SET excluded = ? WHERE path = ?", (1 if excluded else 0, rel_path))
+        self._count_write()
+
+    def include_all(self):
+        """Marks every excluded file as back in Unified_photos."""
+        self.conn.execute("UPDATE media SET excluded = 0 WHERE excluded = 1")
+        self.conn.commit()
+        self.pending = 0
+
+    def outside_ranges(self, ranges):
+        """
+        Returns (path, taken_time, creation_time, modification_time) of the files still in
+        Unified_photos whose taken time is outside every (start, end) timestamp range,
+        or unknown. Only the complement of the ranges is read through the taken_time index.
+        """
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+
+        conditions = ["taken_time IS NULL"]
+        params = []
+        lower = None
+        for start, end in merged:
+            if lower is None:
+                conditions.append("taken_time < ?")
+                params.append(start)
+            else:
+                conditions.append("(taken_time > ? AND taken_time < ?)")
+                params.extend([lower, start])
+            lower = end
+        if lower is None:
+            conditions.append("taken_time IS NOT NULL")
+        else:
+            conditions.append("taken_time > ?")
+            params.append(lower)
+
+        query = (
+            "SELECT path, taken_time, creation_time, modification_time FROM media"
+            f" WHERE excluded = 0 AND ({' OR '.join(conditions)})"
+        )
+        return self.conn.execute(query, params).fetchall()
+
+    def count(self, excluded=False):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM media WHERE excluded = ?", (1 if excluded else 0,)
+        ).fetchone()[0]
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _count_write(self):
+        self.pending += 1
+        if self.pending >= COMMIT_BATCH:
+            self.conn.commit()
+            self.pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
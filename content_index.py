@@ -0,0 +1,88 @@
+import os
+
+# Stage 2 replaces "<name>.<ext>" with its edited version, e.g. "<name>-modifié.<ext>"
+from edited_names import edited_original, name_key
+
+
+def keep_priority(path):
+    """
+    Sort key of the copy to keep among identical files: files directly in a
+    "Photos de " folder first, then the shortest path.
+    """
+    parent_folder = os.path.basename(os.path.dirname(path))
+    return (0 if parent_folder.startswith("Photos de ") else 1, len(path))
+
+
+class ContentIndex:
+    """
+    Content of the files already in Unified_photos, bucketed by size.
+    A file is only hashed once another file of the same size shows up,
+    so most files are never read. JSON sidecars, edited files and the originals
+    they replace in stage 2 are not indexed.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.by_size = {}
+        self.digests = {}
+        self.bytes_hashed = 0
+        # Where an indexed file can be read (it may not be at its indexed path yet)
+        self.locate = lambda path: path
+
+    @classmethod
+    def scan(cls, root, engine):
+        """Indexes the files already present under root (sizes only)."""
+        index = cls(engine)
+        for dirpath, _, filenames in os.walk(root):
+            replaced = {name_key(original) for original in map(edited_original, filenames) if original}
+            for filename in filenames:
+                if name_key(filename) in replaced or not cls.indexed(filename):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    index.add(path, os.path.getsize(path))
+                except OSError:
+                    pass
+        return index
+
+    @staticmethod
+    def indexed(filename):
+        return not filename.lower().endswith(".json") and edited_original(filename) is None
+
+    def _digest(self, path, size):
+        digest = self.digests.get(path)
+        if digest is None:
+            digest = self.engine.hash_file(self.locate(path))
+            self.bytes_hashed += size
+            if digest:
+                self.digests[path] = digest
+        return digest
+
+    def find(self, path, size, digest=None):
+        """
+        Returns (existing_path, digest) of a file with the same content as path, or
+        (None, digest). digest is computed only if another file has the same size.
+        """
+        bucket = self.by_size.get(size)
+        if not bucket:
+            return None, digest
+        if digest is None:
+            digest = self.engine.hash_file(path)
+            self.bytes_hashed += size
+            if not digest:
+                return None, None
+        for existing in bucket:
+            if self._digest(existing, size) == digest:
+                return existing, digest
+        return None, digest
+
+    def add(self, path, size, digest=None):
+        self.by_size.setdefault(size, []).append(path)
+        if digest:
+            self.digests[path] = digest
+
+    def remove(self, path, size):
+        bucket = self.by_size.get(size)
+        if bucket and path in bucket:
+            bucket.remove(path)
+        self.digests.pop(path, None)
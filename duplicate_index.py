@@ -0,0 +1,141 @@
+import os
+import sys
+import sqlite3
+import logging
+from array import array
+
+# Estimated bytes per digest kept in memory: the digest object and its dict slot
+ENTRY_BYTES = 120
+# Extra bytes of a digest shared by several files (the array of their ids)
+GROUP_BYTES = 80
+# Rows inserted at once once the index is on disk
+SPILL_BATCH = 10000
+
+
+class PathTable:
+    """
+    Paths of the files being compared, stored as (folder id, file name): each folder
+    string is kept once, and files are referred to by a small integer id. Ids are
+    given in the order the files are added (the walk order).
+    """
+
+    def __init__(self):
+        self.dirs = []
+        self.dir_ids = {}
+        self.file_dirs = array("I")
+        self.file_names = []
+
+    def add(self, path):
+        dirpath, filename = os.path.split(path)
+        dir_id = self.dir_ids.get(dirpath)
+        if dir_id is None:
+            dir_id = self.dir_ids[dirpath] = len(self.dirs)
+            self.dirs.append(dirpath)
+        self.file_dirs.append(dir_id)
+        self.file_names.append(filename)
+        return len(self.file_names) - 1
+
+    def path(self, file_id):
+        return os.path.join(self.dirs[self.file_dirs[file_id]], self.file_names[file_id])
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def memory(self):
+        """Approximate bytes used by the table."""
+        return (sum(sys.getsizeof(name) for name in self.file_names) + sys.getsizeof(self.file_names)
+                + sum(sys.getsizeof(d) for d in self.dirs) + sys.getsizeof(self.dir_ids)
+                + self.file_dirs.itemsize * len(self.file_dirs))
+
+
+class DuplicateIndex:
+    """
+    Groups file ids by binary digest. A digest seen once maps to the id itself, a
+    shared one to an array of ids. When memory_budget (bytes) is set and the estimated
+    size of the index passes it, every entry moves to a SQLite file at spill_path and
+    the groups are then read back with one sorted query.
+    """
+
+    def __init__(self, memory_budget=None, spill_path=None):
+        self.memory_budget = memory_budget
+        self.spill_path = spill_path
+        self.entries = {}
+        self.memory = 0
+        self.count = 0
+        self.conn = None
+        self.pending = []
+
+    @property
+    def spilled(self):
+        return self.conn is not None
+
+    def add(self, digest, file_id):
+        self.count += 1
+        if self.conn is not None:
+            self.pending.append((digest, file_id))
+            if len(self.pending) >= SPILL_BATCH:
+                self._flush()
+            return
+        ids = self.entries.get(digest)
+        if ids is None:
+            self.entries[digest] = file_id
+            self.memory += ENTRY_BYTES
+        elif isinstance(ids, int):
+            self.entries[digest] = array("I", (ids, file_id))
+            self.memory += GROUP_BYTES
+        else:
+            ids.append(file_id)
+            self.memory += ids.itemsize
+        if self.memory_budget is not None and self.memory > self.memory_budget and self.spill_path:
+            self._spill()
+
+    def groups(self):
+        """Yields the sorted ids of every digest shared by several files (ids in walk order)."""
+        if self.conn is None:
+            for ids in self.entries.values():
+                if not isinstance(ids, int):
+                    yield sorted(ids)
+            return
+        self._flush()
+        group_digest = None
+        group = []
+        for digest, file_id in self.conn.execute("SELECT digest, file FROM entries ORDER BY digest, file"):
+            if digest != group_digest:
+                if len(group) > 1:
+                    yield group
+                group_digest, group = digest, []
+            group.append(file_id)
+        if len(group) > 1:
+            yield group
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            os.remove(self.spill_path)
+        self.entries = {}
+
+    def _spill(self):
+        logging.info(f"Duplicate index over its memory budget ({self.memory_budget} bytes), "
+                     f"moving {self.count} entries to {self.spill_path}")
+        if os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        self.conn = sqlite3.connect(self.spill_path)
+        # Scratch data, rebuilt by the next run if this one is interrupted
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("PRAGMA temp_store=FILE")
+        self.conn.execute("CREATE TABLE entries (digest BLOB NOT NULL, file INTEGER NOT NULL)")
+        for digest, ids in self.entries.items():
+            self.pending.extend((digest, file_id) for file_id in ([ids] if isinstance(ids, int) else ids))
+            if len(self.pending) >= SPILL_BATCH:
+                self._flush()
+        self._flush()
+        self.entries = {}
+        self.memory = 0
+
+    def _flush(self):
+        if self.pending:
+            self.conn.executemany("INSERT INTO entries (digest, file) VALUES (?, ?)", self.pending)
+            self.conn.commit()
+            self.pending = []
@@ -0,0 +1,46 @@
+import os
+import re
+import unicodedata
+
+# Suffixes Google Photos adds to edited copies ("<name><suffix>.<ext>"), by export language.
+# Add the suffix of your export language here if it is missing (or use 2_cleanup_modified.py --suffix).
+EDITED_SUFFIXES = (
+    "-modifié",     # French
+    "-edited",      # English
+    "-bearbeitet",  # German
+    "-modificato",  # Italian
+    "-editado",     # Spanish, Portuguese
+    "-bewerkt",     # Dutch
+)
+
+
+def edited_matcher(suffixes=EDITED_SUFFIXES):
+    """
+    Compiles the suffixes into one regex matching the end of a file name without its
+    extension. Accented suffixes match in both their composed (NFC) and decomposed (NFD)
+    forms, as macOS and some archivers store names decomposed.
+    """
+    variants = set()
+    for suffix in suffixes:
+        variants.add(unicodedata.normalize("NFC", suffix))
+        variants.add(unicodedata.normalize("NFD", suffix))
+    # Longest first, so that a suffix ending another one still wins
+    alternatives = "|".join(re.escape(variant) for variant in sorted(variants, key=len, reverse=True))
+    return re.compile(f"(?:{alternatives})$", re.IGNORECASE)
+
+
+EDITED_MATCHER = edited_matcher()
+
+
+def edited_original(filename, matcher=EDITED_MATCHER):
+    """Returns the name of the original an edited file replaces, or None."""
+    name, ext = os.path.splitext(filename)
+    match = matcher.search(name)
+    if match is None or match.start() == 0:
+        return None
+    return name[:match.start()] + ext
+
+
+def name_key(filename):
+    """Form under which names are compared, so an NFD original pairs with an NFC edited name."""
+    return unicodedata.normalize("NFC", filename)
@@ -0,0 +1,310 @@
+import os
+import time
+import struct
+import logging
+import calendar
+
+import metrics
+
+# Only the headers are read: the EXIF block of photos, the box headers and "mvhd" of videos.
+# A video is never read past a few hundred bytes, whatever its size.
+EXIF_EXTENSIONS = (".jpg", ".jpeg", ".heic", ".heif", ".tif", ".tiff", ".dng")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v", ".3gp", ".mp")
+DATE_EXTENSIONS = EXIF_EXTENSIONS + VIDEO_EXTENSIONS
+
+# JPEG segments looked at before giving up on finding the EXIF block (it is normally the first)
+MAX_JPEG_SEGMENTS = 16
+# Boxes looked at per level of an MP4/MOV/HEIC file
+MAX_BOXES = 64
+# Largest HEIC "meta" box read to find the EXIF item (usually a few KB)
+MAX_META_SIZE = 1 << 20
+# Largest EXIF IFD read (entries are 12 bytes)
+MAX_IFD_ENTRIES = 512
+
+# EXIF tags
+EXIF_IFD_POINTER = 0x8769
+DATETIME = 0x0132
+DATETIME_ORIGINAL = 0x9003
+DATETIME_DIGITIZED = 0x9004
+OFFSET_TIME_ORIGINAL = 0x9011
+
+# Seconds between 1904-01-01 (MP4/MOV epoch) and 1970-01-01
+MP4_EPOCH_OFFSET = 2082844800
+
+
+class BytesReader:
+    """Same interface as HeaderReader, over bytes already read (the "meta" box of a HEIC)."""
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def read(self, offset, size):
+        return self.data[offset:offset + size]
+
+
+class HeaderReader:
+    """Reads small chunks at given offsets of a file, counting the bytes and the reads."""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = os.fstat(f.fileno()).st_size
+        self.bytes_read = 0
+        self.reads = 0
+
+    def read(self, offset, size):
+        if offset < 0 or offset >= self.size:
+            return b""
+        self.f.seek(offset)
+        data = self.f.read(min(size, self.size - offset))
+        self.bytes_read += len(data)
+        self.reads += 1
+        return data
+
+
+def parse_exif_datetime(value, offset=None):
+    """
+    "YYYY:MM:DD HH:MM:SS" to a unix timestamp. EXIF dates are in the local time of the
+    camera: with an OffsetTimeOriginal ("+02:00") it is used, otherwise the local time
+    of this computer is assumed. Returns None for blank or invalid dates.
+    """
+    try:
+        fields = time.strptime(value.strip(), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    try:
+        if offset and len(offset) == 6 and offset[0] in "+-":
+            sign = -1 if offset[0] == "-" else 1
+            seconds = sign * (int(offset[1:3]) * 3600 + int(offset[4:6]) * 60)
+            return calendar.timegm(fields) - seconds
+        return time.mktime(fields)
+    except (ValueError, OverflowError):
+        return None
+
+
+def read_tiff_date(reader, base):
+    """Returns the date of the EXIF (TIFF) block starting at base in the file, or None."""
+    header = reader.read(base, 8)
+    if header[:4] == b"II*\x00":
+        endian = "<"
+    elif header[:4] == b"MM\x00*":
+        endian = ">"
+    else:
+        return None
+
+    def read_ifd(offset):
+        count_data = reader.read(base + offset, 2)
+        if len(count_data) < 2:
+            return {}
+        count = min(struct.unpack(endian + "H", count_data)[0], MAX_IFD_ENTRIES)
+        data = reader.read(base + offset + 2, count * 12)
+        entries = {}
+        for i in range(len(data) // 12):
+            tag, kind, length = struct.unpack(endian + "HHI", data[i * 12:i * 12 + 8])
+            entries[tag] = (kind, length, data[i * 12 + 8:i * 12 + 12])
+        return entries
+
+    def ascii_value(entry):
+        kind, length, value = entry
+        # Type 2 is ASCII; up to 4 bytes are stored in the entry itself
+        if kind != 2 or length == 0:
+            return None
+        if length > 4:
+            value = reader.read(base + struct.unpack(endian + "I", value)[0], length)
+        return value[:length].split(b"\x00", 1)[0].decode("ascii", "replace")
+
+    ifd0 = read_ifd(struct.unpack(endian + "I", header[4:8])[0])
+    exif = {}
+    if EXIF_IFD_POINTER in ifd0:
+        exif = read_ifd(struct.unpack(endian + "I", ifd0[EXIF_IFD_POINTER][2])[0])
+
+    offset = ascii_value(exif[OFFSET_TIME_ORIGINAL]) if OFFSET_TIME_ORIGINAL in exif else None
+    for tags, tag in ((exif, DATETIME_ORIGINAL), (exif, DATETIME_DIGITIZED), (ifd0, DATETIME)):
+        if tag in tags:
+            value = ascii_value(tags[tag])
+            timestamp = parse_exif_datetime(value, offset) if value else None
+            if timestamp is not None:
+                return timestamp
+    return None
+
+
+def read_jpeg_date(reader):
+    """Finds the APP1 "Exif" segment among the first segments of a JPEG."""
+    offset = 2
+    for _ in range(MAX_JPEG_SEGMENTS):
+        marker = reader.read(offset, 4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        # Start of scan: the image data begins, there are no more metadata segments
+        if marker[1] == 0xDA:
+            return None
+        length = struct.unpack(">H", marker[2:4])[0]
+        if marker[1] == 0xE1 and reader.read(offset + 4, 6) == b"Exif\x00\x00":
+            return read_tiff_date(reader, offset + 10)
+        offset += 2 + length
+    return None
+
+
+def boxes(reader, start, end):
+    """Yields (type, payload start, payload end) of the ISO BMFF boxes between start and end."""
+    offset = start
+    for _ in range(MAX_BOXES):
+        if offset + 8 > end:
+            return
+        header = reader.read(offset, 16)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header[:8])
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                return
+            size = struct.unpack(">Q", header[8:16])[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield kind, offset + header_size, min(offset + size, end)
+        offset += size
+
+
+def read_video_date(reader):
+    """Creation time of the "mvhd" box of an MP4/MOV file (UTC), found by skipping from box to box."""
+    for kind, start, end in boxes(reader, 0, reader.size):
+        if kind != b"moov":
+            continue
+        for child, child_start, _ in boxes(reader, start, end):
+            if child != b"mvhd":
+                continue
+            data = reader.read(child_start, 12)
+            if len(data) < 8:
+                return None
+            if data[0] == 1 and len(data) == 12:
+                created = struct.unpack(">Q", data[4:12])[0]
+            else:
+                created = struct.unpack(">I", data[4:8])[0]
+            # 0 means "not set"
+            return created - MP4_EPOCH_OFFSET if created else None
+        return None
+    return None
+
+
+def read_heic_date(reader):
+    """Finds the "Exif" item of a HEIC file through its "iinf" and "iloc" boxes."""
+    for kind, start, end in boxes(reader, 0, reader.size):
+        if kind == b"meta":
+            if end - start > MAX_META_SIZE:
+                return None
+            meta = reader.read(start, end - start)
+            break
+    else:
+        return None
+    exif_item = None
+    locations = {}
+    # "meta" is a full box: 4 bytes of version and flags before its children
+    for kind, box_start, box_end in boxes(BytesReader(meta), 4, len(meta)):
+        if kind == b"iinf":
+            exif_item = _exif_item_id(meta, box_start, box_end)
+        elif kind == b"iloc":
+            locations = _item_locations(meta, box_start, box_end)
+    if exif_item is None or exif_item not in locations:
+        return None
+    offset = locations[exif_item]
+    # The item starts with the offset of the TIFF header after these 4 bytes
+    skip = reader.read(offset, 4)
+    if len(skip) < 4:
+        return None
+    return read_tiff_date(reader, offset + 4 + struct.unpack(">I", skip)[0])
+
+
+def _exif_item_id(data, start, end):
+    version = data[start]
+    if version == 0:
+        entries_start = start + 6
+    else:
+        entries_start = start + 8
+    for kind, infe_start, _ in boxes(BytesReader(data), entries_start, end):
+        # Item info entries of version 2 and 3 have an item type; Exif is never an older one
+        if kind != b"infe" or data[infe_start] < 2:
+            continue
+        if data[infe_start] == 2:
+            item_id = struct.unpack(">H", data[infe_start + 4:infe_start + 6])[0]
+            item_type = data[infe_start + 8:infe_start + 12]
+        else:
+            item_id = struct.unpack(">I", data[infe_start + 4:infe_start + 8])[0]
+            item_type = data[infe_start + 10:infe_start + 14]
+        if item_type == b"Exif":
+            return item_id
+    return None
+
+
+def _item_locations(data, start, end):
+    """Returns {item id: file offset of its first extent} of an "iloc" box (stored in the file only)."""
+    version = data[start]
+    position = start + 4
+
+    def number(size):
+        nonlocal position
+        value = int.from_bytes(data[position:position + size], "big")
+        position += size
+        return value
+
+    sizes = number(2)
+    offset_size, length_size = sizes >> 12, (sizes >> 8) & 0xF
+    base_offset_size, index_size = (sizes >> 4) & 0xF, sizes & 0xF
+    item_count = number(2 if version < 2 else 4)
+    locations = {}
+    for _ in range(item_count):
+        if position >= end:
+            break
+        item_id = number(2 if version < 2 else 4)
+        construction_method = number(2) & 0xF if version in (1, 2) else 0
+        number(2)  # data reference index
+        base_offset = number(base_offset_size)
+        extent_count = number(2)
+        first_offset = None
+        for extent in range(extent_count):
+            if version in (1, 2) and index_size:
+                number(index_size)
+            extent_offset = number(offset_size)
+            number(length_size)
+            if extent == 0:
+                first_offset = extent_offset
+        # Method 0 is an offset in the file; 1 and 2 (inside "idat" or another item) are not read
+        if construction_method == 0 and first_offset is not None:
+            locations[item_id] = base_offset + first_offset
+    return locations
+
+
+def embedded_date(path):
+    """
+    Returns the capture date stored in the file itself (EXIF DateTimeOriginal of a
+    JPEG/HEIC/TIFF, creation time of an MP4/MOV), as a unix timestamp, or None.
+    """
+    lower = path.lower()
+    if not lower.endswith(DATE_EXTENSIONS):
+        return None
+    start = time.perf_counter()
+    timestamp = None
+    reader = None
+    try:
+        with open(path, "rb") as f:
+            reader = HeaderReader(f)
+            magic = reader.read(0, 12)
+            if magic[:2] == b"\xff\xd8":
+                timestamp = read_jpeg_date(reader)
+            elif magic[:4] in (b"II*\x00", b"MM\x00*"):
+                timestamp = read_tiff_date(reader, 0)
+            elif magic[4:8] == b"ftyp" and magic[8:12] in (b"heic", b"heix", b"mif1", b"heim", b"heis", b"msf1"):
+                timestamp = read_heic_date(reader)
+            elif len(magic) >= 8:
+                timestamp = read_video_date(reader)
+    except (OSError, struct.error, IndexError) as e:
+        logging.warning(f"Could not read the embedded date of {path}: {e}")
+        timestamp = None
+    if reader is not None:
+        # open, fstat, one seek and read per chunk, close
+        metrics.active().record("embedded date", time.perf_counter() - start,
+                                bytes_read=reader.bytes_read, syscalls=3 + 2 * reader.reads)
+    return timestamp
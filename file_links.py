@@ -0,0 +1,102 @@
+import os
+import errno
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl cloning a whole file (Linux: btrfs, XFS, bcachefs, overlayfs on those...)
+FICLONE = 0x40049409
+# Errors meaning the filesystem (or the pair of files) cannot be cloned: fall back to a hardlink
+REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM}
+
+# st_dev of the filesystems where a clone already failed, not tried again
+_no_reflink = set()
+
+# Set by main.py --link-duplicates, so 4_final_cleanup.py links duplicates when run by it
+LINK_MODE_ENV = "PIPELINE_DUPLICATE_LINKS"
+
+
+def temp_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f".{filename}.link-tmp")
+
+
+def clone_file(src, dst):
+    """Creates dst as a reflink (copy-on-write clone) of src. Raises OSError if not supported."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform", dst)
+    with open(src, "rb") as source, open(dst, "wb") as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+
+
+def identity(stats):
+    """What tells a file apart from a changed or replaced one: device, inode, size and mtime."""
+    return stats.st_dev, stats.st_ino, stats.st_size, stats.st_mtime_ns
+
+
+def check_unchanged(kept, duplicate, size, hashed=None):
+    """
+    Raises OSError if kept or duplicate is no longer the file that was hashed: hashed is
+    (duplicate stats, kept stats) as hashed, else only the sizes are compared.
+    Returns their current stats.
+    """
+    kept_stats = os.stat(kept)
+    duplicate_stats = os.stat(duplicate)
+    if hashed is not None:
+        changed = identity(duplicate_stats) != identity(hashed[0]) or identity(kept_stats) != identity(hashed[1])
+    else:
+        changed = kept_stats.st_size != size or duplicate_stats.st_size != size
+    if changed:
+        raise OSError(errno.ESTALE, "file changed since it was hashed", duplicate)
+    return kept_stats, duplicate_stats
+
+
+def link_duplicate(kept, duplicate, size, reflink=False, hashed=None):
+    """
+    Replaces duplicate with a reflink of kept (if reflink and the filesystem supports it)
+    or a hardlink to it. The link is made next to duplicate, checked, then renamed over
+    it, so duplicate is never missing. Both files are checked against hashed (see
+    check_unchanged) before and right before the rename. Returns "reflink" or "hardlink".
+    """
+    kept_stats, duplicate_stats = check_unchanged(kept, duplicate, size, hashed)
+    if (kept_stats.st_dev, kept_stats.st_ino) == (duplicate_stats.st_dev, duplicate_stats.st_ino):
+        return "hardlink"
+
+    tmp = temp_path(duplicate)
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    method = "hardlink"
+    try:
+        if reflink and kept_stats.st_dev not in _no_reflink:
+            try:
+                clone_file(kept, tmp)
+                # The clone is a new file: it keeps the timestamps of the copy it replaces
+                shutil.copystat(duplicate, tmp)
+                method = "reflink"
+            except OSError as e:
+                if e.errno not in REFLINK_UNSUPPORTED:
+                    raise
+                _no_reflink.add(kept_stats.st_dev)
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+        if method == "hardlink":
+            os.link(kept, tmp)
+
+        tmp_stats = os.stat(tmp)
+        if method == "hardlink":
+            valid = (tmp_stats.st_dev, tmp_stats.st_ino) == (kept_stats.st_dev, kept_stats.st_ino)
+        else:
+            valid = tmp_stats.st_size == size
+        if not valid:
+            raise OSError(errno.EIO, f"{method} check failed", tmp)
+        # Nothing may have written to either file while the link was made
+        check_unchanged(kept, duplicate, size, (duplicate_stats, kept_stats))
+        os.replace(tmp, duplicate)
+    except OSError:
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        raise
+    return method
@@ -0,0 +1,151 @@
+import os
+import json
+import random
+import logging
+import argparse
+from datetime import datetime
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Defaults of a small but representative export
+PARTS = 3
+# Named albums, besides the "Photos de <year>" folders every photo is in
+ALBUMS = 10
+FILES_PER_ALBUM = 50
+# Sizes follow a log-normal distribution around SIZE_MEDIAN bytes, capped at SIZE_MAX
+SIZE_MEDIAN = 256 * 1024
+SIZE_SIGMA = 1.0
+SIZE_MAX = 64 * 1024 * 1024
+# Fractions of the photos
+DUPLICATE_RATE = 0.2      # also in another takeout part, same album and name
+ALBUM_COPY_RATE = 0.3     # also in a named album, as Google exports album photos twice
+EDITED_RATE = 0.05        # with an -modifié version
+LONG_NAME_RATE = 0.05     # name long enough for Google to truncate the sidecar name
+LEGACY_SIDECAR_RATE = 0.2  # IMG.JPG.json instead of IMG.JPG.supplemental-metadata.json
+MP_RATE = 0.1             # motion photo, with an .MP companion
+
+# Google cuts sidecar names (without ".json") to this many characters
+SIDECAR_NAME_LIMIT = 46
+SUPPLEMENTAL_SUFFIX = ".supplemental-metadata"
+
+# Photo dates are spread over these years
+FIRST_YEAR = 2005
+LAST_YEAR = 2024
+
+
+def sidecar_name(media_name, legacy):
+    if legacy:
+        base = media_name
+    else:
+        base = media_name + SUPPLEMENTAL_SUFFIX
+    return base[:SIDECAR_NAME_LIMIT] + ".json"
+
+
+def sidecar_content(media_name, taken):
+    return json.dumps({
+        "title": media_name,
+        "creationTime": {"timestamp": str(taken + 86400), "formatted": ""},
+        "photoTakenTime": {"timestamp": str(taken), "formatted": ""},
+        "modificationTime": {"timestamp": str(taken + 3600), "formatted": ""},
+    }, indent=2)
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def generate(output_dir, parts=PARTS, albums=ALBUMS, files_per_album=FILES_PER_ALBUM,
+             size_median=SIZE_MEDIAN, size_sigma=SIZE_SIGMA, duplicate_rate=DUPLICATE_RATE,
+             album_copy_rate=ALBUM_COPY_RATE, edited_rate=EDITED_RATE, long_name_rate=LONG_NAME_RATE,
+             legacy_sidecar_rate=LEGACY_SIDECAR_RATE, mp_rate=MP_RATE, seed=0):
+    """
+    Writes parts fake 'takeout-*/Takeout/Google Photos/' trees under output_dir,
+    with albums * files_per_album photos. Photos live in "Photos de <year>" folders,
+    some also in named albums, and each is written to one part (plus another part
+    for duplicates).
+    Returns (files written, bytes written).
+    """
+    rng = random.Random(seed)
+    part_dirs = [os.path.join(output_dir, f"takeout-20250101T000000Z-{i + 1:03d}", "Takeout", "Google Photos")
+                 for i in range(parts)]
+    album_names = [f"Album {i + 1:03d}" for i in range(albums)]
+    count_files = 0
+    count_bytes = 0
+
+    def place(album, name, data, taken, part_indexes, legacy):
+        nonlocal count_files, count_bytes
+        for part in part_indexes:
+            album_dir = os.path.join(part_dirs[part], album)
+            write_file(os.path.join(album_dir, name), data)
+            write_file(os.path.join(album_dir, sidecar_name(name, legacy)), sidecar_content(name, taken).encode())
+            count_files += 2
+            count_bytes += len(data)
+
+    first = int(datetime(FIRST_YEAR, 1, 1).timestamp())
+    last = int(datetime(LAST_YEAR + 1, 1, 1).timestamp()) - 1
+    for i in range(max(1, albums) * files_per_album):
+        taken = rng.randint(first, last)
+        year_album = f"Photos de {datetime.fromtimestamp(taken).year}"
+        if rng.random() < long_name_rate:
+            name = f"PXL_{i:06d}_{rng.randrange(10 ** 9):09d}.MP.PORTRAIT-ORIGINAL-SHOT.jpg"
+        else:
+            name = f"IMG_{i:05d}.JPG"
+        size = min(SIZE_MAX, max(1, int(rng.lognormvariate(0, size_sigma) * size_median)))
+        data = rng.randbytes(size)
+        legacy = rng.random() < legacy_sidecar_rate
+
+        part_indexes = [rng.randrange(parts)]
+        if parts > 1 and rng.random() < duplicate_rate:
+            part_indexes.append((part_indexes[0] + 1 + rng.randrange(parts - 1)) % parts)
+        place(year_album, name, data, taken, part_indexes, legacy)
+
+        if album_names and rng.random() < album_copy_rate:
+            place(rng.choice(album_names), name, data, taken, [rng.randrange(parts)], legacy)
+
+        if rng.random() < edited_rate:
+            stem, ext = os.path.splitext(name)
+            edited = rng.randbytes(max(1, size // 2))
+            write_file(os.path.join(part_dirs[part_indexes[0]], year_album, f"{stem}-modifié{ext}"), edited)
+            count_files += 1
+            count_bytes += len(edited)
+
+        if rng.random() < mp_rate:
+            stem = os.path.splitext(name)[0]
+            motion = rng.randbytes(max(1, size // 4))
+            write_file(os.path.join(part_dirs[part_indexes[0]], year_album, f"{stem}.MP"), motion)
+            count_files += 1
+            count_bytes += len(motion)
+
+    return count_files, count_bytes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a fake Google Photos takeout for benchmarks.")
+    parser.add_argument("output_dir", nargs="?", default=".", help="where the takeout-* folders are written")
+    parser.add_argument("--parts", type=int, default=PARTS, help="number of takeout parts")
+    parser.add_argument("--albums", type=int, default=ALBUMS, help="number of named albums, besides the year folders")
+    parser.add_argument("--files-per-album", type=int, default=FILES_PER_ALBUM, help="photos per named album (albums x this many photos in total)")
+    parser.add_argument("--size-median", type=int, default=SIZE_MEDIAN, help="median photo size in bytes")
+    parser.add_argument("--size-sigma", type=float, default=SIZE_SIGMA, help="spread of the log-normal size distribution")
+    parser.add_argument("--duplicate-rate", type=float, default=DUPLICATE_RATE,
+                        help="fraction of photos also written to another part")
+    parser.add_argument("--album-copy-rate", type=float, default=ALBUM_COPY_RATE,
+                        help="fraction of photos also in a named album")
+    parser.add_argument("--edited-rate", type=float, default=EDITED_RATE, help="fraction of photos with a -modifié version")
+    parser.add_argument("--long-name-rate", type=float, default=LONG_NAME_RATE,
+                        help="fraction of photos whose sidecar name is truncated")
+    parser.add_argument("--legacy-sidecar-rate", type=float, default=LEGACY_SIDECAR_RATE,
+                        help="fraction of sidecars named <photo>.json")
+    parser.add_argument("--mp-rate", type=float, default=MP_RATE, help="fraction of photos with an .MP file")
+    parser.add_argument("--seed", type=int, default=0, help="random seed, the same seed gives the same takeout")
+    args = parser.parse_args()
+
+    files, size = generate(
+        args.output_dir, parts=args.parts, albums=args.albums, files_per_album=args.files_per_album,
+        size_median=args.size_median, size_sigma=args.size_sigma, duplicate_rate=args.duplicate_rate,
+        album_copy_rate=args.album_copy_rate, edited_rate=args.edited_rate, long_name_rate=args.long_name_rate,
+        legacy_sidecar_rate=args.legacy_sidecar_rate, mp_rate=args.mp_rate, seed=args.seed
+    )
+    logging.info(f"Generated {files} files ({size} bytes) in {os.path.abspath(args.output_dir)}")
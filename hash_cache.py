@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import time
+
+# Stored next to Unified_photos so it is never picked up by the cleanup walks
+DEFAULT_CACHE_PATH = os.path.abspath("hash_cache.sqlite")
+
+# Number of pending writes before committing to disk
+COMMIT_BATCH = 1000
+
+# Bumped whenever the table layout changes, older caches are simply rebuilt
+SCHEMA_VERSION = 2
+
+
+class HashCache:
+    """
+    Persistent content-hash cache backed by SQLite.
+    An entry is reused only if path, size, mtime_ns, inode and hash algorithm
+    all still match, so any modification of a file invalidates its cached digest.
+    """
+
+    def __init__(self, db_path=DEFAULT_CACHE_PATH):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS hashes")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        # Duplicates already replaced by a reflink of the kept file (they keep their own inode)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS clones ("
+            " path TEXT PRIMARY KEY,"
+            " kept TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " kept_mtime_ns INTEGER NOT NULL,"
+            " kept_inode INTEGER NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " inode INTEGER NOT NULL,"
+            " algorithm TEXT NOT NULL,"
+            " digest TEXT NOT NULL,"
+            " run_id INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+        # Every entry looked up or stored during this run is tagged with run_id,
+        # anything left with an older run_id at the end is stale.
+        self.run_id = time.time_ns()
+        self.pending = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, path, stats, algorithm):
+        """Returns the cached digest for path if the file is unchanged, else None."""
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, inode, algorithm, digest FROM hashes WHERE path = ?", (path,)
+        ).fetchone()
+        if row and row[:4] == (stats.st_size, stats.st_mtime_ns, stats.st_ino, algorithm):
+            self.conn.execute("UPDATE hashes SET run_id = ? WHERE path = ?", (self.run_id, path))
+            self._count_write()
+            self.hits += 1
+            return row[4]
+        self.misses += 1
+        return None
+
+    def store(self, path, stats, digest, algorithm):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, inode, algorithm, digest, run_id)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, stats.st_size, stats.st_mtime_ns, stats.st_ino, algorithm, digest, self.run_id)
+        )
+        self._count_write()
+
+    def is_clone(self, path, stats, kept, kept_stats):
+        """True if path was made a reflink of kept by an earlier run and neither file changed since."""
+        row = self.conn.execute(
+            "SELECT kept, size, mtime_ns, inode, kept_mtime_ns, kept_inode FROM clones WHERE path = ?", (path,)
+        ).fetchone()
+        return row is not None and row == (kept, stats.st_size, stats.st_mtime_ns, stats.st_ino,
+                                           kept_stats.st_mtime_ns, kept_stats.st_ino)
+
+    def store_clone(self, path, stats, kept, kept_stats):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO clones (path, kept, size, mtime_ns, inode, kept_mtime_ns, kept_inode)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, kept, stats.st_size, stats.st_mtime_ns, stats.st_ino, kept_stats.st_mtime_ns, kept_stats.st_ino)
+        )
+        self._count_write()
+
+    def mark_seen(self, paths):
+        """Keeps the entries of files that still exist but did not need a lookup this run."""
+        self.conn.executemany("UPDATE hashes SET run_id = ? WHERE path = ?", ((self.run_id, p) for p in paths))
+        self.conn.commit()
+        self.pending = 0
+
+    def forget(self, path):
+        """Drops the entry of a file that was deleted during this run."""
+        self.conn.execute("DELETE FROM hashes WHERE path = ?", (path,))
+        self._count_write()
+
+    def evict_stale(self):
+        """Removes entries for files that were not seen during this run."""
+        cursor = self.conn.execute("DELETE FROM hashes WHERE run_id != ?", (self.run_id,))
+        self.conn.commit()
+        self.pending = 0
+        return cursor.rowcount
+
+    def clear(self):
+        self.conn.execute("DELETE FROM hashes")
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def _count_write(self):
+        self.pending += 1
+        if self.pending >= COMMIT_BATCH:
+            self.conn.commit()
+            self.pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
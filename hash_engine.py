@@ -0,0 +1,140 @@
+import os
+import mmap
+import time
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+import metrics
+
+DEFAULT_ALGORITHM = "sha256"
+DEFAULT_WORKERS = 4
+# Files handed to the pool ahead of the one being returned; bounds memory whatever the number of files
+QUEUE_DEPTH = 64
+
+# Read buffer used when hashlib.file_digest is unavailable or a size is forced
+FALLBACK_BUFFER_SIZE = 1024 * 1024
+
+# sha256 and blake2b are cryptographic, xxh3 is much faster but only guards against accidental collisions
+ALGORITHMS = ("sha256", "blake2b", "xxh3")
+
+
+def new_hasher(algorithm):
+    if algorithm == "sha256":
+        return hashlib.sha256()
+    if algorithm == "blake2b":
+        return hashlib.blake2b()
+    if algorithm == "xxh3":
+        return xxhash.xxh3_128()
+    raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+
+def resolve_algorithm(algorithm):
+    """Returns the algorithm that will actually be used, falling back if xxhash is not installed."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm: {algorithm} (choose from {', '.join(ALGORITHMS)})")
+    if algorithm == "xxh3" and xxhash is None:
+        logging.warning("xxhash module is not installed, falling back to blake2b.")
+        return "blake2b"
+    return algorithm
+
+
+class HashEngine:
+    """
+    Hashes files with a selectable algorithm on a pool of threads.
+    hashlib releases the GIL while digesting large buffers, so threads
+    keep several disks (or a deep NVMe queue) busy at once.
+    """
+
+    def __init__(self, algorithm=DEFAULT_ALGORITHM, workers=DEFAULT_WORKERS, buffer_size=None, use_mmap=False,
+                 queue_depth=QUEUE_DEPTH):
+        self.algorithm = resolve_algorithm(algorithm)
+        self.workers = max(1, workers)
+        self.queue_depth = max(self.workers, queue_depth)
+        # None lets hashlib.file_digest choose its buffer when available
+        self.buffer_size = buffer_size
+        self.use_mmap = use_mmap
+
+    def hash_file(self, file_path):
+        """Returns the hex digest of a file, or None if it could not be read."""
+        start = time.perf_counter()
+        hasher = new_hasher(self.algorithm)
+        bytes_read = 0
+        try:
+            with open(file_path, "rb") as f:
+                if self.use_mmap and os.fstat(f.fileno()).st_size > 0:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                        hasher.update(m)
+                        bytes_read = len(m)
+                elif self.buffer_size is None and hasattr(hashlib, "file_digest"):
+                    hasher = hashlib.file_digest(f, lambda: hasher)
+                    bytes_read = f.tell()
+                else:
+                    buffer = bytearray(self.buffer_size or FALLBACK_BUFFER_SIZE)
+                    view = memoryview(buffer)
+                    while True:
+                        size = f.readinto(buffer)
+                        if not size:
+                            break
+                        hasher.update(view[:size])
+                        bytes_read += size
+            return hasher.hexdigest()
+        except Exception as e:
+            logging.error(f"Error calculating hash for {file_path}: {e}")
+            return None
+        finally:
+            # open, fstat, close and one read per buffer (plus the last, empty one)
+            chunks = bytes_read // (self.buffer_size or FALLBACK_BUFFER_SIZE) + 2
+            metrics.active().record("hash", time.perf_counter() - start, bytes_read=bytes_read,
+                                    syscalls=3 + chunks)
+
+    def partial_hash(self, file_path, size, block_size):
+        """Returns the hex digest of the first and last block_size bytes of a file."""
+        start = time.perf_counter()
+        hasher = new_hasher(self.algorithm)
+        try:
+            with open(file_path, "rb") as f:
+                hasher.update(f.read(block_size))
+                if size > block_size:
+                    f.seek(max(size - block_size, block_size))
+                    hasher.update(f.read(block_size))
+            return hasher.hexdigest()
+        except Exception as e:
+            logging.error(f"Error calculating partial hash for {file_path}: {e}")
+            return None
+        finally:
+            # open, read, seek, read, close
+            metrics.active().record("partial hash", time.perf_counter() - start,
+                                    bytes_read=min(size, 2 * block_size), syscalls=5)
+
+    def hash_many(self, paths):
+        """Yields (path, digest) for every path, in input order."""
+        yield from self._map(lambda path: (path, self.hash_file(path)), paths)
+
+    def partial_hash_many(self, entries, block_size):
+        """Yields (path, digest) for every (path, size) entry, in input order."""
+        yield from self._map(lambda entry: (entry[0], self.partial_hash(entry[0], entry[1], block_size)), entries)
+
+    def _map(self, func, items):
+        """
+        Yields func(item) for every item, in input order. Items are read from the iterable
+        as results are yielded: at most queue_depth of them are in the pool at once.
+        """
+        if self.workers == 1:
+            for item in items:
+                yield func(item)
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            in_flight = deque()
+            for item in items:
+                if len(in_flight) >= self.queue_depth:
+                    yield in_flight.popleft().result()
+                in_flight.append(pool.submit(func, item))
+            while in_flight:
+                yield in_flight.popleft().result()
@@ -0,0 +1,144 @@
+import os
+import time
+import struct
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import metrics
+
+# "ssd": files are read in walk order on many threads, as before.
+# "hdd": reads and copies are sorted by their position on the disk and run on HDD_WORKERS
+# thread(s), so a spinning disk sweeps in one direction instead of seeking back and forth.
+IO_MODES = ("ssd", "hdd")
+DEFAULT_IO_MODE = "ssd"
+# Set by main.py --io-mode, so the stage scripts it starts order their I/O the same way
+IO_MODE_ENV = "PIPELINE_IO_MODE"
+HDD_WORKERS = 1
+
+# ioctl returning the physical extents of a file (Linux); struct fiemap is 32 bytes, each extent 56
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = "=QQIIII"
+FIEMAP_EXTENT_SIZE = 56
+# Extent flags: location not known yet (e.g. delayed allocation of a file just written)
+FIEMAP_EXTENT_UNKNOWN = 0x2
+FIEMAP_EXTENT_DELALLOC = 0x4
+
+# st_dev of the filesystems without FIEMAP, where files are ordered by inode instead
+_no_fiemap = set()
+
+# Kind of position of a file that cannot be stat'ed (e.g. deleted since it was planned): after
+# every other file, in the given order, so the operation on it fails and is reported on its own
+MISSING = 2
+
+
+def io_mode(mode=None):
+    mode = mode or os.environ.get(IO_MODE_ENV, DEFAULT_IO_MODE)
+    if mode not in IO_MODES:
+        raise ValueError(f"Unknown I/O mode: {mode} (choose from {', '.join(IO_MODES)})")
+    return mode
+
+
+def io_workers(workers, mode=None):
+    """Number of threads to read with: workers, or HDD_WORKERS on a spinning disk."""
+    return min(workers, HDD_WORKERS) if io_mode(mode) == "hdd" else workers
+
+
+def physical_offset(path, stats):
+    """Position on the device of the first extent of a file (FIEMAP), or None if it cannot be read."""
+    if fcntl is None or stats.st_dev in _no_fiemap:
+        return None
+    request = bytearray(struct.pack(FIEMAP_HEADER, 0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(FIEMAP_EXTENT_SIZE))
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+    except OSError:
+        _no_fiemap.add(stats.st_dev)
+        return None
+    finally:
+        os.close(fd)
+    mapped_extents = struct.unpack_from("=I", request, 20)[0]
+    if not mapped_extents:
+        # Empty file
+        return None
+    # fe_logical, fe_physical, fe_length, 2 reserved, fe_flags
+    extent = struct.calcsize(FIEMAP_HEADER)
+    physical = struct.unpack_from("=Q", request, extent + 8)[0]
+    flags = struct.unpack_from("=I", request, extent + 40)[0]
+    if flags & (FIEMAP_EXTENT_UNKNOWN | FIEMAP_EXTENT_DELALLOC):
+        return None
+    return physical
+
+
+def disk_positions(files):
+    """
+    Sort keys of where the data of files is, given as (path, stats or None): (device, 0,
+    physical offset), or (device, 1, inode) for every file of a device where one file has
+    no known extent, so byte offsets and inode numbers are never compared. A file that
+    cannot be stat'ed gets (inf, MISSING, its index).
+    """
+    stats = []
+    for path, file_stats in files:
+        if file_stats is None:
+            try:
+                file_stats = os.stat(path)
+            except OSError:
+                pass
+        stats.append(file_stats)
+    offsets = [physical_offset(path, file_stats) if file_stats is not None else None
+               for (path, _), file_stats in zip(files, stats)]
+    by_inode = {file_stats.st_dev for file_stats, offset in zip(stats, offsets)
+                if file_stats is not None and offset is None}
+    positions = []
+    for index, (file_stats, offset) in enumerate(zip(stats, offsets)):
+        if file_stats is None:
+            positions.append((float("inf"), MISSING, index))
+        elif file_stats.st_dev in by_inode:
+            positions.append((file_stats.st_dev, 1, file_stats.st_ino))
+        else:
+            positions.append((file_stats.st_dev, 0, offset))
+    return positions
+
+
+def seek_distances(positions):
+    """Sums of the jumps between consecutive positions on the same device: (bytes, inode numbers)."""
+    distances = [0, 0]
+    for previous, current in zip(positions, positions[1:]):
+        if previous[:2] == current[:2] and current[1] != MISSING:
+            distances[current[1]] += abs(current[2] - previous[2])
+    return distances
+
+
+def disk_order(items, locate, mode=None, label="I/O"):
+    """
+    Returns items in the order their data is laid out on disk in hdd mode (unchanged in ssd
+    mode). locate(item) returns (path, stats or None). Ties keep their order.
+    """
+    if io_mode(mode) != "hdd" or len(items) < 2:
+        return items
+    start = time.perf_counter()
+    positions = disk_positions([locate(item) for item in items])
+    order = sorted(range(len(items)), key=positions.__getitem__)
+    bytes_before, inodes_before = seek_distances(positions)
+    bytes_after, inodes_after = seek_distances([positions[i] for i in order])
+    by_extent = sum(1 for position in positions if position[1] == 0)
+    missing = sum(1 for position in positions if position[1] == MISSING)
+    # stat is usually in the inventory; open, ioctl, close per file
+    metrics.active().record("io order", time.perf_counter() - start, files=len(items), syscalls=3 * len(items))
+    if by_extent:
+        metrics.active().count("seek bytes before ordering", bytes_before)
+        metrics.active().count("seek bytes after ordering", bytes_after)
+    if by_extent + missing < len(items):
+        metrics.active().count("seek inodes before ordering", inodes_before)
+        metrics.active().count("seek inodes after ordering", inodes_after)
+    logging.info(f"{label}: {len(items)} files sorted by disk position, {by_extent} by physical extent "
+                 f"(estimated seek {bytes_before} -> {bytes_after} bytes), {len(items) - by_extent - missing} by "
+                 f"inode (estimated seek {inodes_before} -> {inodes_after} inode numbers)"
+                 + (f", {missing} not found (last)" if missing else ""))
+    return [items[i] for i in order]
@@ -1,6 +1,18 @@
 import subprocess
 import os
 import sys
+import logging
+import argparse
+import importlib
+
+# (script, entry point) of each stage for the in-process mode
+STAGES = [
+    ("1_organize_photos.py", "organize_photos"),
+    ("2_cleanup_modified.py", "cleanup_modified_files"),
+    ("3_update_metadata.py", "main"),
+    ("4_final_cleanup.py", "final_cleanup"),
+    ("5_filter_by_date.py", "filter_photos"),
+]
 
 def run_script(script_name):
     print(f"\n>>> Running {script_name}...")
@@ -13,29 +25,131 @@ def run_script(script_name):
         print(f"!!! Error running {script_name}: {e}")
         return False
 
-def main():
-    scripts = [
-        "1_organize_photos.py",
-        "2_cleanup_modified.py",
-        "3_update_metadata.py",
-        "4_final_cleanup.py",
-        "5_filter_by_date.py"
-    ]
+def stage_completed(script):
+    """True if a previous run already completed this stage (see run_state.py)."""
+    from run_state import RunState, STATE_PATH
+    if not os.path.exists(STATE_PATH):
+        return False
+    with RunState() as state:
+        return state.stage_done(script[:-len(".py")])
 
-    print("==========================================")
-    print("   Google Photos Takeout Orchestrator     ")
-    print("==========================================")
-    print(f"Starting the organization process in: {os.getcwd()}")
-    
-    for script in scripts:
+def run_in_process():
+    """
+    Runs every stage in this process. Stage 1 fills Unified_photos, then a single
+    inventory of it is built and handed to stages 2 to 5, which update it as they
+    rename, move or delete files instead of walking the tree again.
+    """
+    # Configured before the stages are imported, so all of them log to the same file
+    from pipeline_logging import setup_logging
+    setup_logging("pipeline_log.txt")
+    from inventory import Inventory
+    from run_state import run_stage
+
+    inventory = None
+    for script, entry_point in STAGES:
         if not os.path.exists(script):
             print(f"Warning: {script} not found, skipping.")
             continue
-            
-        success = run_script(script)
-        if not success:
+
+        print(f"\n>>> Running {script} (in-process)...")
+        try:
+            stage_name = script[:-len(".py")]
+            module = importlib.import_module(stage_name)
+            stage = getattr(module, entry_point)
+            if stage_completed(script):
+                print(f">>> {script} already completed in a previous run, skipping.")
+                continue
+            if script == STAGES[0][0]:
+                completed = run_stage(stage_name, stage)
+            else:
+                if inventory is None:
+                    inventory = Inventory.scan(os.path.abspath("Unified_photos"))
+                    print(f">>> Inventory built: {inventory.count_files()} files.")
+                completed = run_stage(stage_name, stage, inventory=inventory)
+        except Exception as e:
+            logging.exception(f"Error running {script}: {e}")
             print(f"\nExecution halted due to error in {script}.")
             sys.exit(1)
+        if not completed:
+            print(f"\nExecution halted: {script} had nothing to work on (see the log).")
+            sys.exit(1)
+        print(f">>> {script} completed successfully.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run all organization stages in order.")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run the stages in this process, sharing one file inventory between them")
+    parser.add_argument("--restart", action="store_true",
+                        help="forget the progress of previous runs and run every stage from the start")
+    parser.add_argument("--profile", nargs="?", const="cpu", choices=("cpu", "memory"),
+                        help="profile every stage with cProfile (cpu, the default) or tracemalloc (memory) "
+                             "and save the reports in profiles/")
+    parser.add_argument("--io-mode", choices=("ssd", "hdd"),
+                        help="ssd: read and move files in walk order on several threads (default); hdd: in the "
+                             "order they are laid out on the disk, one at a time")
+    parser.add_argument("--link-duplicates", nargs="?", choices=("reflink", "hardlink"), const="reflink",
+                        help="stage 4 replaces duplicates with links to the kept copy instead of deleting them: "
+                             "reflink (default, falls back to hardlinks) or hardlink")
+    parser.add_argument("--log-mode", choices=("full", "summary"),
+                        help="full: one log line per file (default); summary: per-file events go to "
+                             "pipeline_events.jsonl and the console shows their counts every few seconds")
+    args = parser.parse_args()
+
+    scripts = [script for script, _ in STAGES]
+
+    print("==========================================")
+    print("   Google Photos Takeout Orchestrator     ")
+    print("==========================================")
+    print(f"Starting the organization process in: {os.getcwd()}")
+
+    if args.restart:
+        from run_state import RunState
+        with RunState() as state:
+            state.reset()
+        print("Progress of previous runs cleared.")
+
+    if args.log_mode:
+        from pipeline_logging import LOG_MODE_ENV
+        os.environ[LOG_MODE_ENV] = args.log_mode
+
+    if args.io_mode:
+        from io_order import IO_MODE_ENV
+        os.environ[IO_MODE_ENV] = args.io_mode
+
+    if args.link_duplicates:
+        # Read by 4_final_cleanup.py, in this process or in the script it starts
+        from file_links import LINK_MODE_ENV
+        os.environ[LINK_MODE_ENV] = args.link_duplicates
+
+    if args.profile:
+        # Read by run_stage, in this process and in the stage scripts it starts
+        from metrics import PROFILE_ENV
+        os.environ[PROFILE_ENV] = args.profile
+
+    if args.in_process:
+        run_in_process()
+    else:
+        for script in scripts:
+            if not os.path.exists(script):
+                print(f"Warning: {script} not found, skipping.")
+                continue
+            if stage_completed(script):
+                print(f"\n>>> {script} already completed in a previous run, skipping.")
+                continue
+
+            success = run_script(script)
+            if not success:
+                print(f"\nExecution halted due to error in {script}.")
+                sys.exit(1)
+            if not stage_completed(script):
+                print(f"\nExecution halted: {script} had nothing to work on (see its log).")
+                sys.exit(1)
+
+    # A finished run leaves no progress behind: the next one (e.g. after adding takeout parts) starts over
+    from run_state import RunState, STATE_PATH
+    if os.path.exists(STATE_PATH):
+        with RunState() as state:
+            state.reset()
 
     print("\n==========================================")
     print("   ALL STEPS COMPLETED SUCCESSFULLY!      ")
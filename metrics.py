@@ -0,0 +1,267 @@
+import os
+import io
+import sys
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows: the peak memory is not reported
+    resource = None
+
+# One JSON line per stage run: time, files, bytes and system calls per phase, throughput samples
+METRICS_PATH = os.path.abspath("pipeline_metrics.jsonl")
+# Seconds between two updates of the progress line, which are also the throughput samples
+PROGRESS_INTERVAL = 1.0
+
+# Set by main.py --profile to "cpu" (cProfile) or "memory" (tracemalloc), read by run_stage
+PROFILE_ENV = "PIPELINE_PROFILE"
+PROFILE_DIR = os.path.abspath("profiles")
+# Lines kept in the text reports
+PROFILE_TOP = 40
+
+
+def peak_rss():
+    """Peak resident memory of this process in bytes, or None where it cannot be read."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class ConsoleLine:
+    """
+    The progress line, at the bottom of the console (stderr, where the log lines go too).
+    The console log handlers clear it under lock before writing a record, so log lines
+    never land on it; the next update draws it again. Not shown if stderr is not a terminal.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.width = 0
+
+    @staticmethod
+    def stream():
+        stream = sys.stderr
+        try:
+            return stream if stream is not None and stream.isatty() else None
+        except ValueError:
+            # Closed at exit
+            return None
+
+    def show(self, text):
+        with self.lock:
+            stream = self.stream()
+            if stream is None:
+                return
+            stream.write(text.ljust(self.width) + "\r")
+            stream.flush()
+            self.width = len(text)
+
+    def clear(self):
+        with self.lock:
+            stream = self.stream()
+            if self.width and stream is not None:
+                stream.write(" " * self.width + "\r")
+                stream.flush()
+            self.width = 0
+
+    def end(self):
+        """Keeps the last progress line on screen and moves below it."""
+        with self.lock:
+            stream = self.stream()
+            if self.width and stream is not None:
+                stream.write("\n")
+                stream.flush()
+            self.width = 0
+
+
+console = ConsoleLine()
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class StageMetrics:
+    """
+    Time, files, bytes read and system calls of a stage, per phase (walk, stat, hash,
+    parse, utime, move, delete...). Phases run on worker threads add up the time of
+    every thread, so they can exceed the wall time. System calls are estimated by the
+    code that records them, not traced.
+    """
+
+    def __init__(self, stage=None):
+        self.stage = stage
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.samples = []
+        self.lock = threading.Lock()
+        # label -> (time, done) when the progress of that label was first reported
+        self.baselines = {}
+        # label -> done at the last update of the line
+        self.reported = {}
+        # Totals that are not per phase (e.g. the seek distance saved by io_order.py)
+        self.counters = {}
+        self.last_progress = 0.0
+
+    def record(self, phase, seconds, files=1, bytes_read=0, syscalls=0):
+        with self.lock:
+            totals = self.phases.get(phase)
+            if totals is None:
+                totals = self.phases[phase] = {"seconds": 0.0, "files": 0, "bytes_read": 0, "syscalls": 0}
+            totals["seconds"] += seconds
+            totals["files"] += files
+            totals["bytes_read"] += bytes_read
+            totals["syscalls"] += syscalls
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def timed(self, phase, files=1, bytes_read=0, syscalls=1):
+        return _Timer(self, phase, files, bytes_read, syscalls)
+
+    def progress(self, label, done, total=None):
+        """
+        Reports that done of total items of label are finished. At most every PROGRESS_INTERVAL,
+        samples the throughput and rewrites the progress line with the files/sec and the ETA.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            base_time, base_done = self.baselines.setdefault(label, (now, done))
+            if self.reported.get(label) == done:
+                return
+            if now - self.last_progress < PROGRESS_INTERVAL and done != total:
+                return
+            self.last_progress = now
+            self.reported[label] = done
+            rate = (done - base_done) / (now - base_time) if now > base_time else 0.0
+            eta = (total - done) / rate if total and rate > 0 else None
+            self.samples.append({
+                "elapsed": round(now - self.start, 2),
+                "label": label,
+                "done": done,
+                "total": total,
+                "files_per_sec": round(rate, 1),
+            })
+            line = f"{label}: {done}" + (f"/{total}" if total else "") + f" files, {rate:.0f} files/sec"
+            if eta is not None:
+                line += f", ETA {format_duration(eta)}"
+            console.show(line)
+
+    def summary(self, completed=True):
+        wall_time = time.perf_counter() - self.start
+        phases = {}
+        for phase, totals in sorted(self.phases.items()):
+            phases[phase] = dict(totals, seconds=round(totals["seconds"], 4))
+            if totals["seconds"] > 0:
+                phases[phase]["files_per_sec"] = round(totals["files"] / totals["seconds"], 1)
+        return {
+            "stage": self.stage,
+            "completed": completed,
+            "started_at": self.started_at,
+            "wall_time": round(wall_time, 4),
+            "peak_rss": peak_rss(),
+            "bytes_read": sum(totals["bytes_read"] for totals in self.phases.values()),
+            "syscalls": sum(totals["syscalls"] for totals in self.phases.values()),
+            "phases": phases,
+            "counters": self.counters,
+            "samples": self.samples,
+        }
+
+    def save(self, path=METRICS_PATH, completed=True):
+        """Ends the progress line, logs the time per phase and appends the metrics to path."""
+        console.end()
+        result = self.summary(completed)
+        for phase, totals in result["phases"].items():
+            logging.info(f"[{self.stage}] {phase}: {totals['seconds']:.2f}s, {totals['files']} files, "
+                         f"{totals['bytes_read']} bytes read, ~{totals['syscalls']} system calls")
+        for name, value in result["counters"].items():
+            logging.info(f"[{self.stage}] {name}: {value}")
+        rss = f", peak RSS {result['peak_rss']} bytes" if result["peak_rss"] is not None else ""
+        logging.info(f"[{self.stage}] wall time {result['wall_time']:.2f}s{rss} (metrics in {path})")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+        return result
+
+
+class _Timer:
+    def __init__(self, metrics, phase, files, bytes_read, syscalls):
+        self.metrics = metrics
+        self.phase = phase
+        self.files = files
+        self.bytes_read = bytes_read
+        self.syscalls = syscalls
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.phase, time.perf_counter() - self.start, self.files, self.bytes_read, self.syscalls)
+
+
+# Metrics of the running stage. Outside of a stage they are collected but never saved.
+_active = StageMetrics()
+
+
+def active():
+    return _active
+
+
+def begin(stage):
+    global _active
+    _active = StageMetrics(stage)
+    return _active
+
+
+def end(completed=True):
+    global _active
+    metrics, _active = _active, StageMetrics()
+    return metrics.save(completed=completed)
+
+
+def run_profiled(stage, func, kwargs, mode):
+    """
+    Runs func(**kwargs) under cProfile ("cpu") or tracemalloc ("memory") and writes the
+    report to PROFILE_DIR. cProfile only sees the calling thread: work done on the
+    hashing and metadata pools shows up as time waiting for their results.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    if mode == "memory":
+        tracemalloc.start(25)
+        try:
+            return func(**kwargs)
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report_path = os.path.join(PROFILE_DIR, f"{stage}.memory.txt")
+            with open(report_path, "w", encoding="utf-8") as f:
+                f.write(f"Peak traced memory: {peak} bytes, still allocated at the end: {current} bytes\n\n")
+                for stat in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                    f.write(f"{stat}\n")
+            logging.info(f"Memory profile of {stage} written to {report_path} (peak {peak} bytes).")
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(**kwargs)
+    finally:
+        profiler.disable()
+        profile_path = os.path.join(PROFILE_DIR, f"{stage}.prof")
+        profiler.dump_stats(profile_path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        with open(os.path.join(PROFILE_DIR, f"{stage}.txt"), "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+        logging.info(f"CPU profile of {stage} written to {profile_path} (open it with pstats or snakeviz).")
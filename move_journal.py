@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import errno
+import shutil
+import logging
+
+import metrics
+from plan import COPY_CHUNK
+
+# Moves are journaled and fsynced in batches of this many files
+JOURNAL_BATCH = 256
+
+
+def move_file(src, dst):
+    """Renames src to dst, creating the parent folder; copies only across filesystems."""
+    start = time.perf_counter()
+    # makedirs stats the parent, then the rename (a copy reads and writes every chunk)
+    syscalls = 2
+    bytes_read = 0
+    try:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            bytes_read = os.path.getsize(src)
+            shutil.move(src, dst)
+            syscalls += 8 + 2 * max(1, -(-bytes_read // COPY_CHUNK))
+    finally:
+        metrics.active().record("move", time.perf_counter() - start, bytes_read=bytes_read, syscalls=syscalls)
+
+
+class MoveJournal:
+    """
+    Append-only journal of the files moved from src_root to dst_root (paths are relative).
+
+    Each batch is written ahead as "move" (or "revert") records and fsynced before any
+    file is touched, then followed by a "commit" record once the batch is done.
+    After a crash, records after the last commit are checked against the disk and
+    completed, so both trees are always back in a known state.
+    """
+
+    def __init__(self, journal_path, src_root, dst_root, batch_size=JOURNAL_BATCH):
+        self.journal_path = journal_path
+        self.src_root = src_root
+        self.dst_root = dst_root
+        self.batch_size = batch_size
+        self.pending = []
+        self.f = None
+
+    def _open(self):
+        if self.f is None:
+            self.f = open(self.journal_path, "a", encoding="utf-8")
+        return self.f
+
+    def _write(self, records, sync):
+        f = self._open()
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        if sync:
+            os.fsync(f.fileno())
+
+    def read_records(self):
+        """Returns the journal records, ignoring a last line cut by a crash."""
+        if not os.path.exists(self.journal_path):
+            return []
+        records = []
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+
+    def _paths(self, rel_path):
+        return os.path.join(self.src_root, rel_path), os.path.join(self.dst_root, rel_path)
+
+    def _apply(self, op, rel_path):
+        src, dst = self._paths(rel_path)
+        if op == "revert":
+            src, dst = dst, src
+        move_file(src, dst)
+
+    def recover(self):
+        """Completes the batch that was in progress when the last run stopped. Returns the files finished."""
+        records = self.read_records()
+        last_commit = max((i for i, r in enumerate(records) if r["op"] == "commit"), default=-1)
+        unfinished = records[last_commit + 1:]
+        if not unfinished:
+            return 0
+
+        finished = 0
+        for record in unfinished:
+            src, dst = self._paths(record["path"])
+            if record["op"] == "revert":
+                src, dst = dst, src
+            # Done already if the file is only at its destination
+            if os.path.exists(src) and not os.path.exists(dst):
+                try:
+                    self._apply(record["op"], record["path"])
+                    finished += 1
+                except OSError as e:
+                    logging.error(f"Error completing journaled move of {record['path']}: {e}")
+        self._write([{"op": "commit"}], sync=True)
+        logging.info(f"Recovered interrupted batch from {self.journal_path}: {finished} file(s) completed.")
+        return finished
+
+    def add(self, rel_path, op="move"):
+        """Queues a move. Returns [(rel_path, error)] for the batch executed, if any."""
+        self.pending.append((op, rel_path))
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """Journals and executes the pending moves. Returns [(rel_path, error or None)]."""
+        if not self.pending:
+            return []
+        batch, self.pending = self.pending, []
+        self._write([{"op": op, "path": rel_path} for op, rel_path in batch], sync=True)
+
+        results = []
+        for op, rel_path in batch:
+            try:
+                self._apply(op, rel_path)
+                results.append((rel_path, None))
+            except OSError as e:
+                results.append((rel_path, e))
+        # Not synced: if lost, recovery finds the files already moved
+        self._write([{"op": "commit"}], sync=False)
+        return results
+
+    def moved_paths(self):
+        """Returns the journaled moves that were not reverted, oldest first."""
+        moved = {}
+        for record in self.read_records():
+            if record["op"] == "move":
+                moved[record["path"]] = True
+            elif record["op"] == "revert":
+                moved.pop(record["path"], None)
+        return list(moved)
+
+    def close(self):
+        if self.pending:
+            self.flush()
+        if self.f is not None:
+            os.fsync(self.f.fileno())
+            self.f.close()
+            self.f = None
+
+    def remove(self):
+        """Deletes the journal once everything it recorded has been reverted."""
+        self.close()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
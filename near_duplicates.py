@@ -0,0 +1,195 @@
+import os
+import time
+import logging
+from array import array
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Files decoded for the perceptual hash; videos and sidecars are skipped.
+# HEIC needs a Pillow plugin (pillow-heif), without it those files are listed as unreadable.
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff", ".heic")
+
+# "dhash" (brightness gradient between neighbour pixels) or "ahash" (pixels above the mean),
+# both on an 8x8 grid: 64-bit hashes
+METHODS = ("dhash", "ahash")
+HASH_SIZE = 8
+# Two photos are near duplicates when their hashes differ by at most this many bits
+HAMMING_RADIUS = 3
+# Narrowest band compared (see band_masks): narrower ones take so few values that nearly
+# every bucket goes over MAX_BUCKET. The radius is at most 64 // 10 - 1 = 5 bits.
+MIN_BAND_WIDTH = 10
+MAX_RADIUS = HASH_SIZE * HASH_SIZE // MIN_BAND_WIDTH - 1
+HASH_WORKERS = os.cpu_count() or 1
+# Files handed to a worker process at once
+CHUNK_SIZE = 64
+# Bands with more photos sharing a value than this are degenerate hashes (blank or
+# uniform images); comparing them all would be quadratic, so they are skipped and counted
+MAX_BUCKET = 1000
+
+
+def image_hash(path, method="dhash"):
+    """Returns the 64-bit perceptual hash of an image, or None if it cannot be decoded."""
+    try:
+        with Image.open(path) as img:
+            # JPEGs are decoded at a reduced scale, much cheaper than a full decode
+            img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+            gray = img.convert("L")
+    except Exception:
+        return None
+    if method == "ahash":
+        pixels = gray.resize((HASH_SIZE, HASH_SIZE), Image.BILINEAR).tobytes()
+        mean = sum(pixels) / len(pixels)
+        bits = (pixel > mean for pixel in pixels)
+    else:
+        pixels = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).tobytes()
+        row = HASH_SIZE + 1
+        bits = (pixels[y * row + x] < pixels[y * row + x + 1] for y in range(HASH_SIZE) for x in range(HASH_SIZE))
+    value = 0
+    for bit in bits:
+        value = (value << 1) | bit
+    return value
+
+
+def band_masks(radius, bits=HASH_SIZE * HASH_SIZE):
+    """
+    Splits the hash into radius + 1 bands of (shift, mask). Two hashes at most radius
+    bits apart are equal on at least one band, so only photos sharing a band are compared.
+    Raises ValueError if the bands would be narrower than MIN_BAND_WIDTH bits.
+    """
+    if radius < 0 or bits // (radius + 1) < MIN_BAND_WIDTH:
+        raise ValueError(f"Near-duplicate radius must be between 0 and {bits // MIN_BAND_WIDTH - 1} bits, not {radius}")
+    bands = radius + 1
+    width, extra = divmod(bits, bands)
+    masks = []
+    shift = 0
+    for band in range(bands):
+        band_width = width + (1 if band < extra else 0)
+        masks.append((shift, (1 << band_width) - 1))
+        shift += band_width
+    return masks
+
+
+def similar_pairs(hashes, radius):
+    """
+    Yields (i, j, distance) for every pair of hashes at most radius bits apart, once each.
+    For every band, the photos are sorted by the value of that band and only runs of
+    equal values are compared: memory stays at one index list, never O(n²) pairs.
+    """
+    bands = band_masks(radius)
+    skipped = 0
+    # Per band, the values whose bucket was too large to compare
+    oversized = []
+    for band, (shift, mask) in enumerate(bands):
+        oversized.append(set())
+        order = array("I", sorted(range(len(hashes)), key=lambda i: (hashes[i] >> shift) & mask))
+        start = 0
+        while start < len(order):
+            value = (hashes[order[start]] >> shift) & mask
+            end = start + 1
+            while end < len(order) and (hashes[order[end]] >> shift) & mask == value:
+                end += 1
+            if end - start > MAX_BUCKET:
+                skipped += end - start
+                oversized[band].add(value)
+            else:
+                for a in range(start, end):
+                    for b in range(a + 1, end):
+                        i, j = order[a], order[b]
+                        diff = hashes[i] ^ hashes[j]
+                        distance = bin(diff).count("1")
+                        # A pair sharing an earlier band was already reported there, unless that bucket was skipped
+                        if distance <= radius and not any(
+                                not (diff >> s) & m and (hashes[i] >> s) & m not in oversized[earlier]
+                                for earlier, (s, m) in enumerate(bands[:band])):
+                            yield min(i, j), max(i, j), distance
+            start = end
+    if skipped:
+        logging.warning(f"Near duplicates: {skipped} photo(s) in oversized hash buckets (blank or uniform "
+                        f"images) were not compared.")
+
+
+class NearDuplicateReport:
+    """Groups of visually similar photos, for review. Nothing is deleted."""
+
+    def __init__(self):
+        # [[(path, distance to the first photo of the group), ...], ...]
+        self.groups = []
+        self.unreadable = []
+        self.hashed = 0
+
+    def write(self, report_path):
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(f"# Photos hashed: {self.hashed}\n")
+            f.write(f"# Groups of near duplicates: {len(self.groups)}\n")
+            for number, group in enumerate(self.groups, 1):
+                f.write(f"GROUP {number}\n")
+                for path, distance in group:
+                    f.write(f"\t{distance}\t{path}\n")
+            f.write(f"# Photos that could not be decoded: {len(self.unreadable)}\n")
+            for path in self.unreadable:
+                f.write(f"UNREADABLE\t{path}\n")
+
+
+def find_near_duplicates(paths, radius=HAMMING_RADIUS, method="dhash", workers=HASH_WORKERS):
+    """
+    Hashes the images among paths on a pool of worker processes and groups the ones
+    within radius bits of each other. Returns a NearDuplicateReport.
+    Memory per photo is one 64-bit hash and an index: the paths are not copied.
+    """
+    report = NearDuplicateReport()
+    images = [path for path in paths if path.lower().endswith(IMAGE_EXTENSIONS)]
+    stage_metrics = metrics.active()
+    start = time.perf_counter()
+
+    # Hashes of the decoded images, and the position of each one in images
+    hashes = array("Q")
+    positions = array("I")
+    hash_one = partial(image_hash, method=method)
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(hash_one, images, chunksize=CHUNK_SIZE)
+    else:
+        pool = None
+        results = map(hash_one, images)
+    for position, value in enumerate(results):
+        if value is None:
+            report.unreadable.append(images[position])
+        else:
+            hashes.append(value)
+            positions.append(position)
+        stage_metrics.progress("Perceptual hashing", position + 1, len(images))
+    if pool:
+        pool.shutdown()
+    report.hashed = len(hashes)
+    stage_metrics.record("perceptual hash", time.perf_counter() - start, files=len(images))
+
+    # Union-find over the photos that have at least one near duplicate
+    parents = {}
+
+    def find(i):
+        while parents.get(i, i) != i:
+            parents[i] = parents.get(parents[i], parents[i])
+            i = parents[i]
+        return i
+
+    for i, j, _ in similar_pairs(hashes, radius):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+        parents.setdefault(i, i)
+        parents.setdefault(j, j)
+
+    groups = {}
+    for i in sorted(parents):
+        groups.setdefault(find(i), []).append(i)
+    for members in groups.values():
+        first = hashes[members[0]]
+        report.groups.append([(images[positions[i]], bin(hashes[i] ^ first).count("1")) for i in members])
+    return report
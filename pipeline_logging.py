@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+import metrics
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# "full": one log line per file, on the console and in the log file, as before.
+# "summary": per-file events go to EVENTS_PATH and the console shows their counts every SUMMARY_INTERVAL.
+LOG_MODES = ("full", "summary")
+DEFAULT_LOG_MODE = "full"
+# Set by main.py --log-mode, so the stage scripts it starts log the same way
+LOG_MODE_ENV = "PIPELINE_LOG_MODE"
+
+EVENTS_PATH = os.path.abspath("pipeline_events.jsonl")
+SUMMARY_INTERVAL = 5.0
+
+
+def is_event(record):
+    return getattr(record, "event", None) is not None
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """Console handler that clears the progress line of metrics.py before writing a record."""
+
+    def emit(self, record):
+        with metrics.console.lock:
+            metrics.console.clear()
+            super().emit(record)
+
+
+class SummaryHandler(ConsoleHandler):
+    """Console handler that prints the per-file events as counts, at most every interval seconds."""
+
+    def __init__(self, interval=SUMMARY_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self.counts = {}
+        self.last = time.monotonic()
+
+    def emit(self, record):
+        if not is_event(record):
+            # Counts so far first, to keep the console in order
+            self.emit_counts(record)
+            super().emit(record)
+            return
+        self.counts[record.event] = self.counts.get(record.event, 0) + 1
+        if time.monotonic() - self.last >= self.interval:
+            self.emit_counts(record)
+
+    def emit_counts(self, record=None):
+        """Prints the counts since the last summary, dated like record (the record being handled)."""
+        now = time.monotonic()
+        if self.counts:
+            text = ", ".join(f"{count} {kind}" for kind, count in self.counts.items())
+            summary = logging.makeLogRecord({"msg": f"Last {now - self.last:.0f}s: {text}",
+                                             "levelno": logging.INFO, "levelname": "INFO"})
+            if record is not None:
+                summary.created = record.created
+                summary.msecs = record.msecs
+            super().emit(summary)
+            self.counts = {}
+        self.last = now
+
+    def close(self):
+        self.acquire()
+        try:
+            self.emit_counts()
+        finally:
+            self.release()
+        super().close()
+
+
+class EventHandler(logging.Handler):
+    """Appends the per-file events to a JSON lines file, one compact object per event."""
+
+    def __init__(self, path=EVENTS_PATH):
+        super().__init__()
+        self.f = open(path, "a", encoding="utf-8")
+
+    def emit(self, record):
+        if not is_event(record):
+            return
+        event = {"time": round(record.created, 3), "stage": record.stage, "event": record.event,
+                 "path": record.path, "level": record.levelname}
+        event.update(record.fields)
+        self.f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.acquire()
+        try:
+            self.f.close()
+        finally:
+            self.release()
+        super().close()
+
+
+def setup_logging(log_file, mode=None):
+    """
+    Logs at INFO to log_file and to the console, like logging.basicConfig did, but the
+    handlers run on a background thread: the stages only put records on a queue.
+    Does nothing if logging is already set up (the stages run by main.py --in-process).
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    mode = mode or os.environ.get(LOG_MODE_ENV, DEFAULT_LOG_MODE)
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    if mode == "summary":
+        file_handler.addFilter(lambda record: not is_event(record))
+        handlers = [file_handler, SummaryHandler(), EventHandler()]
+    else:
+        handlers = [file_handler, ConsoleHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+
+    def stop():
+        # Writes what is still queued, then the last counts of the summary
+        listener.stop()
+        for handler in handlers:
+            handler.close()
+    atexit.register(stop)
+
+
+def file_event(kind, path, message, **fields):
+    """
+    Logs the INFO line of something that happens to one file. In the summary mode it
+    goes to the event log with fields instead, and is counted on the console as kind.
+    """
+    logging.info(message, extra={"event": kind, "path": path, "fields": fields, "stage": metrics.active().stage})
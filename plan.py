@@ -0,0 +1,220 @@
+import os
+import time
+import shutil
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import io_order
+from file_links import link_duplicate
+
+# kind: "mkdir", "move", "rename", "replace" (a rename over an existing file), "link", "delete" or "rmdir"
+# copy: the move crosses filesystems, so the file is copied then deleted
+# (for a link: try a reflink before falling back to a hardlink)
+# A link replaces src with a link to dst, the copy that is kept
+# stats: for a link, the (src, dst) stat results the files were hashed with
+Operation = namedtuple("Operation", "kind src dst size copy stats", defaults=(None,))
+
+# Chunk size used to estimate the read/write calls of a copy
+COPY_CHUNK = 1024 * 1024
+
+
+def syscalls(op):
+    """Rough number of system calls an operation issues."""
+    if op.kind == "move" and op.copy:
+        # open/fstat x2, read + write per chunk, close x2, utime, unlink
+        return 8 + 2 * max(1, -(-op.size // COPY_CHUNK))
+    if op.kind == "link":
+        # stat x2, link (or open x2, ioctl, close x2), stat, rename
+        return 8 if op.copy else 5
+    return 1
+
+
+class Plan:
+    """
+    Filesystem operations a stage decides on before touching anything.
+    Planning only reads the tree. Executing runs the folders to create, then the
+    moves, renames and deletes grouped by source folder (folders in path order,
+    operations in plan order inside each), then the folders to remove, in plan order.
+    A dry run prints the plan and its estimated cost instead of executing it.
+    """
+
+    def __init__(self):
+        self.ops = []
+        self.by_dst = {}
+        self.cancelled = set()
+
+    def _add(self, op):
+        if op.dst is not None and op.kind != "link":
+            self.by_dst[op.dst] = len(self.ops)
+        self.ops.append(op)
+
+    def mkdir(self, path):
+        self._add(Operation("mkdir", path, None, 0, False))
+
+    def move(self, src, dst, size=0, copy=False):
+        self._add(Operation("move", src, dst, size, copy))
+
+    def rename(self, src, dst, size=0):
+        self._add(Operation("rename", src, dst, size, False))
+
+    def replace(self, src, dst, size=0):
+        """Renames src over dst in one atomic step, dst is never missing."""
+        self._add(Operation("replace", src, dst, size, False))
+
+    def link(self, path, kept, size=0, reflink=False, stats=None):
+        """
+        Replaces the file at path with a hardlink (or reflink) to kept, an identical file.
+        stats: (path stats, kept stats) when hashed, the link is not made if either changed since.
+        """
+        self._add(Operation("link", path, kept, size, reflink, stats))
+
+    def delete(self, path, size=0):
+        self._add(Operation("delete", path, None, size, False))
+
+    def rmdir(self, path):
+        self._add(Operation("rmdir", path, None, 0, False))
+
+    def merge(self, other):
+        """Appends the operations of another plan (e.g. one planned separately for an album)."""
+        for op in other.operations():
+            self._add(op)
+
+    def source_of(self, path):
+        """Where the file planned to end up at path is now (path itself if nothing is planned)."""
+        index = self.by_dst.get(path)
+        if index is None or index in self.cancelled:
+            return path
+        return self.ops[index].src
+
+    def cancel(self, dst):
+        """Drops the planned move, rename or replace to dst. Returns False if there was none."""
+        index = self.by_dst.pop(dst, None)
+        if index is None or index in self.cancelled:
+            return False
+        self.cancelled.add(index)
+        return True
+
+    def operations(self, *kinds):
+        return [op for i, op in enumerate(self.ops) if i not in self.cancelled and (not kinds or op.kind in kinds)]
+
+    def batches(self):
+        """Returns [(folder, operations)] of the moves, renames, replaces, links and deletes, by source folder."""
+        groups = {}
+        for op in self.operations("move", "rename", "replace", "link", "delete"):
+            groups.setdefault(os.path.dirname(op.src), []).append(op)
+        return sorted(groups.items())
+
+    def disk_ordered_batches(self, io_mode=None):
+        """
+        The operations of batches, in execution order. In the hdd I/O mode (see io_order.py), the
+        batches made only of moves are sorted by where their files are on the disk, each batch
+        run from its first file in that order; the other batches keep plan order and run after.
+        """
+        batches = [ops for _, ops in self.batches()]
+        if io_order.io_mode(io_mode) != "hdd":
+            return batches
+        only_moves = [all(op.kind == "move" for op in ops) for ops in batches]
+        moves = [op for ops, movable in zip(batches, only_moves) if movable for op in ops]
+        grouped = {}
+        for op in io_order.disk_order(moves, lambda op: (op.src, None), io_mode, label="Plan"):
+            grouped.setdefault(os.path.dirname(op.src), []).append(op)
+        return list(grouped.values()) + [ops for ops, movable in zip(batches, only_moves) if not movable]
+
+    def estimate(self):
+        """Returns counts per kind, bytes copied, bytes deleted, bytes linked and the estimated system calls."""
+        counts = {}
+        bytes_copied = 0
+        bytes_deleted = 0
+        bytes_linked = 0
+        calls = 0
+        for op in self.operations():
+            counts[op.kind] = counts.get(op.kind, 0) + 1
+            if op.kind == "move" and op.copy:
+                bytes_copied += op.size
+            elif op.kind == "delete":
+                bytes_deleted += op.size
+            elif op.kind == "link":
+                bytes_linked += op.size
+            calls += syscalls(op)
+        return counts, bytes_copied, bytes_deleted, bytes_linked, calls
+
+    def log_summary(self, title):
+        counts, bytes_copied, bytes_deleted, bytes_linked, calls = self.estimate()
+        kinds = ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items())) or "nothing to do"
+        logging.info(f"{title}: {kinds} in {len(self.batches())} folder batch(es)")
+        linked = f", {bytes_linked} bytes linked" if bytes_linked else ""
+        logging.info(f"Estimated: {bytes_copied} bytes copied, {bytes_deleted} bytes deleted{linked}, ~{calls} system calls")
+
+    def print_plan(self):
+        """Prints every operation, in execution order."""
+        for op in self.operations("mkdir"):
+            print(f"MKDIR   {op.src}")
+        for _, ops in self.batches():
+            for op in ops:
+                if op.dst is None:
+                    print(f"{op.kind.upper():<8}{op.src}")
+                else:
+                    print(f"{op.kind.upper():<8}{op.src} -> {op.dst}")
+        for op in self.operations("rmdir"):
+            print(f"RMDIR   {op.src}")
+
+    def execute(self, workers=1, io_mode=None):
+        """
+        Runs the plan. Folder batches are independent of each other and run on
+        workers threads (HDD_WORKERS in the hdd I/O mode, in disk order).
+        Returns [(operation, error or None)] in execution order.
+        """
+        workers = io_order.io_workers(workers, io_mode)
+        stage_metrics = metrics.active()
+        total = len(self.operations())
+        stage_metrics.progress("Executing plan", 0, total)
+        results = []
+        for op in self.operations("mkdir"):
+            results.append(run_operation(op))
+
+        batches = self.disk_ordered_batches(io_mode)
+        if workers > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for batch_results in pool.map(run_batch, batches):
+                    results.extend(batch_results)
+                    stage_metrics.progress("Executing plan", len(results), total)
+        else:
+            for ops in batches:
+                results.extend(run_batch(ops))
+                stage_metrics.progress("Executing plan", len(results), total)
+
+        for op in self.operations("rmdir"):
+            results.append(run_operation(op))
+        stage_metrics.progress("Executing plan", len(results), total)
+        return results
+
+
+def run_operation(op):
+    start = time.perf_counter()
+    try:
+        if op.kind == "mkdir":
+            os.makedirs(op.src, exist_ok=True)
+        elif op.kind == "move" and op.copy:
+            shutil.move(op.src, op.dst)
+        elif op.kind in ("move", "rename"):
+            os.rename(op.src, op.dst)
+        elif op.kind == "replace":
+            os.replace(op.src, op.dst)
+        elif op.kind == "link":
+            link_duplicate(op.dst, op.src, op.size, reflink=op.copy, hashed=op.stats)
+        elif op.kind == "delete":
+            os.remove(op.src)
+        elif op.kind == "rmdir":
+            os.rmdir(op.src)
+        return op, None
+    except OSError as e:
+        return op, e
+    finally:
+        metrics.active().record("move" if op.kind in ("rename", "replace") else op.kind, time.perf_counter() - start,
+                                bytes_read=op.size if op.kind == "move" and op.copy else 0, syscalls=syscalls(op))
+
+
+def run_batch(ops):
+    return [run_operation(op) for op in ops]
@@ -0,0 +1,128 @@
+import os
+import time
+import logging
+import sqlite3
+
+import metrics
+
+STATE_PATH = os.path.abspath("pipeline_state.sqlite")
+
+# Stages in pipeline order: running one again invalidates the ones after it
+STAGE_ORDER = [
+    "1_organize_photos",
+    "2_cleanup_modified",
+    "3_update_metadata",
+    "4_final_cleanup",
+    "5_filter_by_date",
+]
+
+# Number of file checkpoints written before committing to disk
+CHECKPOINT_BATCH = 500
+
+
+class RunState:
+    """
+    Progress of a pipeline run: a completion marker per stage, and the files a stage
+    has already finished while it runs, so an interrupted run continues where it stopped.
+    File checkpoints are committed in batches; at most one batch is redone after a crash.
+    """
+
+    def __init__(self, db_path=STATE_PATH):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS stages (stage TEXT PRIMARY KEY, completed_at REAL)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints (stage TEXT, item TEXT, PRIMARY KEY (stage, item))"
+        )
+        self.conn.commit()
+        self.pending = 0
+
+    def stage_done(self, stage):
+        return self.conn.execute("SELECT 1 FROM stages WHERE stage = ?", (stage,)).fetchone() is not None
+
+    def begin_stage(self, stage):
+        """Clears the marker of this stage and all the progress of the stages after it."""
+        later = STAGE_ORDER[STAGE_ORDER.index(stage) + 1:] if stage in STAGE_ORDER else []
+        self.conn.execute("DELETE FROM stages WHERE stage = ?", (stage,))
+        for later_stage in later:
+            self.reset_stage(later_stage)
+        self.conn.commit()
+
+    def complete_stage(self, stage):
+        self.conn.execute("DELETE FROM checkpoints WHERE stage = ?", (stage,))
+        self.conn.execute("INSERT OR REPLACE INTO stages (stage, completed_at) VALUES (?, ?)", (stage, time.time()))
+        self.conn.commit()
+        self.pending = 0
+
+    def reset_stage(self, stage):
+        self.conn.execute("DELETE FROM stages WHERE stage = ?", (stage,))
+        self.conn.execute("DELETE FROM checkpoints WHERE stage = ?", (stage,))
+        self.conn.commit()
+
+    def reset(self):
+        self.conn.execute("DELETE FROM stages")
+        self.conn.execute("DELETE FROM checkpoints")
+        self.conn.commit()
+
+    def done_items(self, stage):
+        return {row[0] for row in self.conn.execute("SELECT item FROM checkpoints WHERE stage = ?", (stage,))}
+
+    def checkpoint(self, stage, item, before_commit=None):
+        """
+        Records item as finished. before_commit is called before a batch is committed, to
+        commit first what the checkpoints vouch for (e.g. the catalog rows of stage 3).
+        """
+        self.conn.execute("INSERT OR IGNORE INTO checkpoints (stage, item) VALUES (?, ?)", (stage, item))
+        self.pending += 1
+        if self.pending >= CHECKPOINT_BATCH:
+            if before_commit is not None:
+                before_commit()
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def run_stage(stage, func, restart=False, **kwargs):
+    """
+    Runs a stage unless a previous run already completed it (or restart is set),
+    then records it as completed, unless func returned False because it had nothing
+    to work on (e.g. no Unified_photos yet). Returns False if the stage was skipped
+    or not completed.
+    The metrics of the run are saved (see metrics.py), also when it fails, and it is
+    profiled when PIPELINE_PROFILE is set.
+    """
+    with RunState() as state:
+        if restart:
+            state.reset_stage(stage)
+        if state.stage_done(stage):
+            logging.info(f"{stage} already completed in a previous run, skipping (use --restart to run it again).")
+            return False
+        state.begin_stage(stage)
+    metrics.begin(stage)
+    completed = False
+    try:
+        profile = os.environ.get(metrics.PROFILE_ENV)
+        if profile:
+            result = metrics.run_profiled(stage, func, kwargs, profile)
+        else:
+            result = func(**kwargs)
+        completed = True
+    finally:
+        metrics.end(completed)
+    if result is False:
+        logging.warning(f"{stage} had nothing to work on, it is not recorded as completed.")
+        return False
+    with RunState() as state:
+        state.complete_stage(stage)
+    return True
@@ -0,0 +1,91 @@
+import os
+import re
+
+# Google cuts sidecar names (without the final ".json") to this many characters
+TRUNCATE_LENGTH = 46
+SUPPLEMENTAL_SUFFIX = ".supplemental-metadata"
+# Duplicate names get "(1)", "(2)"... before the extension of the media file,
+# but at the very end (just before ".json") of the sidecar
+NUMBERING = re.compile(r"^(.*)\((\d+)\)$")
+
+
+def sidecar_key(json_name):
+    """
+    Returns the (media name, number) a sidecar describes, e.g.
+    IMG_0001.JPG.supplemental-metadata(1).json -> ("IMG_0001.JPG", "1")
+    IMG_0001.JPG.supplemen.json -> ("IMG_0001.JPG", None)
+    The media name itself may be cut at TRUNCATE_LENGTH characters.
+    """
+    base = json_name[:-len(".json")]
+    number = None
+    match = NUMBERING.match(base)
+    if match:
+        base, number = match.group(1), match.group(2)
+    # Full or truncated ".supplemental-metadata" (down to a lone trailing dot)
+    dot = base.rfind(".")
+    if dot > 0 and SUPPLEMENTAL_SUFFIX.startswith(base[dot:]):
+        base = base[:dot]
+    return base, number
+
+
+def media_keys(filename):
+    """Returns the keys under which the sidecar of a media file can be indexed, best first."""
+    stem, ext = os.path.splitext(filename)
+    match = NUMBERING.match(stem)
+    if match:
+        name, number = match.group(1) + ext, match.group(2)
+    else:
+        name, number = filename, None
+    keys = [(name, number)]
+    if len(name) > TRUNCATE_LENGTH:
+        keys.append((name[:TRUNCATE_LENGTH], number))
+    # Some exports name the sidecar after the stem only (IMG_0001.json)
+    name_stem = os.path.splitext(name)[0]
+    if name_stem and name_stem != name:
+        keys.append((name_stem, number))
+    return keys
+
+
+class SidecarIndex:
+    """
+    Maps the media files of one directory to their JSON sidecars.
+    Built from a single listing, each lookup is a few dictionary accesses.
+    """
+
+    def __init__(self, names):
+        self.names = set(names)
+        self.by_key = {}
+        for name in sorted(self.names):
+            if name.lower().endswith(".json"):
+                self.by_key.setdefault(sidecar_key(name), []).append(name)
+
+    def lookup(self, filename):
+        """
+        Returns (json_name, candidates). json_name is None when nothing matches;
+        more than one candidate means the match was ambiguous and the first one was used.
+        """
+        for exact in (filename + ".json", filename + SUPPLEMENTAL_SUFFIX + ".json"):
+            if exact in self.names:
+                return exact, [exact]
+        for key in media_keys(filename):
+            candidates = self.by_key.get(key)
+            if candidates:
+                return candidates[0], candidates
+        return None, []
+
+
+class SidecarReport:
+    """Collects media files without a sidecar and ambiguous matches."""
+
+    def __init__(self):
+        self.unmatched = []
+        self.ambiguous = []
+
+    def write(self, report_path):
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(f"# Files without JSON sidecar: {len(self.unmatched)}\n")
+            for file_path in self.unmatched:
+                f.write(f"UNMATCHED\t{file_path}\n")
+            f.write(f"# Ambiguous sidecar matches (first candidate used): {len(self.ambiguous)}\n")
+            for file_path, candidates in self.ambiguous:
+                f.write(f"AMBIGUOUS\t{file_path}\t{' | '.join(candidates)}\n")
@@ -0,0 +1,90 @@
+import glob
+import time
+import tarfile
+import zipfile
+
+ARCHIVE_PATTERNS = ["takeout-*.zip", "takeout-*.tgz", "takeout-*.tar.gz"]
+
+
+def find_archives():
+    """Returns the takeout archives of the current directory, in name order."""
+    archives = set()
+    for pattern in ARCHIVE_PATTERNS:
+        archives.update(glob.glob(pattern))
+    return sorted(archives)
+
+
+def split_photos_member(name):
+    """
+    Returns (album, filename) for a 'Takeout/Google Photos/<album>/<file>' member,
+    or None for anything else (other Google products, nested folders, directories),
+    and for names with an empty, "." or ".." part, which could point outside the album.
+    """
+    parts = name.replace("\\", "/").strip("/").split("/")
+    if len(parts) != 4 or parts[0] != "Takeout":
+        return None
+    if any(part in ("", ".", "..") for part in parts):
+        return None
+    # Same loose match as for extracted folders (non-breaking spaces, localized names)
+    if not ("Google" in parts[1] and "Photos" in parts[1]):
+        return None
+    return parts[2], parts[3]
+
+
+def member_name(info):
+    """Returns the name of a zip member, fixing UTF-8 names stored without the UTF-8 flag."""
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("utf-8")
+    except UnicodeError:
+        return info.filename
+
+
+def iter_photo_members(archive_path):
+    """
+    Yields (album, filename, mtime, fileobj) for every Google Photos file of an archive.
+    Zip files are read from their central directory, tar files as a single stream.
+    fileobj is only valid until the next item is requested.
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                location = split_photos_member(member_name(info))
+                if not location:
+                    continue
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                with zf.open(info) as fileobj:
+                    yield location[0], location[1], mtime, fileobj
+    else:
+        # "r|*" streams the archive without seeking, compressed or not
+        with tarfile.open(archive_path, "r|*") as tf:
+            for member in tf:
+                if not member.isfile():
+                    continue
+                location = split_photos_member(member.name)
+                if not location:
+                    continue
+                fileobj = tf.extractfile(member)
+                yield location[0], location[1], member.mtime, fileobj
+
+
+def list_photo_members(archive_path):
+    """
+    Returns the (album, filename) of every Google Photos file of an archive without reading them.
+    Free for zip files; a tar file has to be read through once.
+    """
+    locations = []
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as zf:
+            names = [member_name(info) for info in zf.infolist() if not info.is_dir()]
+    else:
+        with tarfile.open(archive_path, "r|*") as tf:
+            names = [member.name for member in tf if member.isfile()]
+    for name in names:
+        location = split_photos_member(name)
+        if location:
+            locations.append(location)
+    return locations
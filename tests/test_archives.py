@@ -0,0 +1,61 @@
+import os
+import sys
+import zipfile
+import tempfile
+import unittest
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from takeout_archives import split_photos_member
+
+# Runs stage 1 on the takeout archives of the current directory, in a fresh process
+ARCHIVE_RUNNER = """
+import sys, importlib
+sys.path.insert(0, sys.argv[1])
+stage = importlib.import_module("1_organize_photos")
+stage.organize_from_archives(workers=1)
+"""
+
+
+class SplitPhotosMemberTest(unittest.TestCase):
+
+    def test_album_file(self):
+        self.assertEqual(split_photos_member("Takeout/Google Photos/Vacances/IMG_0001.JPG"),
+                         ("Vacances", "IMG_0001.JPG"))
+        self.assertEqual(split_photos_member("Takeout\\Google Photos\\Vacances\\IMG_0001.JPG"),
+                         ("Vacances", "IMG_0001.JPG"))
+
+    def test_other_members(self):
+        self.assertIsNone(split_photos_member("Takeout/Google Photos/IMG_0001.JPG"))
+        self.assertIsNone(split_photos_member("Takeout/Google Photos/Vacances/Sub/IMG_0001.JPG"))
+        self.assertIsNone(split_photos_member("Takeout/Drive/Vacances/IMG_0001.JPG"))
+
+    def test_traversal(self):
+        for name in ("Takeout/Google Photos/../evil.txt",
+                     "Takeout/Google Photos/./evil.txt",
+                     "Takeout/Google Photos/Vacances/..",
+                     "Takeout/Google Photos//evil.txt",
+                     "Takeout/Google Photos/../../evil.txt"):
+            self.assertIsNone(split_photos_member(name), name)
+
+
+class ArchiveIngestTest(unittest.TestCase):
+
+    def test_members_outside_albums_are_not_written(self):
+        with tempfile.TemporaryDirectory() as root:
+            with zipfile.ZipFile(os.path.join(root, "takeout-001.zip"), "w") as zf:
+                zf.writestr("Takeout/Google Photos/Vacances/IMG_0001.JPG", b"photo")
+                zf.writestr("Takeout/Google Photos/../evil.txt", b"evil")
+                zf.writestr("Takeout/Google Photos/./evil.txt", b"evil")
+            subprocess.run([sys.executable, "-c", ARCHIVE_RUNNER, REPO_DIR], cwd=root, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            written = sorted(os.path.relpath(os.path.join(dirpath, filename), root)
+                             for dirpath, _, filenames in os.walk(root) for filename in filenames
+                             if not filename.endswith((".zip", ".txt", ".jsonl", ".sqlite")) or filename == "evil.txt")
+            self.assertEqual(written, [os.path.join("Unified_photos", "Vacances", "IMG_0001.JPG")])
+
+
+if __name__ == "__main__":
+    unittest.main()
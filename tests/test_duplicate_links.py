@@ -0,0 +1,78 @@
+import os
+import sys
+import errno
+import tempfile
+import unittest
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from file_links import link_duplicate
+from hash_cache import HashCache
+
+# Runs stage 4 in the current directory, in a fresh process, with the link mode of argv[2] ("" deletes)
+STAGE_4_RUNNER = """
+import sys, importlib
+sys.path.insert(0, sys.argv[1])
+stage = importlib.import_module("4_final_cleanup")
+stage.final_cleanup(workers=1, link=sys.argv[2] or None)
+"""
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def run_stage_4(root, link=""):
+    subprocess.run([sys.executable, "-c", STAGE_4_RUNNER, REPO_DIR, link], cwd=root, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class DuplicateLinksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.kept = os.path.join(self.root, "Unified_photos", "Photos de 2015", "IMG_0001.JPG")
+        self.copy = os.path.join(self.root, "Unified_photos", "Vacances", "IMG_0001.JPG")
+        write(self.kept, b"photo" * 1000)
+        write(self.copy, b"photo" * 1000)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_delete_mode_deletes_the_copy(self):
+        run_stage_4(self.root)
+        self.assertTrue(os.path.exists(self.kept))
+        self.assertFalse(os.path.exists(self.copy))
+
+    def test_links_survive_a_normal_run(self):
+        run_stage_4(self.root, "hardlink")
+        self.assertTrue(os.path.samefile(self.kept, self.copy))
+        run_stage_4(self.root)
+        self.assertTrue(os.path.exists(self.copy))
+        self.assertTrue(os.path.samefile(self.kept, self.copy))
+
+    def test_changed_copy_is_not_linked(self):
+        hashed = (os.stat(self.copy), os.stat(self.kept))
+        os.utime(self.copy, ns=(hashed[0].st_atime_ns, hashed[0].st_mtime_ns + 1_000_000_000))
+        with self.assertRaises(OSError) as raised:
+            link_duplicate(self.kept, self.copy, hashed[0].st_size, hashed=hashed)
+        self.assertEqual(raised.exception.errno, errno.ESTALE)
+        self.assertFalse(os.path.samefile(self.kept, self.copy))
+
+    def test_clones_are_recorded(self):
+        with HashCache(os.path.join(self.root, "hash_cache.sqlite")) as cache:
+            stats, kept_stats = os.stat(self.copy), os.stat(self.kept)
+            self.assertFalse(cache.is_clone(self.copy, stats, self.kept, kept_stats))
+            cache.store_clone(self.copy, stats, self.kept, kept_stats)
+            self.assertTrue(cache.is_clone(self.copy, stats, self.kept, kept_stats))
+            write(self.copy, b"edited")
+            self.assertFalse(cache.is_clone(self.copy, os.stat(self.copy), self.kept, kept_stats))
+
+
+if __name__ == "__main__":
+    unittest.main()
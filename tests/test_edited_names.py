@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+import unicodedata
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from edited_names import edited_original, name_key
+
+# Runs stage 2 in the current directory, in a fresh process
+STAGE_2_RUNNER = """
+import sys, importlib
+sys.path.insert(0, sys.argv[1])
+stage = importlib.import_module("2_cleanup_modified")
+stage.cleanup_modified_files()
+"""
+
+
+def nfc(name):
+    return unicodedata.normalize("NFC", name)
+
+
+def nfd(name):
+    return unicodedata.normalize("NFD", name)
+
+
+class EditedOriginalTest(unittest.TestCase):
+
+    def test_suffixes(self):
+        self.assertEqual(edited_original("IMG_0001-edited.JPG"), "IMG_0001.JPG")
+        self.assertEqual(edited_original("IMG_0001-EDITED.jpg"), "IMG_0001.jpg")
+        self.assertEqual(edited_original("IMG_0001-bearbeitet.HEIC"), "IMG_0001.HEIC")
+
+    def test_both_unicode_forms(self):
+        self.assertEqual(edited_original(nfc("IMG_0001-modifié.jpg")), "IMG_0001.jpg")
+        self.assertEqual(edited_original(nfd("IMG_0001-modifié.jpg")), "IMG_0001.jpg")
+        self.assertEqual(edited_original(nfd("Été-modifié.jpg")), nfd("Été.jpg"))
+        self.assertEqual(name_key(nfd("Été.jpg")), name_key(nfc("Été.jpg")))
+
+    def test_not_edited(self):
+        self.assertIsNone(edited_original("IMG_0001.JPG"))
+        # Only right before the extension, and not the whole name
+        self.assertIsNone(edited_original("IMG-edited_0001.JPG"))
+        self.assertIsNone(edited_original("-edited.JPG"))
+
+
+class CleanupModifiedTest(unittest.TestCase):
+
+    def test_edited_versions_replace_originals(self):
+        with tempfile.TemporaryDirectory() as root:
+            album = os.path.join(root, "Unified_photos", "Vacances")
+            os.makedirs(album)
+            files = {
+                # Original stored decomposed, edited copy composed
+                nfd("Été.jpg"): b"original",
+                nfc("Été-modifié.jpg"): b"edited",
+                # Original missing
+                "IMG_0002-edited.JPG": b"edited 2",
+                "IMG_0003.JPG": b"untouched",
+            }
+            for filename, data in files.items():
+                with open(os.path.join(album, filename), "wb") as f:
+                    f.write(data)
+
+            subprocess.run([sys.executable, "-c", STAGE_2_RUNNER, REPO_DIR], cwd=root, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            self.assertEqual(sorted(os.listdir(album)), sorted([nfd("Été.jpg"), "IMG_0002.JPG", "IMG_0003.JPG"]))
+            with open(os.path.join(album, nfd("Été.jpg")), "rb") as f:
+                self.assertEqual(f.read(), b"edited")
+            with open(os.path.join(album, "IMG_0002.JPG"), "rb") as f:
+                self.assertEqual(f.read(), b"edited 2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import sys
+import time
+import struct
+import calendar
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from embedded_dates import (embedded_date, MP4_EPOCH_OFFSET, EXIF_IFD_POINTER, DATETIME,
+                            DATETIME_ORIGINAL, OFFSET_TIME_ORIGINAL)
+
+TAKEN = "2015:07:14 10:30:00"
+TAKEN_UTC = calendar.timegm((2015, 7, 14, 10, 30, 0))
+
+
+def tiff_block(ifd0_tags, exif_tags=None, endian="<"):
+    """
+    A TIFF header and its IFDs with the given ASCII tags ({tag: text}), and an EXIF IFD
+    when exif_tags is given. Values longer than 4 bytes follow the IFDs.
+    """
+    ifds = [dict(ifd0_tags)]
+    if exif_tags is not None:
+        ifds.append(dict(exif_tags))
+        # Placeholder, the pointer value is set once the offsets are known
+        ifds[0][EXIF_IFD_POINTER] = None
+    ifd_offsets = []
+    offset = 8
+    for tags in ifds:
+        ifd_offsets.append(offset)
+        offset += 2 + 12 * len(tags) + 4
+    values = b""
+    data = (b"II*\x00" if endian == "<" else b"MM\x00*") + struct.pack(endian + "I", 8)
+    for tags in ifds:
+        data += struct.pack(endian + "H", len(tags))
+        for tag in sorted(tags):
+            if tags[tag] is None:
+                data += struct.pack(endian + "HHII", tag, 4, 1, ifd_offsets[1])
+                continue
+            text = tags[tag].encode("ascii") + b"\x00"
+            if len(text) <= 4:
+                data += struct.pack(endian + "HHI", tag, 2, len(text)) + text.ljust(4, b"\x00")
+            else:
+                data += struct.pack(endian + "HHII", tag, 2, len(text), offset + len(values))
+                values += text
+        data += struct.pack(endian + "I", 0)
+    return data + values
+
+
+def jpeg(tiff):
+    app1 = b"Exif\x00\x00" + tiff
+    # A JFIF segment first, as most cameras write
+    jfif = b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00"
+    return (b"\xff\xd8" + b"\xff\xe0" + struct.pack(">H", 2 + len(jfif)) + jfif
+            + b"\xff\xe1" + struct.pack(">H", 2 + len(app1)) + app1 + b"\xff\xda" + b"\x00" * 64)
+
+
+def box(kind, payload):
+    return struct.pack(">I", 8 + len(payload)) + kind + payload
+
+
+def mp4(created, version=0):
+    if version == 1:
+        mvhd = b"\x01\x00\x00\x00" + struct.pack(">QQIQ", created, created, 1000, 0)
+    else:
+        mvhd = b"\x00\x00\x00\x00" + struct.pack(">IIII", created, created, 1000, 0)
+    return (box(b"ftyp", b"isom\x00\x00\x02\x00") + box(b"mdat", b"\x00" * 4096)
+            + box(b"moov", box(b"mvhd", mvhd + b"\x00" * 80)))
+
+
+def heic(tiff):
+    """A HEIC with an image item (1) and the Exif item (2), located by "iloc" in the "mdat" box."""
+    def infe(item_id, item_type):
+        return box(b"infe", b"\x02\x00\x00\x00" + struct.pack(">HH", item_id, 0) + item_type + b"\x00")
+
+    def meta(exif_offset):
+        iinf = box(b"iinf", b"\x00\x00\x00\x00" + struct.pack(">H", 2) + infe(1, b"hvc1") + infe(2, b"Exif"))
+        # Version 0, 4-byte offsets and lengths, no base offset
+        iloc = box(b"iloc", b"\x00\x00\x00\x00" + struct.pack(">HH", 0x4400, 2)
+                   + struct.pack(">HHHII", 1, 0, 1, 0, 16)
+                   + struct.pack(">HHHII", 2, 0, 1, exif_offset, len(item)))
+        return box(b"meta", b"\x00\x00\x00\x00" + box(b"hdlr", b"\x00" * 24) + iinf + iloc)
+
+    ftyp = box(b"ftyp", b"heic\x00\x00\x00\x00mif1heic")
+    # The item starts with the offset of the TIFF header after its first 4 bytes
+    item = struct.pack(">I", 6) + b"Exif\x00\x00" + tiff
+    exif_offset = len(ftyp) + len(meta(0)) + 8 + 16
+    return ftyp + meta(exif_offset) + box(b"mdat", b"\x00" * 16 + item)
+
+
+class EmbeddedDateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def date_of(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return embedded_date(path)
+
+    def test_jpeg_exif_with_offset(self):
+        tiff = tiff_block({DATETIME: "2001:01:01 00:00:00"},
+                          {DATETIME_ORIGINAL: TAKEN, OFFSET_TIME_ORIGINAL: "+02:00"})
+        self.assertEqual(self.date_of("IMG_0001.JPG", jpeg(tiff)), TAKEN_UTC - 2 * 3600)
+
+    def test_jpeg_without_original_date_uses_local_datetime(self):
+        tiff = tiff_block({DATETIME: TAKEN}, {}, endian=">")
+        self.assertEqual(self.date_of("IMG_0002.jpeg", jpeg(tiff)),
+                         time.mktime(time.strptime(TAKEN, "%Y:%m:%d %H:%M:%S")))
+
+    def test_blank_date_is_ignored(self):
+        tiff = tiff_block({}, {DATETIME_ORIGINAL: "    :  :     :  :  "})
+        self.assertIsNone(self.date_of("IMG_0003.JPG", jpeg(tiff)))
+
+    def test_tiff(self):
+        tiff = tiff_block({}, {DATETIME_ORIGINAL: TAKEN, OFFSET_TIME_ORIGINAL: "-05:00"}, endian=">")
+        self.assertEqual(self.date_of("scan.tif", tiff), TAKEN_UTC + 5 * 3600)
+
+    def test_heic_exif_item(self):
+        tiff = tiff_block({}, {DATETIME_ORIGINAL: TAKEN, OFFSET_TIME_ORIGINAL: "+00:00"})
+        self.assertEqual(self.date_of("IMG_0004.HEIC", heic(tiff)), TAKEN_UTC)
+
+    def test_mp4_creation_time(self):
+        self.assertEqual(self.date_of("VID_0001.mp4", mp4(TAKEN_UTC + MP4_EPOCH_OFFSET)), TAKEN_UTC)
+        self.assertEqual(self.date_of("VID_0002.MOV", mp4(TAKEN_UTC + MP4_EPOCH_OFFSET, version=1)), TAKEN_UTC)
+        # 0 means "not set"
+        self.assertIsNone(self.date_of("VID_0003.mp4", mp4(0)))
+
+    def test_truncated_and_unknown_files(self):
+        tiff = tiff_block({}, {DATETIME_ORIGINAL: TAKEN})
+        self.assertIsNone(self.date_of("IMG_0005.JPG", jpeg(tiff)[:40]))
+        self.assertIsNone(self.date_of("VID_0004.mp4", mp4(TAKEN_UTC + MP4_EPOCH_OFFSET)[:4140]))
+        self.assertIsNone(self.date_of("notes.txt", jpeg(tiff)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from inventory import Inventory
+
+
+def write(path, data=b"photo"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class EmptyDirsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "Unified_photos")
+        write(self.path("Vacances", "Plage", "IMG_0001.JPG"))
+        write(self.path("Vacances", "Plage", "IMG_0002.JPG"))
+        write(self.path("Vacances", "Montagne", "IMG_0003.JPG"))
+        write(self.path("Photos de 2015", "IMG_0004.JPG"))
+        os.makedirs(self.path("Vide", "Sous-dossier"))
+        self.inventory = Inventory.scan(self.root)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def test_folders_empty_at_scan(self):
+        self.assertEqual(self.inventory.empty_dirs(), [self.path("Vide", "Sous-dossier"), self.path("Vide")])
+
+    def test_planned_removals(self):
+        removed = [self.path("Vacances", "Plage", "IMG_0001.JPG"), self.path("Vacances", "Plage", "IMG_0002.JPG")]
+        self.assertEqual(set(self.inventory.empty_dirs(removed)),
+                         {self.path("Vacances", "Plage"), self.path("Vide", "Sous-dossier"), self.path("Vide")})
+        # Nothing was changed: the folder still counts its files
+        self.assertTrue(self.inventory.has_file(removed[0]))
+
+    def test_parents_emptied_with_their_subfolders(self):
+        for path in (self.path("Vacances", "Plage", "IMG_0001.JPG"), self.path("Vacances", "Plage", "IMG_0002.JPG"),
+                     self.path("Vacances", "Montagne", "IMG_0003.JPG")):
+            self.inventory.discard(path)
+        empty = self.inventory.empty_dirs()
+        self.assertEqual(set(empty), {self.path("Vacances", "Plage"), self.path("Vacances", "Montagne"),
+                                      self.path("Vacances"), self.path("Vide", "Sous-dossier"), self.path("Vide")})
+        # Deepest first, so each folder can be removed in order
+        self.assertLess(empty.index(self.path("Vacances", "Plage")), empty.index(self.path("Vacances")))
+        self.assertNotIn(self.root, empty)
+
+    def test_moved_in_and_removed_folders(self):
+        self.inventory.renamed(self.path("Photos de 2015", "IMG_0004.JPG"), self.path("Vide", "IMG_0004.JPG"))
+        self.assertEqual(set(self.inventory.empty_dirs()),
+                         {self.path("Photos de 2015"), self.path("Vide", "Sous-dossier")})
+        self.inventory.discard_dir(self.path("Vide", "Sous-dossier"))
+        self.assertEqual(self.inventory.empty_dirs(), [self.path("Photos de 2015")])
+
+
+if __name__ == "__main__":
+    unittest.main()
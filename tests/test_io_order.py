@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import io_order
+
+
+class DiskOrderTest(unittest.TestCase):
+
+    def test_missing_files_go_last_in_given_order(self):
+        with tempfile.TemporaryDirectory() as root:
+            paths = [os.path.join(root, name) for name in ("a", "gone-1", "b", "gone-2")]
+            for path in (paths[0], paths[2]):
+                with open(path, "wb") as f:
+                    f.write(b"data")
+            ordered = io_order.disk_order(paths, lambda path: (path, None), mode="hdd")
+            self.assertEqual(sorted(ordered[:2]), sorted([paths[0], paths[2]]))
+            self.assertEqual(ordered[2:], [paths[1], paths[3]])
+
+    def test_ssd_mode_keeps_the_order(self):
+        paths = ["/nonexistent/b", "/nonexistent/a"]
+        self.assertEqual(io_order.disk_order(paths, lambda path: (path, None), mode="ssd"), paths)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from move_journal import MoveJournal
+
+# Reverts the filter of the current directory, in a fresh process
+REVERT_RUNNER = """
+import sys, importlib
+sys.path.insert(0, sys.argv[1])
+stage = importlib.import_module("6_revert_filter")
+stage.revert_filter()
+"""
+
+
+def write(path, data=b"photo"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def write_journal(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+class MoveJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.src_root = os.path.join(self.tmp.name, "Unified_photos")
+        self.dst_root = os.path.join(self.tmp.name, "_Excluded_by_Date")
+        self.journal_path = os.path.join(self.tmp.name, "filter_journal.jsonl")
+        self.names = [os.path.join("Vacances", f"IMG_{i:04d}.JPG") for i in range(3)]
+        for rel_path in self.names:
+            write(os.path.join(self.src_root, rel_path))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def journal(self, batch_size=2):
+        return MoveJournal(self.journal_path, self.src_root, self.dst_root, batch_size=batch_size)
+
+    def assertAt(self, root, rel_path):
+        self.assertTrue(os.path.exists(os.path.join(root, rel_path)), rel_path)
+        other = self.dst_root if root == self.src_root else self.src_root
+        self.assertFalse(os.path.exists(os.path.join(other, rel_path)), rel_path)
+
+    def test_moves_run_by_batch(self):
+        journal = self.journal()
+        self.assertEqual(journal.add(self.names[0]), [])
+        self.assertEqual(journal.add(self.names[1]), [(self.names[0], None), (self.names[1], None)])
+        journal.add(self.names[2])
+        # Still pending until the journal is flushed or closed
+        self.assertAt(self.src_root, self.names[2])
+        journal.close()
+        for rel_path in self.names:
+            self.assertAt(self.dst_root, rel_path)
+        self.assertEqual(self.journal().moved_paths(), self.names)
+
+    def test_reverted_moves_are_forgotten(self):
+        journal = self.journal()
+        for rel_path in self.names:
+            journal.add(rel_path)
+        journal.flush()
+        journal.add(self.names[1], op="revert")
+        journal.close()
+        self.assertAt(self.src_root, self.names[1])
+        self.assertAt(self.dst_root, self.names[0])
+        self.assertEqual(self.journal().moved_paths(), [self.names[0], self.names[2]])
+
+    def test_recover_completes_the_interrupted_batch(self):
+        # Crashed after journaling a batch of three and moving only the first file;
+        # the last record was cut in the middle of the line
+        write_journal(self.journal_path, [{"op": "move", "path": rel_path} for rel_path in self.names])
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write('{"op": "mo')
+        write(os.path.join(self.dst_root, self.names[0]))
+        os.remove(os.path.join(self.src_root, self.names[0]))
+
+        journal = self.journal()
+        self.assertEqual(journal.recover(), 2)
+        journal.close()
+        for rel_path in self.names:
+            self.assertAt(self.dst_root, rel_path)
+        # The batch is committed, a second recovery has nothing to do
+        self.assertEqual(self.journal().recover(), 0)
+
+    def test_recover_completes_an_interrupted_revert(self):
+        journal = self.journal()
+        for rel_path in self.names:
+            journal.add(rel_path)
+        journal.close()
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "revert", "path": self.names[0]}) + "\n")
+
+        journal = self.journal()
+        self.assertEqual(journal.recover(), 1)
+        journal.close()
+        self.assertAt(self.src_root, self.names[0])
+        self.assertEqual(self.journal().moved_paths(), self.names[1:])
+
+
+class RevertFromJournalTest(unittest.TestCase):
+
+    def test_only_journaled_moves_are_reverted(self):
+        with tempfile.TemporaryDirectory() as root:
+            target = os.path.join(root, "Unified_photos")
+            excluded = os.path.join(root, "_Excluded_by_Date")
+            journal_path = os.path.join(root, "filter_journal.jsonl")
+            moved = os.path.join("Photos de 2015", "IMG_0001.JPG")
+            deleted = os.path.join("Photos de 2015", "IMG_0002.JPG")
+            by_hand = os.path.join("Vacances", "IMG_0003.JPG")
+            os.makedirs(target)
+            write(os.path.join(excluded, moved))
+            write(os.path.join(excluded, by_hand))
+            # IMG_0002.JPG was deleted from the exclusion folder since the filter ran
+            write_journal(journal_path, [{"op": "move", "path": moved}, {"op": "move", "path": deleted},
+                                         {"op": "commit"}])
+
+            subprocess.run([sys.executable, "-c", REVERT_RUNNER, REPO_DIR], cwd=root, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            self.assertTrue(os.path.exists(os.path.join(target, moved)))
+            self.assertFalse(os.path.exists(os.path.join(excluded, "Photos de 2015")))
+            self.assertFalse(os.path.exists(os.path.join(target, deleted)))
+            self.assertTrue(os.path.exists(os.path.join(excluded, by_hand)))
+            self.assertFalse(os.path.exists(os.path.join(target, by_hand)))
+            self.assertFalse(os.path.exists(journal_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+import unittest
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs stage 3 in a fresh process; with a crash count, the process dies (no cleanup at all)
+# when the catalog is about to record one more file than that
+STAGE_3_RUNNER = """
+import os, sys, importlib
+sys.path.insert(0, sys.argv[1])
+stage = importlib.import_module("3_update_metadata")
+crash_after = int(sys.argv[2])
+if crash_after:
+    record = stage.MediaCatalog.record
+    calls = [0]
+    def crashing_record(self, *args):
+        calls[0] += 1
+        if calls[0] > crash_after:
+            os._exit(1)
+        record(self, *args)
+    stage.MediaCatalog.record = crashing_record
+stage.run_stage(stage.STAGE, stage.main, workers=1)
+"""
+
+MEDIA_FILES = 1184
+
+
+def make_tree(root):
+    album = os.path.join(root, "Unified_photos", "Photos de 2015")
+    os.makedirs(album)
+    for i in range(MEDIA_FILES):
+        name = f"IMG_{i:04d}.JPG"
+        with open(os.path.join(album, name), "wb") as f:
+            f.write(b"photo")
+        # Every other file has no sidecar
+        if i % 2 == 0:
+            with open(os.path.join(album, name + ".json"), "w", encoding="utf-8") as f:
+                json.dump({"photoTakenTime": {"timestamp": str(1433657350 + i)}}, f)
+
+
+def run_stage_3(root, crash_after=0):
+    return subprocess.run([sys.executable, "-c", STAGE_3_RUNNER, REPO_DIR, str(crash_after)], cwd=root,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+
+def count_rows(db_path, query):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(query).fetchone()[0]
+    finally:
+        conn.close()
+
+
+class CrashResumeTest(unittest.TestCase):
+
+    def test_catalog_has_every_file_after_crash_and_resume(self):
+        with tempfile.TemporaryDirectory() as root:
+            make_tree(root)
+            catalog_path = os.path.join(root, "media_catalog.sqlite")
+            state_path = os.path.join(root, "pipeline_state.sqlite")
+
+            self.assertNotEqual(run_stage_3(root, crash_after=700), 0)
+            checkpoints = count_rows(state_path, "SELECT COUNT(*) FROM checkpoints")
+            self.assertGreater(checkpoints, 0)
+            # Every file checkpointed as done has its row in the catalog
+            self.assertGreaterEqual(count_rows(catalog_path, "SELECT COUNT(*) FROM media"), checkpoints)
+
+            self.assertEqual(run_stage_3(root), 0)
+            self.assertEqual(count_rows(catalog_path, "SELECT COUNT(*) FROM media"), MEDIA_FILES)
+            self.assertEqual(count_rows(catalog_path, "SELECT COUNT(*) FROM media WHERE taken_time IS NOT NULL"),
+                             MEDIA_FILES // 2)
+
+    def test_stage_without_its_folder_is_not_completed(self):
+        with tempfile.TemporaryDirectory() as root:
+            self.assertEqual(run_stage_3(root), 0)
+            state_path = os.path.join(root, "pipeline_state.sqlite")
+            self.assertEqual(count_rows(state_path, "SELECT COUNT(*) FROM stages"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from sidecar_index import SidecarIndex, sidecar_key
+
+# Cut to 46 characters by the export, with the end of the extension
+LONG_NAME = "PXL_20150714_103000123_Vacances_a_la_montagn.jpg"
+
+
+class SidecarKeyTest(unittest.TestCase):
+
+    def test_keys(self):
+        self.assertEqual(sidecar_key("IMG_0001.JPG.json"), ("IMG_0001.JPG", None))
+        self.assertEqual(sidecar_key("IMG_0001.JPG.supplemental-metadata.json"), ("IMG_0001.JPG", None))
+        self.assertEqual(sidecar_key("IMG_0001.JPG.supplemen.json"), ("IMG_0001.JPG", None))
+        self.assertEqual(sidecar_key("IMG_0001.JPG.supplemental-metadata(2).json"), ("IMG_0001.JPG", "2"))
+        self.assertEqual(sidecar_key(LONG_NAME[:46] + ".json"), (LONG_NAME[:46], None))
+
+
+class SidecarIndexTest(unittest.TestCase):
+
+    def test_exact_names(self):
+        index = SidecarIndex(["IMG_0001.JPG", "IMG_0001.JPG.json", "IMG_0002.JPG",
+                              "IMG_0002.JPG.supplemental-metadata.json"])
+        self.assertEqual(index.lookup("IMG_0001.JPG"), ("IMG_0001.JPG.json", ["IMG_0001.JPG.json"]))
+        self.assertEqual(index.lookup("IMG_0002.JPG")[0], "IMG_0002.JPG.supplemental-metadata.json")
+
+    def test_truncated_sidecars(self):
+        sidecar = (LONG_NAME + ".supplemental-metadata")[:46] + ".json"
+        index = SidecarIndex([LONG_NAME, sidecar, "IMG_0003.JPG", "IMG_0003.JPG.supplemental-me.json"])
+        self.assertEqual(index.lookup(LONG_NAME), (sidecar, [sidecar]))
+        self.assertEqual(index.lookup("IMG_0003.JPG")[0], "IMG_0003.JPG.supplemental-me.json")
+
+    def test_numbered_duplicates(self):
+        names = ["IMG_0001.JPG", "IMG_0001(1).JPG", "IMG_0001.JPG.supplemental-metadata.json",
+                 "IMG_0001.JPG.supplemental-metadata(1).json"]
+        index = SidecarIndex(names)
+        self.assertEqual(index.lookup("IMG_0001.JPG")[0], "IMG_0001.JPG.supplemental-metadata.json")
+        self.assertEqual(index.lookup("IMG_0001(1).JPG")[0], "IMG_0001.JPG.supplemental-metadata(1).json")
+        # No "(2)" sidecar: never the one of another copy
+        self.assertEqual(index.lookup("IMG_0001(2).JPG"), (None, []))
+
+    def test_stem_only_sidecar(self):
+        index = SidecarIndex(["IMG_0004.MP4", "IMG_0004.json"])
+        self.assertEqual(index.lookup("IMG_0004.MP4")[0], "IMG_0004.json")
+
+    def test_ambiguous_match_uses_the_first_candidate(self):
+        index = SidecarIndex(["IMG_0005.JPG", "IMG_0005.JPG.supplemental-met.json", "IMG_0005.JPG.suppl.json"])
+        self.assertEqual(index.lookup("IMG_0005.JPG"),
+                         ("IMG_0005.JPG.suppl.json", ["IMG_0005.JPG.suppl.json", "IMG_0005.JPG.supplemental-met.json"]))
+
+    def test_no_sidecar(self):
+        index = SidecarIndex(["IMG_0006.JPG", "IMG_0007.JPG.json"])
+        self.assertEqual(index.lookup("IMG_0006.JPG"), (None, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import sys
+import logging
+
+# Mapping of the Google sidecar fields to file timestamps:
+#
+#   backend   creationTime             modificationTime   photoTakenTime
+#   windows   creation date            modification date  access date
+#   posix     birth time (macOS only)  mtime              atime
+#
+# Linux has no call to set the birth time and the inode change time (st_ctime) is always
+# "now", so there creationTime is only used as a fallback for the other two fields.
+# On macOS, setting mtime earlier than the birth time also moves the birth time back,
+# which is used to store creationTime.
+
+BACKENDS = ("auto", "windows", "posix")
+
+
+def to_ns(ts):
+    return int(round(ts * 1_000_000_000))
+
+
+class WindowsBackend:
+    """Sets creation, access and write times with SetFileTime."""
+
+    name = "windows"
+
+    def __init__(self):
+        from ctypes import windll, Structure, byref
+        from ctypes.wintypes import DWORD
+
+        class FILETIME(Structure):
+            _fields_ = [("dwLowDateTime", DWORD),
+                        ("dwHighDateTime", DWORD)]
+
+        self.kernel32 = windll.kernel32
+        self.byref = byref
+        self.FILETIME = FILETIME
+
+    def to_ft(self, ts):
+        if not ts:
+            return None
+        # Windows FileTime counts 100-nanosecond intervals since Jan 1, 1601
+        # Unix epoch (Jan 1 1970) is 116444736000000000 intervals after Windows epoch
+        ticks = int((ts * 10000000) + 116444736000000000)
+        ft = self.FILETIME()
+        ft.dwLowDateTime = ticks & 0xFFFFFFFF
+        ft.dwHighDateTime = ticks >> 32
+        return ft
+
+    def open_dir(self, dirpath):
+        # CreateFileW resolves full paths, there is nothing to keep open per folder
+        return None
+
+    def close_dir(self, dir_fd):
+        pass
+
+    def apply(self, file_path, ts_creation, ts_modification, ts_taken, dir_fd=None):
+        """Returns False if the file could not be opened. Missing timestamps are left unchanged."""
+        ft_creation = self.to_ft(ts_creation)
+        ft_modification = self.to_ft(ts_modification)
+        ft_taken = self.to_ft(ts_taken)
+
+        # 256 = FILE_WRITE_ATTRIBUTES, 3 = OPEN_EXISTING, 128 = FILE_ATTRIBUTE_NORMAL
+        handle = self.kernel32.CreateFileW(file_path, 256, 0, None, 3, 128, None)
+        if handle == -1:
+            logging.warning(f"Failed to open file handle for {file_path}")
+            return False
+
+        # SetFileTime(handle, lpCreationTime, lpLastAccessTime, lpLastWriteTime)
+        # Passing None (0 pointer) leaves a time unchanged.
+        self.kernel32.SetFileTime(
+            handle,
+            self.byref(ft_creation) if ft_creation else None,
+            self.byref(ft_taken) if ft_taken else None,
+            self.byref(ft_modification) if ft_modification else None
+        )
+        self.kernel32.CloseHandle(handle)
+        return True
+
+
+class PosixBackend:
+    """
+    Sets access and modification times with nanosecond os.utime.
+    When the platform supports it, calls are made relative to an open
+    folder descriptor so the path of every file is not resolved again.
+    """
+
+    name = "posix"
+
+    def __init__(self):
+        self.use_dir_fd = os.utime in os.supports_dir_fd
+        self.set_birth_time = sys.platform == "darwin"
+
+    def open_dir(self, dirpath):
+        if not self.use_dir_fd:
+            return None
+        try:
+            return os.open(dirpath, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+        except OSError as e:
+            logging.warning(f"Could not open folder {dirpath}, using full paths: {e}")
+            return None
+
+    def close_dir(self, dir_fd):
+        if dir_fd is not None:
+            os.close(dir_fd)
+
+    def apply(self, file_path, ts_creation, ts_modification, ts_taken, dir_fd=None):
+        """Returns False if the file could not be updated. Missing timestamps are left unchanged."""
+        if dir_fd is not None:
+            target = os.path.basename(file_path)
+            kwargs = {"dir_fd": dir_fd}
+        else:
+            target = file_path
+            kwargs = {}
+        try:
+            if ts_taken and ts_modification:
+                atime_ns, mtime_ns = to_ns(ts_taken), to_ns(ts_modification)
+            else:
+                stats = os.stat(target, **kwargs)
+                atime_ns = to_ns(ts_taken) if ts_taken else stats.st_atime_ns
+                mtime_ns = to_ns(ts_modification) if ts_modification else stats.st_mtime_ns
+
+            if self.set_birth_time and ts_creation:
+                # Moves the birth time back to creationTime (only ever lowers it)
+                os.utime(target, ns=(atime_ns, to_ns(ts_creation)), **kwargs)
+            os.utime(target, ns=(atime_ns, mtime_ns), **kwargs)
+            return True
+        except OSError as e:
+            logging.warning(f"Failed to set timestamps for {file_path}: {e}")
+            return False
+
+
+def select_backend(name="auto"):
+    """Returns the timestamp backend for this platform, or the one explicitly requested."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown timestamp backend: {name} (choose from {', '.join(BACKENDS)})")
+    if name == "auto":
+        name = "windows" if os.name == "nt" else "posix"
+    if name == "windows":
+        return WindowsBackend()
+    return PosixBackend()